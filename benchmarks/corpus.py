@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+"""
+================================================================================
+:mod:`corpus` -- Synthetic corpus of tagged MP3 and OGG files
+================================================================================
+
+.. module:: corpus
+   :synopsis: Synthetic corpus of tagged MP3 and OGG files
+
+The audio of the generated files comes from the test data of
+:mod:`musictools`: the MP3 files reuse the frames of ``song.mp3`` and the
+OGG files the first pages of ``song3.ogg``, so that no encoder is needed.
+The tags are random but reproducible from the seed: accented titles,
+several artists, missing fields, tags of various sizes and embedded cover
+art.
+
+"""
+
+# Script information for the file.
+__author__ = "Philippe T. Pinard"
+__email__ = "philippe.pinard@gmail.com"
+__version__ = "0.1"
+__copyright__ = "Copyright (c) 2013 Philippe T. Pinard"
+__license__ = "GPL v3"
+
+# Standard library modules.
+import os
+import io
+import json
+import base64
+import random
+import argparse
+
+# Third party modules.
+import mutagen.id3 as id3
+import mutagen.oggvorbis as ogg
+from mutagen.ogg import OggPage
+from mutagen.flac import Picture
+
+# Local modules.
+from musictools.tagreader import id3_tag_size
+
+# Globals and constants variables.
+TESTDATA_DIR = os.path.join(os.path.dirname(__file__), '..', 'musictools', 'testData')
+
+WORDS = ['world', 'wonderful', 'silence', 'night', 'noël', 'fête', 'été',
+         'hôpital', 'école', 'bière', 'çà', 'straße', 'søndag', 'ärger',
+         'ñandú', 'ÆON', 'café', 'über', 'río', 'œuvre', 'blue', 'live',
+         'AC/DC', "l'amour", 'déjà-vu', '(remix)', 'vol. 2', 'Sigur Rós']
+
+NAMES = ['Louis Armstrong', 'K.D. Lang', 'Tony Bennett', 'Björk',
+         'Édith Piaf', 'Mötley Crüe', 'Sigur Rós', 'Françoise Hardy',
+         'Jean-Michel Jarre', 'Zoë', 'Beyoncé', 'Céline Dion']
+
+GENRES = ['Jazz', 'Rock', 'Pop', 'Électronique', 'Classical', 'Chanson']
+
+DEFAULT_COUNT = 2000
+
+DEFAULT_SEED = 0
+
+MANIFEST_FILENAME = 'corpus.json'
+
+def _mp3_audio():
+    with open(os.path.join(TESTDATA_DIR, 'song.mp3'), 'rb') as fp:
+        id3_tag_size(fp)
+        return fp.read()
+
+def _ogg_audio(pages=3):
+    """
+    Returns the first *pages* pages of ``song3.ogg``, the last one being
+    marked as the end of the stream. The three first pages hold the Vorbis
+    headers and complete audio packets.
+    """
+    buf = io.BytesIO()
+    with open(os.path.join(TESTDATA_DIR, 'song3.ogg'), 'rb') as fp:
+        for i in range(pages):
+            page = OggPage(fp)
+            page.last = i == pages - 1
+            buf.write(page.write())
+    return buf.getvalue()
+
+def _title(rnd):
+    return ' '.join(rnd.choice(WORDS) for _ in range(rnd.randint(1, 6))).capitalize()
+
+def _cover(rnd, size):
+    # Not a valid image, only the size matters
+    return b'\xff\xd8\xff\xe0' + bytes(rnd.getrandbits(8) for _ in range(64)) * (size // 64)
+
+def random_tags(rnd):
+    """
+    Returns a :class:`dict` of random tags. Each field is missing with some
+    probability.
+    """
+    tags = {}
+    if rnd.random() > 0.05:
+        tags['artists'] = rnd.sample(NAMES, rnd.choice([1, 1, 1, 2, 3]))
+    if rnd.random() > 0.05:
+        tags['albumtitle'] = _title(rnd)
+    if rnd.random() > 0.02:
+        tags['title'] = _title(rnd)
+    if rnd.random() > 0.1:
+        tags['tracknumber'] = rnd.randint(1, 25)
+    if rnd.random() > 0.2:
+        tags['year'] = rnd.randint(1950, 2013)
+    if rnd.random() > 0.3:
+        tags['genre'] = rnd.choice(GENRES)
+    if rnd.random() > 0.7:
+        tags['discnumber'] = rnd.randint(1, 3)
+        tags['disctotal'] = 3
+    if rnd.random() > 0.8:
+        # Large tags, e.g. lyrics
+        tags['description'] = _title(rnd) * rnd.randint(10, 500)
+    if rnd.random() > 0.7:
+        tags['cover'] = rnd.choice([4096, 32768, 262144])
+    return tags
+
+def write_mp3(filepath, audio, tags, rnd):
+    tag = id3.ID3()
+    if 'artists' in tags:
+        tag.add(id3.TPE1(encoding=3, text=tags['artists']))
+    if 'albumtitle' in tags:
+        tag.add(id3.TALB(encoding=3, text=tags['albumtitle']))
+    if 'title' in tags:
+        tag.add(id3.TIT2(encoding=3, text=tags['title']))
+    if 'tracknumber' in tags:
+        tag.add(id3.TRCK(encoding=3, text=str(tags['tracknumber'])))
+    if 'year' in tags:
+        tag.add(id3.TYER(encoding=3, text=str(tags['year'])))
+    if 'genre' in tags:
+        tag.add(id3.TCON(encoding=3, text=tags['genre']))
+    if 'discnumber' in tags:
+        tag.add(id3.TPOS(encoding=3, text='%i/%i' % (tags['discnumber'], tags['disctotal'])))
+    if 'description' in tags:
+        tag.add(id3.COMM(encoding=3, lang='eng', desc='', text=tags['description']))
+    if 'cover' in tags:
+        tag.add(id3.APIC(encoding=3, mime='image/jpeg', type=3, desc='Cover',
+                         data=_cover(rnd, tags['cover'])))
+
+    with open(filepath, 'wb') as fp:
+        fp.write(audio)
+    tag.save(filepath, v2_version=rnd.choice([3, 4]),
+             padding=lambda info: rnd.choice([0, 1024, 4096]))
+
+def write_ogg(filepath, audio, tags, rnd):
+    with open(filepath, 'wb') as fp:
+        fp.write(audio)
+
+    ogginfo = ogg.OggVorbis(filepath)
+    ogginfo.tags.clear()
+    if 'artists' in tags:
+        ogginfo['artist'] = tags['artists']
+    if 'albumtitle' in tags:
+        ogginfo['album'] = [tags['albumtitle']]
+    if 'title' in tags:
+        ogginfo['title'] = [tags['title']]
+    if 'tracknumber' in tags:
+        ogginfo['tracknumber'] = [str(tags['tracknumber'])]
+    if 'year' in tags:
+        ogginfo['date'] = [str(tags['year'])]
+    if 'genre' in tags:
+        ogginfo['genre'] = [tags['genre']]
+    if 'discnumber' in tags:
+        ogginfo['discnumber'] = [str(tags['discnumber'])]
+    if 'description' in tags:
+        ogginfo['description'] = [tags['description']]
+    if 'cover' in tags:
+        picture = Picture()
+        picture.type = 3
+        picture.mime = 'image/jpeg'
+        picture.data = _cover(rnd, tags['cover'])
+        ogginfo['metadata_block_picture'] = \
+            [base64.b64encode(picture.write()).decode('ascii')]
+    ogginfo.save(padding=lambda info: rnd.choice([0, 1024, 4096]))
+
+def generate(dirpath, count=DEFAULT_COUNT, seed=DEFAULT_SEED, ogg_ratio=0.3):
+    """
+    Generates *count* files in *dirpath*, spread over subdirectories of 100
+    files, and writes a manifest ``corpus.json``.
+    Returns the manifest.
+
+    :arg ogg_ratio: fraction of OGG files
+    """
+    rnd = random.Random(seed)
+    mp3_audio = _mp3_audio()
+    ogg_audio = _ogg_audio()
+
+    filepaths = []
+    for i in range(count):
+        subdirpath = os.path.join(dirpath, '%03i' % (i // 100))
+        os.makedirs(subdirpath, exist_ok=True)
+
+        tags = random_tags(rnd)
+        if rnd.random() < ogg_ratio:
+            filepath = os.path.join(subdirpath, '%05i.ogg' % i)
+            write_ogg(filepath, ogg_audio, tags, rnd)
+        else:
+            filepath = os.path.join(subdirpath, '%05i.mp3' % i)
+            write_mp3(filepath, mp3_audio, tags, rnd)
+        filepaths.append(os.path.relpath(filepath, dirpath))
+
+    manifest = {'count': count, 'seed': seed, 'ogg_ratio': ogg_ratio,
+                'size': sum(os.path.getsize(os.path.join(dirpath, filepath))
+                            for filepath in filepaths),
+                'files': filepaths}
+    with open(os.path.join(dirpath, MANIFEST_FILENAME), 'w') as fp:
+        json.dump(manifest, fp)
+
+    return manifest
+
+def load(dirpath):
+    """
+    Returns the manifest of the corpus in *dirpath* or ``None``.
+    """
+    try:
+        with open(os.path.join(dirpath, MANIFEST_FILENAME), 'r') as fp:
+            return json.load(fp)
+    except (OSError, ValueError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic corpus of mp3/ogg files')
+    parser.add_argument('-n', '--count', type=int, default=DEFAULT_COUNT,
+                        help='Number of files')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED,
+                        help='Seed of the random tags')
+    parser.add_argument('--ogg-ratio', type=float, default=0.3,
+                        help='Fraction of ogg files')
+    parser.add_argument('dir', help='Output directory')
+
+    args = parser.parse_args()
+
+    manifest = generate(args.dir, args.count, args.seed, args.ogg_ratio)
+    print('{} files, {:.1f} MB'.format(manifest['count'], manifest['size'] / 1e6))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,287 @@
+#!/usr/bin/env python
+"""
+================================================================================
+:mod:`run` -- Run the benchmarks
+================================================================================
+
+.. module:: run
+   :synopsis: Run the benchmarks
+
+Times the reading and saving of tags, the formatting of filenames and the
+renaming of a whole corpus with ``scripts/rename.py`` on a synthetic corpus
+(see :mod:`corpus`). The corpus is generated on the first run and reused
+afterwards. Nothing is downloaded.
+
+The results are saved as JSON; two result files can be compared with
+``--compare``::
+
+    python benchmarks/run.py -o before.json
+    git checkout other-branch
+    python benchmarks/run.py -o after.json --compare before.json
+
+"""
+
+# Script information for the file.
+__author__ = "Philippe T. Pinard"
+__email__ = "philippe.pinard@gmail.com"
+__version__ = "0.1"
+__copyright__ = "Copyright (c) 2013 Philippe T. Pinard"
+__license__ = "GPL v3"
+
+# Standard library modules.
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import platform
+import argparse
+import warnings
+import statistics
+import subprocess
+
+# Third party modules.
+
+# Local modules.
+from musictools.song import Song
+from musictools.utils import slugify, unicode_to_ascii
+from musictools.library import Library
+import corpus
+
+# Globals and constants variables.
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+RENAME_SCRIPT = os.path.join(ROOT_DIR, 'scripts', 'rename.py')
+
+BENCHMARKS = ['read', 'read_lazy', 'save', 'formatted_filename', 'slugify_cold',
+              'slugify_warm', 'unicode_to_ascii', 'library_scan',
+              'rename', 'rename_jobs']
+
+class Benchmark(object):
+
+    def __init__(self, corpusdir, tmpdir, jobs):
+        """
+        Benchmarks on the corpus in *corpusdir*.
+        Each benchmark is a method ``bench_<name>`` called with a timer
+        function: the benchmark prepares its data, then calls the timer with
+        the function to time. Files modified by a benchmark are copies in
+        *tmpdir*.
+        """
+        self.corpusdir = corpusdir
+        self.tmpdir = tmpdir
+        self.jobs = jobs
+
+        manifest = corpus.load(corpusdir)
+        self.filepaths = [os.path.join(corpusdir, filepath)
+                          for filepath in manifest['files']]
+        self.songs = [Song(filepath) for filepath in self.filepaths]
+        self.titles = [song.title for song in self.songs] + \
+                      [song.albumtitle for song in self.songs]
+
+    def _copy(self):
+        dirpath = os.path.join(self.tmpdir, 'copy')
+        shutil.rmtree(dirpath, ignore_errors=True)
+        shutil.copytree(self.corpusdir, dirpath)
+        os.remove(os.path.join(dirpath, corpus.MANIFEST_FILENAME))
+        return dirpath
+
+    def bench_read(self, timer):
+        timer(lambda: [Song(filepath) for filepath in self.filepaths])
+
+    def bench_read_lazy(self, timer):
+        def read():
+            for filepath in self.filepaths:
+                song = Song(filepath, lazy=True)
+                song.artists, song.albumtitle, song.title, song.tracknumber
+        timer(read)
+
+    def bench_save(self, timer):
+        dirpath = self._copy()
+        songs = [Song(os.path.join(dirpath, os.path.relpath(filepath, self.corpusdir)))
+                 for filepath in self.filepaths]
+        for song in songs:
+            song.title += ' (remastered)'
+
+        def save():
+            for song in songs:
+                song.save()
+        timer(save)
+
+    def bench_formatted_filename(self, timer):
+        # Songs without artist have no directory name
+        songs = [song for song in self.songs if song.artists]
+
+        def format():
+            for song in songs:
+                song.formatted_dirname
+                song.formatted_filename
+        slugify.cache_clear()
+        timer(format)
+
+    def bench_slugify_cold(self, timer):
+        def run():
+            slugify.cache_clear()
+            for title in self.titles:
+                slugify(title)
+        timer(run)
+
+    def bench_slugify_warm(self, timer):
+        def run():
+            for title in self.titles:
+                slugify(title)
+        run()
+        timer(run)
+
+    def bench_unicode_to_ascii(self, timer):
+        def run():
+            for title in self.titles:
+                unicode_to_ascii(title)
+        timer(run)
+
+    def bench_library_scan(self, timer):
+        filepath = os.path.join(self.tmpdir, 'index.sqlite')
+        for path in [filepath, filepath + '-wal', filepath + '-shm']:
+            if os.path.exists(path):
+                os.remove(path)
+
+        def scan():
+            with Library(filepath) as library:
+                for _song in library.scan(self.corpusdir):
+                    pass
+        timer(scan)
+
+    def _rename(self, timer, *args):
+        dirpath = self._copy()
+        outdirpath = os.path.join(self.tmpdir, 'renamed')
+        shutil.rmtree(outdirpath, ignore_errors=True)
+
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join([ROOT_DIR, env.get('PYTHONPATH', '')])
+        env['PYTHONWARNINGS'] = 'ignore'
+        cmd = [sys.executable, RENAME_SCRIPT, '-o', outdirpath] + list(args) + [dirpath]
+        timer(lambda: subprocess.check_call(cmd, env=env, stdout=subprocess.DEVNULL))
+
+    def bench_rename(self, timer):
+        self._rename(timer)
+
+    def bench_rename_jobs(self, timer):
+        self._rename(timer, '-j', str(self.jobs))
+
+    def run(self, name, repeat):
+        """
+        Runs the benchmark *name* *repeat* times and returns the timings (in
+        seconds).
+        """
+        times = []
+
+        def timer(func):
+            start = time.perf_counter()
+            func()
+            times.append(time.perf_counter() - start)
+
+        for _ in range(repeat):
+            getattr(self, 'bench_' + name)(timer)
+
+        return times
+
+def _summary(times, count):
+    return {'times': times,
+            'min': min(times),
+            'median': statistics.median(times),
+            'per_file': min(times) / count}
+
+def _version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       cwd=ROOT_DIR, stderr=subprocess.DEVNULL) \
+                         .decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results, baseline, threshold):
+    """
+    Prints the ratio of the median times of *results* and *baseline*.
+    Returns the names of the benchmarks slower than *threshold* times the
+    baseline.
+    """
+    print('{:<20} {:>12} {:>12} {:>8}'.format('benchmark', 'baseline (s)', 'current (s)', 'ratio'))
+    regressions = []
+    for name, result in results['benchmarks'].items():
+        base = baseline['benchmarks'].get(name)
+        if base is None:
+            continue
+        ratio = result['median'] / base['median']
+        print('{:<20} {:>12.4f} {:>12.4f} {:>8.2f}'.format(name, base['median'], result['median'], ratio))
+        if ratio > threshold:
+            regressions.append(name)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the benchmarks')
+    parser.add_argument('-n', '--count', type=int, default=corpus.DEFAULT_COUNT,
+                        help='Number of files in the corpus')
+    parser.add_argument('--seed', type=int, default=corpus.DEFAULT_SEED,
+                        help='Seed of the corpus')
+    parser.add_argument('--corpus',
+                        help='Directory of the corpus (default: temporary directory)')
+    parser.add_argument('-r', '--repeat', type=int, default=3,
+                        help='Number of repetitions of each benchmark')
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1,
+                        help='Number of workers of rename.py in the benchmark rename_jobs')
+    parser.add_argument('-b', '--benchmark', action='append', choices=BENCHMARKS,
+                        help='Benchmark to run (default: all)')
+    parser.add_argument('-o', '--output', help='JSON file of the results')
+    parser.add_argument('--compare', help='JSON file of the results to compare with')
+    parser.add_argument('--threshold', type=float, default=1.2,
+                        help='Ratio above which a benchmark is a regression')
+
+    args = parser.parse_args()
+
+    warnings.simplefilter('ignore')
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        corpusdir = args.corpus or os.path.join(tmpdir, 'corpus')
+        manifest = corpus.load(corpusdir)
+        if manifest is None or manifest['count'] != args.count or \
+                manifest['seed'] != args.seed:
+            print('Generating corpus of {} files in {}...'.format(args.count, corpusdir))
+            shutil.rmtree(corpusdir, ignore_errors=True)
+            manifest = corpus.generate(corpusdir, args.count, args.seed)
+
+        benchmark = Benchmark(corpusdir, tmpdir, args.jobs)
+
+        results = {'version': _version(),
+                   'python': platform.python_version(),
+                   'platform': platform.platform(),
+                   'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                   'corpus': {'count': manifest['count'], 'seed': manifest['seed'],
+                              'size': manifest['size']},
+                   'repeat': args.repeat,
+                   'benchmarks': {}}
+
+        for name in args.benchmark or BENCHMARKS:
+            times = benchmark.run(name, args.repeat)
+            result = _summary(times, manifest['count'])
+            results['benchmarks'][name] = result
+            print('{:<20} {:>10.4f} s {:>10.1f} us/file'.format(
+                  name, result['median'], result['per_file'] * 1e6))
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(results, fp, indent=2)
+
+    if args.compare:
+        with open(args.compare, 'r') as fp:
+            baseline = json.load(fp)
+        print('-' * 56)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print('Regressions: {}'.format(', '.join(regressions)))
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
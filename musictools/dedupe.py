@@ -0,0 +1,266 @@
+#!/usr/bin/env python
+"""
+================================================================================
+:mod:`dedupe` -- Find files with the same audio
+================================================================================
+
+.. module:: dedupe
+   :synopsis: Find files with the same audio
+
+Two files are duplicates if their audio is identical, whatever their tags
+and paths. Only the audio payload is hashed:
+
+  * MP3: the data between the ID3v2 tag and the ID3v1 tag, if any;
+  * Ogg Vorbis: the content of the pages following the header packets
+    (identification, comment and setup headers). Page headers are excluded,
+    since their sequence numbers and checksums change when the comment
+    header grows or shrinks.
+
+:func:`find_duplicates` narrows down the candidates in three passes, each
+more expensive than the previous one: the size of the payload, the hash of
+its first :data:`PARTIAL_SIZE` bytes and the hash of the whole payload.
+Files are mapped in memory and hashed in a pool of threads (the hash
+functions of :mod:`hashlib` release the GIL).
+
+"""
+
+# Standard library modules.
+import os
+import mmap
+import hashlib
+import logging
+import contextlib
+import collections
+from concurrent.futures import ThreadPoolExecutor
+
+# Third party modules.
+
+# Local modules.
+from musictools.song import EXTENSION_OGG
+from musictools.stats import NullStats
+from musictools.tagreader import id3_tag_size
+
+# Globals and constants variables.
+PARTIAL_SIZE = 64 * 1024 # bytes
+
+CHUNK_SIZE = 1024 * 1024 # bytes
+
+DIGEST_SIZE = 20 # bytes
+
+DEFAULT_MAX_WORKERS = os.cpu_count() or 1
+
+_ID3V1_SIZE = 128
+
+_OGG_PAGE_HEADER_SIZE = 27
+
+_VORBIS_HEADER_COUNT = 3
+
+@contextlib.contextmanager
+def _map(filepath):
+    """
+    Yields the open file *filepath* and its content mapped in memory.
+    """
+    with open(filepath, 'rb') as fp:
+        if os.fstat(fp.fileno()).st_size == 0: # cannot be mapped
+            yield fp, b''
+            return
+
+        data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield fp, data
+        finally:
+            data.close()
+
+def _iter_ogg_pages(data, offset=0):
+    """
+    Yields the offset of the pages of the first logical bitstream of Ogg
+    data, the size of their header and their lacing values.
+    """
+    serial = None
+    while offset < len(data):
+        if data[offset:offset + 4] != b'OggS' or \
+                offset + _OGG_PAGE_HEADER_SIZE > len(data):
+            raise ValueError('Invalid Ogg page')
+
+        header_size = _OGG_PAGE_HEADER_SIZE + data[offset + 26]
+        lacing = data[offset + _OGG_PAGE_HEADER_SIZE:offset + header_size]
+        if offset + header_size + sum(lacing) > len(data):
+            raise ValueError('Truncated Ogg page')
+
+        page_serial = data[offset + 14:offset + 18]
+        if serial is None:
+            serial = page_serial
+        if page_serial == serial:
+            yield offset, header_size, lacing
+
+        offset += header_size + sum(lacing)
+
+def _ogg_audio_offset(data):
+    # Offset of the first page after the header packets
+    packets = 0
+    for offset, header_size, lacing in _iter_ogg_pages(data):
+        packets += sum(1 for length in lacing if length < 255)
+        if packets >= _VORBIS_HEADER_COUNT:
+            return offset + header_size + sum(lacing)
+    raise ValueError('Truncated Vorbis headers')
+
+def _mp3_ranges(fp, data):
+    start = min(id3_tag_size(fp), len(data))
+    end = len(data)
+    if end - start >= _ID3V1_SIZE and data[end - _ID3V1_SIZE:end - _ID3V1_SIZE + 3] == b'TAG':
+        end -= _ID3V1_SIZE
+    return [(start, end - start)]
+
+def _ogg_ranges(data):
+    ranges = []
+    for offset, header_size, lacing in _iter_ogg_pages(data, _ogg_audio_offset(data)):
+        ranges.append((offset + header_size, sum(lacing)))
+    return ranges
+
+def _is_ogg(filepath):
+    return os.path.splitext(filepath)[1] == '.' + EXTENSION_OGG
+
+def payload_size(filepath):
+    """
+    Returns the size in bytes of the audio payload of *filepath*.
+    For Ogg files, it includes the page headers of the audio, which do not
+    depend on the tags; only the header pages are read.
+
+    :raise ValueError: if the file is not a valid Ogg file
+    """
+    with _map(filepath) as (fp, data):
+        if _is_ogg(filepath):
+            return len(data) - _ogg_audio_offset(data)
+        (_offset, size), = _mp3_ranges(fp, data)
+        return size
+
+def hash_audio(filepath, limit=None):
+    """
+    Returns the hexadecimal hash of the audio payload of *filepath*, or of
+    its first *limit* bytes.
+
+    :raise ValueError: if the file is not a valid Ogg file
+    """
+    digest = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    with _map(filepath) as (fp, data):
+        ranges = _ogg_ranges(data) if _is_ogg(filepath) else _mp3_ranges(fp, data)
+
+        view = memoryview(data)
+        try:
+            remaining = limit
+            for offset, size in ranges:
+                if remaining is not None:
+                    size = min(size, remaining)
+                    remaining -= size
+                for start in range(offset, offset + size, CHUNK_SIZE):
+                    digest.update(view[start:min(start + CHUNK_SIZE, offset + size)])
+                if remaining == 0:
+                    break
+        finally:
+            view.release() # the memory map cannot be closed otherwise
+
+    return digest.hexdigest()
+
+def _hash_partial(filepath):
+    return hash_audio(filepath, PARTIAL_SIZE)
+
+def _timed(stats, phase, function, filepath):
+    with stats.phase(phase):
+        return function(filepath)
+
+def _compute(executor, filepaths, function, stats, phase):
+    """
+    Returns a :class:`dict` of *filepaths* and the result of *function*,
+    computed in the *executor*. Files that cannot be read are logged and
+    left out.
+    """
+    futures = [(filepath, executor.submit(_timed, stats, phase, function, filepath))
+               for filepath in filepaths]
+
+    values = {}
+    for filepath, future in futures:
+        try:
+            values[filepath] = future.result()
+        except (OSError, ValueError) as ex:
+            logging.warning('Cannot read %s: %s', filepath, ex)
+            stats.count('failures')
+    return values
+
+def _split(groups, values):
+    """
+    Splits each group of files by their value in *values* and returns the
+    groups of more than one file.
+    """
+    result = []
+    for group in groups:
+        subgroups = collections.OrderedDict()
+        for filepath in group:
+            if filepath in values:
+                subgroups.setdefault(values[filepath], []).append(filepath)
+        result.extend(subgroup for subgroup in subgroups.values() if len(subgroup) > 1)
+    return result
+
+def _split_by_hash(executor, groups, column, function, library, stats):
+    """
+    Splits each group of files by the hash *column* of their audio, read
+    from the *library* if it was already computed and stored in it
+    otherwise.
+    """
+    filepaths = [filepath for group in groups for filepath in group]
+
+    values = {}
+    if library is not None:
+        for filepath in filepaths:
+            hashes = library.hashes(filepath)
+            if hashes is not None and hashes[column] is not None:
+                values[filepath] = hashes[column]
+        stats.count('cached_' + column, len(values))
+
+    missing = [filepath for filepath in filepaths if filepath not in values]
+    computed = _compute(executor, missing, function, stats, column)
+    stats.count(column, len(computed))
+
+    if library is not None:
+        for filepath, value in computed.items():
+            library.set_hashes(filepath, **{column: value})
+        library.commit()
+
+    values.update(computed)
+    return _split(groups, values)
+
+def find_duplicates(filepaths, library=None, max_workers=DEFAULT_MAX_WORKERS,
+                    stats=None):
+    """
+    Returns the groups of files of *filepaths* with the same audio, as a
+    list of lists of paths, in the order of *filepaths*.
+
+    :arg library: index where the hashes are stored, so that they are only
+        computed once for each file (only indexed files are stored)
+    :type library: :class:`musictools.library.Library`
+    :arg max_workers: number of threads reading the files
+    :arg stats: statistics of the run (phases ``size``, ``partial_hash``
+        and ``content_hash``)
+    :type stats: :class:`musictools.stats.Stats`
+    """
+    if stats is None:
+        stats = NullStats()
+
+    filepaths = list(filepaths)
+    stats.count('files', len(filepaths))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        sizes = _compute(executor, filepaths, payload_size, stats, 'size')
+        groups = _split([filepaths], sizes)
+
+        groups = _split_by_hash(executor, groups, 'partial_hash', _hash_partial,
+                                library, stats)
+
+        # The partial hash of a small payload is its full hash
+        small = [group for group in groups if sizes[group[0]] <= PARTIAL_SIZE]
+        large = [group for group in groups if sizes[group[0]] > PARTIAL_SIZE]
+        large = _split_by_hash(executor, large, 'content_hash', hash_audio,
+                               library, stats)
+
+    # Back in the order of the files
+    index = dict((filepath, i) for i, filepath in enumerate(filepaths))
+    return sorted(small + large, key=lambda group: index[group[0]])
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+"""
+================================================================================
+:mod:`inotify` -- Watch directories for new files
+================================================================================
+
+.. module:: inotify
+   :synopsis: Watch directories for new files
+
+:class:`Inotify` is a thin wrapper around the inotify interface of the Linux
+kernel, through :mod:`ctypes`. :class:`FileWatcher` uses it to watch
+directory trees and reports a file once it is completely written: it was
+closed after being written (or moved into the tree) and no event was
+received for it during a short delay.
+
+"""
+
+# Standard library modules.
+import os
+import sys
+import time
+import errno
+import struct
+import select
+import ctypes
+import ctypes.util
+import collections
+
+# Third party modules.
+
+# Local modules.
+
+# Globals and constants variables.
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | \
+             IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_ONLYDIR
+
+DEFAULT_DELAY = 2.0 # s
+
+_EVENT_HEADER = struct.Struct('iIII')
+
+_BUFFER_SIZE = 64 * 1024
+
+Event = collections.namedtuple('Event', ['wd', 'mask', 'cookie', 'name'])
+
+_libc = None
+
+def _load_libc():
+    global _libc
+    if _libc is None:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1.argtypes = [ctypes.c_int]
+        libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+        libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+        _libc = libc
+    return _libc
+
+def _check(result):
+    if result < 0:
+        code = ctypes.get_errno()
+        raise OSError(code, os.strerror(code))
+    return result
+
+def parse_events(data):
+    """
+    Returns the list of :class:`Event` in the buffer *data* read from an
+    inotify file descriptor.
+    """
+    events = []
+    offset = 0
+    while offset + _EVENT_HEADER.size <= len(data):
+        wd, mask, cookie, length = _EVENT_HEADER.unpack_from(data, offset)
+        offset += _EVENT_HEADER.size
+        name = data[offset:offset + length].rstrip(b'\0')
+        offset += length
+        events.append(Event(wd, mask, cookie, os.fsdecode(name)))
+    return events
+
+class Inotify(object):
+
+    def __init__(self):
+        """
+        Inotify instance of the Linux kernel.
+
+        :raise OSError: if inotify is not available
+        """
+        if not sys.platform.startswith('linux'):
+            raise OSError(errno.ENOSYS, 'inotify is only available on Linux')
+
+        self._libc = _load_libc()
+        self.fd = _check(self._libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        """
+        Watches *path* and returns the watch descriptor.
+        """
+        return _check(self._libc.inotify_add_watch(self.fd, os.fsencode(path), mask))
+
+    def rm_watch(self, wd):
+        _check(self._libc.inotify_rm_watch(self.fd, wd))
+
+    def read(self, timeout=None):
+        """
+        Waits at most *timeout* seconds (indefinitely if ``None``) for events
+        and returns them.
+        """
+        poller = select.poll()
+        poller.register(self.fd, select.POLLIN)
+        if not poller.poll(None if timeout is None else int(timeout * 1000)):
+            return []
+
+        try:
+            data = os.read(self.fd, _BUFFER_SIZE)
+        except BlockingIOError:
+            return []
+        return parse_events(data)
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+class FileWatcher(object):
+
+    def __init__(self, dirpaths, delay=DEFAULT_DELAY, inotify=None):
+        """
+        Watches the directory trees *dirpaths* for new files.
+        A file is ready once it was closed after writing, or moved into a
+        watched directory, and no event was received for it during *delay*
+        seconds. Files already in the directories are not reported.
+        """
+        self.delay = delay
+        self._inotify = inotify or Inotify()
+        self._dirpaths = {}
+        self._pending = {} # filepath: [time of the last event, closed]
+
+        self.roots = list(dirpaths)
+        for dirpath in self.roots:
+            self._watch_tree(dirpath, False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _watch_tree(self, dirpath, add_files):
+        """
+        Watches *dirpath* and its subdirectories. If *add_files* is ``True``,
+        the files found in them are ready after the delay: a directory moved
+        or created in the tree may already contain files.
+        """
+        stack = [dirpath]
+        while stack:
+            dirpath = stack.pop()
+            try:
+                wd = self._inotify.add_watch(dirpath)
+                entries = list(os.scandir(dirpath))
+            except OSError: # removed meanwhile
+                continue
+            self._dirpaths[wd] = dirpath
+
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif add_files:
+                    self._touch(entry.path, True)
+
+    def _touch(self, filepath, closed):
+        state = self._pending.get(filepath)
+        if state is None:
+            self._pending[filepath] = [time.monotonic(), closed]
+        else:
+            state[0] = time.monotonic()
+            state[1] = state[1] or closed
+
+    def _handle(self, event):
+        if event.mask & IN_Q_OVERFLOW:
+            # Events were lost: all the files of the trees are checked
+            for dirpath in self.roots:
+                self._watch_tree(dirpath, True)
+            return
+
+        dirpath = self._dirpaths.get(event.wd)
+        if dirpath is None:
+            return
+
+        if event.mask & (IN_IGNORED | IN_DELETE_SELF):
+            if event.mask & IN_IGNORED:
+                del self._dirpaths[event.wd]
+            return
+
+        path = os.path.join(dirpath, event.name)
+        if event.mask & IN_ISDIR:
+            if event.mask & (IN_CREATE | IN_MOVED_TO):
+                self._watch_tree(path, True)
+        elif event.mask & (IN_DELETE | IN_MOVED_FROM):
+            self._pending.pop(path, None)
+        elif event.mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+            self._touch(path, True)
+        elif event.mask & (IN_CREATE | IN_MODIFY):
+            self._touch(path, False)
+
+    def _ready(self, now):
+        ready = []
+        for filepath, (last, closed) in list(self._pending.items()):
+            if closed and now - last >= self.delay:
+                del self._pending[filepath]
+                if os.path.isfile(filepath):
+                    ready.append(filepath)
+        return sorted(ready)
+
+    def poll(self, timeout=None):
+        """
+        Waits at most *timeout* seconds (indefinitely if ``None``) for files
+        to be ready and returns them, sorted.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            now = time.monotonic()
+            ready = self._ready(now)
+            if ready:
+                return ready
+
+            # Wait for the next event, or until a pending file is ready
+            wait = None
+            closed = [last + self.delay - now
+                      for last, closed in self._pending.values() if closed]
+            if closed:
+                wait = max(0.0, min(closed))
+            if deadline is not None:
+                remaining = deadline - now
+                if remaining <= 0:
+                    return []
+                wait = remaining if wait is None else min(wait, remaining)
+
+            for event in self._inotify.read(wait):
+                self._handle(event)
+
+    def close(self):
+        self._inotify.close()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+"""
+================================================================================
+:mod:`journal` -- Journal of the moves of a rename run
+================================================================================
+
+.. module:: journal
+   :synopsis: Journal of the moves of a rename run
+
+The journal is an append-only file with one JSON record per line:
+
+  * ``{"op": "begin", "time": ...}`` starts a run;
+  * ``{"op": "plan", "src": ..., "dst": ..., "size": ..., "mtime_ns": ...}``
+    is a planned move, with the size and modification time of its source;
+  * ``{"op": "planned"}`` marks the end of the plan, once it is on disk;
+  * ``{"op": "done", "src": ..., "dst": ...}`` is a completed move;
+  * ``{"op": "undone", "src": ..., "dst": ...}`` is a move rolled back;
+  * ``{"op": "end"}`` marks the end of the run (or of its rollback).
+
+A run interrupted before its end can be resumed from the journal, without
+reading the tags again, or rolled back. Since a record may be lost in a
+crash, the files themselves tell whether a move not recorded as done was
+actually done (see :func:`reconcile`).
+
+"""
+
+# Standard library modules.
+import os
+import json
+import filecmp
+import time
+import collections
+
+# Third party modules.
+
+# Local modules.
+
+# Globals and constants variables.
+OP_BEGIN = 'begin'
+OP_PLAN = 'plan'
+OP_PLANNED = 'planned'
+OP_DONE = 'done'
+OP_UNDONE = 'undone'
+OP_END = 'end'
+
+SYNC_INTERVAL = 100 # records
+
+# Results of _compare
+_MOVED = 'moved'
+_COPIED = 'copied'
+
+def _record(op, src, dst):
+    return {'op': op, 'src': os.path.abspath(src), 'dst': os.path.abspath(dst)}
+
+class Journal(object):
+
+    def __init__(self, filepath, append=False):
+        """
+        Opens the journal *filepath* for writing. A new journal replaces
+        the existing one unless *append* is ``True``.
+        """
+        self.filepath = filepath
+        self._fp = open(filepath, 'a' if append else 'w', encoding='utf-8')
+        self._unsynced = 0
+
+        # Terminate a line truncated by a crash
+        if append and self._fp.tell() > 0:
+            with open(filepath, 'rb') as fp:
+                fp.seek(-1, os.SEEK_END)
+                if fp.read(1) != b'\n':
+                    self._fp.write('\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _write(self, record, sync=False):
+        self._fp.write(json.dumps(record) + '\n')
+        self._fp.flush()
+        self._unsynced += 1
+        if sync or self._unsynced >= SYNC_INTERVAL:
+            self.sync()
+
+    def sync(self):
+        os.fsync(self._fp.fileno())
+        self._unsynced = 0
+
+    def begin(self):
+        self._write({'op': OP_BEGIN, 'time': time.time()})
+
+    def plan(self, moves):
+        """
+        Records the planned moves, a sequence of objects with the attributes
+        ``src`` and ``dst``.
+        Paths are recorded as absolute paths, so that the run can be resumed
+        or rolled back from another working directory.
+        """
+        for move in moves:
+            record = _record(OP_PLAN, move.src, move.dst)
+            try:
+                stat = os.stat(move.src)
+            except OSError:
+                pass
+            else:
+                record['size'] = stat.st_size
+                record['mtime_ns'] = stat.st_mtime_ns
+            self._write(record)
+        self._write({'op': OP_PLANNED}, sync=True)
+
+    def done(self, src, dst):
+        self._write(_record(OP_DONE, src, dst))
+
+    def undone(self, src, dst):
+        self._write(_record(OP_UNDONE, src, dst))
+
+    def end(self):
+        self._write({'op': OP_END}, sync=True)
+
+    def close(self):
+        if self._fp.closed:
+            return
+        self.sync()
+        self._fp.close()
+
+JournalState = collections.namedtuple('JournalState',
+                                      ['moves', 'sources', 'done', 'undone',
+                                       'planned', 'ended'])
+
+def read_journal(filepath):
+    """
+    Reads the journal *filepath* and returns a :class:`JournalState`:
+
+      * *moves*: list of the planned moves ``(src, dst)``, in plan order;
+      * *sources*: :class:`dict` of the planned moves and the size and
+        modification time (in nanoseconds) of their source when planned;
+      * *done*, *undone*: sets of the moves ``(src, dst)`` recorded as done
+        or rolled back;
+      * *planned*: whether the plan was completely recorded;
+      * *ended*: whether the run (or its rollback) ended.
+
+    Only the last run of the journal is read. A truncated last line, left by
+    a crash, is ignored.
+    """
+    moves = []
+    sources = {}
+    done = set()
+    undone = set()
+    planned = ended = False
+
+    with open(filepath, 'r', encoding='utf-8') as fp:
+        for line in fp:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+
+            op = record.get('op')
+            if op == OP_BEGIN:
+                moves = []
+                sources = {}
+                done = set()
+                undone = set()
+                planned = ended = False
+            elif op == OP_PLAN:
+                move = (record['src'], record['dst'])
+                moves.append(move)
+                if 'size' in record and 'mtime_ns' in record:
+                    sources[move] = (record['size'], record['mtime_ns'])
+            elif op == OP_PLANNED:
+                planned = True
+            elif op == OP_DONE:
+                done.add((record['src'], record['dst']))
+                undone.discard((record['src'], record['dst']))
+            elif op == OP_UNDONE:
+                undone.add((record['src'], record['dst']))
+            elif op == OP_END:
+                ended = True
+
+    return JournalState(moves, sources, done, undone, planned, ended)
+
+def reconcile(state, finish=True):
+    """
+    Returns the moves of the journal *state* left to do, the moves found
+    done on disk although they were not recorded as done and the moves in
+    conflict, whose source and destination both exist.
+
+    A move is found done if its source is gone and its destination exists,
+    or if its destination is the planned source (same size and modification
+    time) while the source is now another file, moved there afterwards.
+    If the source and destination are both the planned source, with the
+    same content, a copy across file systems was interrupted before the
+    source was removed: with *finish*, the source is removed and the move
+    is found done; otherwise (e.g. to roll back the run), both files are
+    left and the move is in conflict. Nothing is removed in any other case.
+    """
+    remaining = []
+    found = []
+    conflicts = []
+    for move in state.moves:
+        if move in state.done and move not in state.undone:
+            continue
+        src, dst = move
+        if not os.path.lexists(dst):
+            remaining.append(move)
+        elif not os.path.lexists(src):
+            found.append(move)
+        else:
+            status = _compare(src, dst, state.sources.get(move))
+            if status == _MOVED:
+                found.append(move)
+            elif status == _COPIED and finish:
+                os.remove(src)
+                found.append(move)
+            else:
+                conflicts.append(move)
+    return remaining, found, conflicts
+
+def _compare(src, dst, source):
+    """
+    Returns whether *dst* is the planned *source* ``(size, mtime_ns)`` and
+    *src* another file (:data:`_MOVED`), whether both are the planned
+    source with the same content (:data:`_COPIED`), or ``None``.
+    """
+    if source is None:
+        return None
+    try:
+        srcstat = os.stat(src)
+        dststat = os.stat(dst)
+    except OSError:
+        return None
+    if os.path.samestat(srcstat, dststat): # same file, e.g. a hard link
+        return None
+
+    if (dststat.st_size, dststat.st_mtime_ns) != tuple(source):
+        return None
+    if (srcstat.st_size, srcstat.st_mtime_ns) != tuple(source):
+        return _MOVED
+    if filecmp.cmp(src, dst, shallow=False):
+        return _COPIED
+    return None
@@ -0,0 +1,461 @@
+#!/usr/bin/env python
+"""
+================================================================================
+:mod:`library` -- Persistent index of songs
+================================================================================
+
+.. module:: library
+   :synopsis: Persistent index of songs
+
+The index is a SQLite database storing the fields read by
+:class:`musictools.song.Song`. Each entry is keyed by the path of the file
+and remembers its size and modification time, so that a rescan only reads
+again the files that changed. The index also stores the hashes of the audio
+of the files computed by :mod:`musictools.dedupe`, which are cleared
+whenever the entry of a file is replaced.
+
+For library-wide queries, :meth:`Library.table` loads the index into a
+:class:`SongTable`, which stores each field in a column backed by a NumPy
+array. NumPy (and PyArrow for the export) are optional dependencies, only
+required by :class:`SongTable`.
+
+"""
+
+# Standard library modules.
+import os
+import sys
+import json
+import logging
+import sqlite3
+
+# Third party modules.
+try:
+    import numpy as np
+except ImportError: #pragma: no cover
+    np = None
+
+# Local modules.
+from musictools.song import Song, Artist, EXTENSION_MP3, EXTENSION_OGG
+from musictools.utils import iter_files
+
+# Globals and constants variables.
+SCHEMA_VERSION = 2
+
+COMMIT_INTERVAL = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS songs (
+    filepath TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    filetype TEXT NOT NULL,
+    artists TEXT NOT NULL,
+    albumtitle TEXT NOT NULL,
+    title TEXT NOT NULL,
+    tracknumber INTEGER NOT NULL,
+    year INTEGER NOT NULL,
+    genre TEXT NOT NULL,
+    discnumber INTEGER NOT NULL,
+    partial_hash TEXT,
+    content_hash TEXT
+)
+"""
+
+_FIELDS = ('filetype', 'artists', 'albumtitle', 'title', 'tracknumber',
+           'year', 'genre', 'discnumber')
+
+_HASHES = ('partial_hash', 'content_hash')
+
+class Library(object):
+
+    def __init__(self, filepath):
+        """
+        Opens (or creates) the index stored in *filepath*.
+        Use ``':memory:'`` for a temporary index.
+        """
+        self.filepath = filepath
+        self._connection = sqlite3.connect(filepath)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('PRAGMA synchronous=NORMAL')
+
+        version, = self._connection.execute('PRAGMA user_version').fetchone()
+        if version not in (0, SCHEMA_VERSION):
+            self._connection.execute('DROP TABLE IF EXISTS songs')
+        self._connection.execute(_SCHEMA)
+        self._connection.execute('PRAGMA user_version=%i' % SCHEMA_VERSION)
+        self._connection.commit()
+
+        self._uncommitted = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        count, = self._connection.execute('SELECT COUNT(*) FROM songs').fetchone()
+        return count
+
+    def __contains__(self, filepath):
+        return self.lookup(filepath) is not None
+
+    def __iter__(self):
+        """
+        Iterates over all indexed songs, without reading the files.
+        """
+        cursor = self._connection.execute('SELECT filepath, %s FROM songs '
+                                          'ORDER BY filepath' % ', '.join(_FIELDS))
+        for row in cursor:
+            yield Song._from_fields(row[0], self._decode(row[1:]))
+
+    def table(self):
+        """
+        Returns a :class:`SongTable` of all indexed songs.
+        """
+        cursor = self._connection.execute('SELECT filepath, %s FROM songs '
+                                          'ORDER BY filepath' % ', '.join(_FIELDS))
+        rows = cursor.fetchall()
+        columns = dict(zip(('filepath',) + _FIELDS, zip(*rows)))
+        if not rows:
+            columns = dict((name, ()) for name in ('filepath',) + _FIELDS)
+
+        artists = [json.loads(value) for value in columns['artists']]
+        columns['artist'] = [names[0] if names else '' for names in artists]
+        del columns['artists']
+
+        return SongTable(columns)
+
+    def _key(self, filepath):
+        return os.path.abspath(filepath)
+
+    def _decode(self, row):
+        fields = dict(zip(_FIELDS, row))
+        fields['artists'] = [Artist(name=name) for name in json.loads(fields['artists'])]
+        fields['albumtitle'] = sys.intern(fields['albumtitle'])
+        fields['genre'] = sys.intern(fields['genre'])
+        return fields
+
+    def _changed(self):
+        self._uncommitted += 1
+        if self._uncommitted >= COMMIT_INTERVAL:
+            self.commit()
+
+    def _select(self, filepath, columns):
+        # Values of the columns, if the file did not change since indexed
+        try:
+            stat = os.stat(filepath)
+        except OSError:
+            return None
+
+        row = self._connection.execute(
+            'SELECT size, mtime_ns, %s FROM songs WHERE filepath=?' % ', '.join(columns),
+            (self._key(filepath),)).fetchone()
+        if row is None:
+            return None
+
+        size, mtime_ns = row[:2]
+        if size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+            return None
+
+        return row[2:]
+
+    def lookup(self, filepath):
+        """
+        Returns a :class:`dict` of the indexed fields of *filepath* or
+        ``None`` if the file is not indexed or changed since it was indexed.
+        """
+        row = self._select(filepath, _FIELDS)
+        if row is None:
+            return None
+        return self._decode(row)
+
+    def hashes(self, filepath):
+        """
+        Returns a :class:`dict` of the audio hashes of *filepath*
+        (``partial_hash`` and ``content_hash``, ``None`` if not computed yet)
+        or ``None`` if the file is not indexed or changed since it was indexed.
+        """
+        row = self._select(filepath, _HASHES)
+        if row is None:
+            return None
+        return dict(zip(_HASHES, row))
+
+    def set_hashes(self, filepath, partial_hash=None, content_hash=None):
+        """
+        Stores the audio hashes of *filepath*; hashes that are ``None`` are
+        left unchanged. Nothing is stored if the file is not indexed or
+        changed since it was indexed.
+        """
+        stat = os.stat(filepath)
+        self._connection.execute(
+            'UPDATE songs SET partial_hash=COALESCE(?, partial_hash), '
+            'content_hash=COALESCE(?, content_hash) '
+            'WHERE filepath=? AND size=? AND mtime_ns=?',
+            (partial_hash, content_hash, self._key(filepath),
+             stat.st_size, stat.st_mtime_ns))
+        self._changed()
+
+    def add(self, song):
+        """
+        Adds or replaces the entry of *song* in the index.
+        """
+        stat = os.stat(song.filepath)
+        artists = json.dumps([artist.name for artist in song.artists])
+        values = (self._key(song.filepath), stat.st_size, stat.st_mtime_ns,
+                  song.filetype, artists, song.albumtitle, song.title,
+                  song.tracknumber, song.year, song.genre, song.discnumber)
+        self._connection.execute('INSERT OR REPLACE INTO songs '
+                                 '(filepath, size, mtime_ns, %s) VALUES '
+                                 '(?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)' % ', '.join(_FIELDS),
+                                 values)
+        self._changed()
+
+    def remove(self, filepath):
+        """
+        Removes the entry of *filepath* from the index, if any.
+        """
+        self._connection.execute('DELETE FROM songs WHERE filepath=?',
+                                 (self._key(filepath),))
+        self._changed()
+
+    def move(self, src, dst):
+        """
+        Updates the index after the file *src* was moved to *dst*.
+        """
+        self._connection.execute('UPDATE songs SET filepath=? WHERE filepath=?',
+                                 (self._key(dst), self._key(src)))
+        self._changed()
+
+    def scan(self, dirpaths, incremental=True):
+        """
+        Yields a :class:`Song` for every MP3 and OGG file found recursively
+        in *dirpaths* and updates the index.
+        If *incremental* is ``True``, only files that are new or changed
+        since the last scan are read.
+        Files that cannot be read are logged and skipped.
+        """
+        try:
+            for filepath in iter_files(dirpaths, [EXTENSION_MP3, EXTENSION_OGG]):
+                try:
+                    if incremental:
+                        song = Song.from_index(self, filepath)
+                    else:
+                        song = Song(filepath)
+                        self.add(song)
+                except Exception as ex:
+                    logging.warning('Cannot read %s: %s', filepath, ex)
+                    continue
+
+                yield song
+        finally:
+            self.commit()
+
+    def commit(self):
+        self._connection.commit()
+        self._uncommitted = 0
+
+    def close(self):
+        self.commit()
+        self._connection.close()
+
+class DictionaryColumn(object):
+
+    def __init__(self, codes, categories):
+        """
+        Dictionary-encoded column: *codes* is an array of indices in the list
+        of distinct values *categories*.
+        """
+        self.codes = codes
+        self.categories = categories
+
+    @classmethod
+    def encode(cls, values):
+        categories = {}
+        codes = np.fromiter((categories.setdefault(value, len(categories))
+                             for value in values), dtype=np.int32, count=len(values))
+        return cls(codes, list(categories))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def code(self, value):
+        """
+        Returns the code of *value* or -1 if it is not in the column.
+        """
+        try:
+            return self.categories.index(value)
+        except ValueError:
+            return -1
+
+    def decode(self):
+        """
+        Returns the values as an array of objects.
+        """
+        categories = np.array(self.categories + [None], dtype=object)
+        return categories[self.codes]
+
+    def take(self, indices):
+        return DictionaryColumn(self.codes[indices], self.categories)
+
+class SongTable(object):
+
+    NUMERIC_COLUMNS = ('tracknumber', 'year', 'discnumber')
+    DICTIONARY_COLUMNS = ('artist', 'albumtitle', 'genre', 'filetype')
+    OBJECT_COLUMNS = ('filepath', 'title')
+
+    def __init__(self, columns):
+        """
+        Columnar table of songs.
+        Numerical fields are stored in NumPy arrays, artist (first artist of
+        the song), album title, genre and file type are dictionary-encoded.
+
+        :arg columns: :class:`dict` of the column names and their values
+        """
+        if np is None:
+            raise ImportError('numpy is required for SongTable')
+
+        self._columns = {}
+        for name in self.NUMERIC_COLUMNS:
+            self._columns[name] = np.asarray(columns[name], dtype=np.int32)
+        for name in self.DICTIONARY_COLUMNS:
+            values = columns[name]
+            if not isinstance(values, DictionaryColumn):
+                values = DictionaryColumn.encode(values)
+            self._columns[name] = values
+        for name in self.OBJECT_COLUMNS:
+            self._columns[name] = np.asarray(columns[name], dtype=object)
+
+    @classmethod
+    def from_songs(cls, songs):
+        """
+        Creates a table from :class:`Song` objects.
+        """
+        songs = list(songs)
+        columns = {}
+        for name in cls.NUMERIC_COLUMNS + cls.OBJECT_COLUMNS + cls.DICTIONARY_COLUMNS:
+            if name == 'artist':
+                continue
+            columns[name] = [getattr(song, name) for song in songs]
+        columns['artist'] = [song.artists[0].name if song.artists else ''
+                             for song in songs]
+        return cls(columns)
+
+    def __len__(self):
+        return len(self._columns['filepath'])
+
+    def __getitem__(self, name):
+        """
+        Returns the column *name*: a NumPy array or a
+        :class:`DictionaryColumn`.
+        """
+        return self._columns[name]
+
+    @property
+    def columns(self):
+        return list(self._columns)
+
+    def equals(self, name, value):
+        """
+        Returns a boolean mask of the rows where the column *name* equals
+        *value*.
+        """
+        column = self._columns[name]
+        if isinstance(column, DictionaryColumn):
+            return column.codes == column.code(value)
+        return column == value
+
+    def missing(self, name):
+        """
+        Returns a boolean mask of the rows where the field *name* is missing
+        (empty string or 0).
+        """
+        if name in self.NUMERIC_COLUMNS:
+            return self._columns[name] == 0
+        return self.equals(name, '')
+
+    def select(self, mask):
+        """
+        Returns a new table with the rows selected by the boolean *mask* (or
+        array of indices).
+        """
+        columns = {}
+        for name, column in self._columns.items():
+            if isinstance(column, DictionaryColumn):
+                columns[name] = column.take(mask)
+            else:
+                columns[name] = column[mask]
+        return SongTable(columns)
+
+    def count_by(self, name):
+        """
+        Returns a :class:`dict` of the values of column *name* and their
+        number of rows.
+        """
+        column = self._columns[name]
+        if isinstance(column, DictionaryColumn):
+            counts = np.bincount(column.codes, minlength=len(column.categories))
+            return dict((value, int(count))
+                        for value, count in zip(column.categories, counts) if count)
+
+        values, counts = np.unique(column, return_counts=True)
+        return dict((value.item() if hasattr(value, 'item') else value, int(count))
+                    for value, count in zip(values, counts))
+
+    def albums_per_artist(self):
+        """
+        Returns a :class:`dict` of the artists and their number of distinct
+        albums.
+        """
+        artist = self._columns['artist']
+        album = self._columns['albumtitle']
+        pairs = artist.codes.astype(np.int64) * max(1, len(album.categories)) + album.codes
+        artist_codes = np.unique(pairs) // max(1, len(album.categories))
+        counts = np.bincount(artist_codes, minlength=len(artist.categories))
+        return dict((value, int(count))
+                    for value, count in zip(artist.categories, counts) if count)
+
+    def missing_counts(self):
+        """
+        Returns a :class:`dict` of the fields and their number of missing
+        values.
+        """
+        names = ('artist', 'albumtitle', 'title', 'tracknumber', 'year', 'genre')
+        return dict((name, int(np.count_nonzero(self.missing(name))))
+                    for name in names)
+
+    def year_histogram(self):
+        """
+        Returns a :class:`dict` of the years and their number of songs,
+        ignoring songs without a year.
+        """
+        years = self._columns['year']
+        return self.select(years != 0).count_by('year')
+
+    def to_arrow(self):
+        """
+        Returns a :class:`pyarrow.Table`. Numerical columns and the codes of
+        dictionary-encoded columns are shared with the NumPy arrays, without
+        copy.
+        """
+        import pyarrow as pa
+
+        arrays = []
+        for name, column in self._columns.items():
+            if isinstance(column, DictionaryColumn):
+                array = pa.DictionaryArray.from_arrays(
+                    pa.array(column.codes), pa.array(column.categories, type=pa.string()))
+            elif column.dtype == object:
+                array = pa.array(column, type=pa.string())
+            else:
+                array = pa.array(column)
+            arrays.append(array)
+
+        return pa.Table.from_arrays(arrays, names=list(self._columns))
+
+    def to_parquet(self, filepath):
+        """
+        Writes the table to the Parquet file *filepath*.
+        """
+        import pyarrow.parquet as pq
+        pq.write_table(self.to_arrow(), filepath)
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+"""
+================================================================================
+:mod:`mover` -- Move files within and across file systems
+================================================================================
+
+.. module:: mover
+   :synopsis: Move files within and across file systems
+
+On the same file system, a file is moved with :func:`os.rename`. Across file
+systems, the data is copied by the kernel (``copy_file_range``, or
+``sendfile`` when it is not supported), with a fallback to a copy in user
+space. The copy is written to a temporary file next to the destination,
+flushed to disk and renamed; the source is only removed afterwards, once
+the size of the copy is checked, so that an interruption never loses a
+file.
+
+"""
+
+# Standard library modules.
+import os
+import errno
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor, Future
+
+# Third party modules.
+
+# Local modules.
+from musictools.stats import NullStats
+
+# Globals and constants variables.
+DEFAULT_MAX_WORKERS = 4
+
+COPY_CHUNK_SIZE = 8 * 1024 * 1024 # bytes
+
+# Errors of copy_file_range and sendfile meaning that the next method must
+# be tried
+_UNSUPPORTED_ERRNOS = frozenset([errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                                 errno.EOPNOTSUPP, errno.ENOTSUP, errno.EPERM])
+
+def _copy_file_range(infd, outfd, offset):
+    return os.copy_file_range(infd, outfd, COPY_CHUNK_SIZE, offset, offset)
+
+def _sendfile(infd, outfd, offset):
+    os.lseek(outfd, offset, os.SEEK_SET)
+    return os.sendfile(outfd, infd, offset, COPY_CHUNK_SIZE)
+
+def _pread_write(infd, outfd, offset):
+    data = os.pread(infd, COPY_CHUNK_SIZE, offset)
+    view = memoryview(data)
+    while view:
+        written = os.pwrite(outfd, view, offset)
+        view = view[written:]
+        offset += written
+    return len(data)
+
+def _copy_methods():
+    methods = []
+    if hasattr(os, 'copy_file_range'):
+        methods.append(_copy_file_range)
+    if hasattr(os, 'sendfile'):
+        methods.append(_sendfile)
+    methods.append(_pread_write)
+    return methods
+
+def copy_data(infd, outfd):
+    """
+    Copies the content of the file descriptor *infd* into *outfd*, using the
+    fastest method supported by the kernel and the file systems.
+    Returns the number of bytes copied.
+    """
+    offset = 0
+    for method in _copy_methods():
+        try:
+            while True:
+                count = method(infd, outfd, offset)
+                if count == 0:
+                    break
+                offset += count
+        except OSError as ex:
+            if method is _pread_write or ex.errno not in _UNSUPPORTED_ERRNOS:
+                raise
+            continue
+
+        # Some file systems report an end of file from the start instead of
+        # an error (e.g. copy_file_range on procfs or some FUSE file
+        # systems): try the next method
+        if offset > 0:
+            return offset
+    return offset
+
+def _fsync_dir(dirpath):
+    if os.name != 'posix': # directories cannot be opened
+        return
+    fd = os.open(dirpath, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def copy_and_remove(src, dst):
+    """
+    Copies *src* to *dst*, keeping its permissions and timestamps, flushes
+    the copy to disk, then removes *src*.
+
+    :raise IOError: if fewer bytes than the size of *src* were copied (*src*
+        is then kept)
+    """
+    dirpath, filename = os.path.split(dst)
+    fd, tmpfilepath = tempfile.mkstemp(prefix='.' + filename, suffix='.tmp',
+                                       dir=dirpath or '.')
+    try:
+        with open(fd, 'wb') as outfp, open(src, 'rb') as infp:
+            size = os.fstat(infp.fileno()).st_size
+            copied = copy_data(infp.fileno(), outfp.fileno())
+            if copied != size:
+                raise IOError("Incomplete copy of %s (%i of %i bytes)" % (src, copied, size))
+            os.fsync(outfp.fileno())
+        shutil.copystat(src, tmpfilepath)
+        os.replace(tmpfilepath, dst)
+    except:
+        os.remove(tmpfilepath)
+        raise
+
+    _fsync_dir(dirpath or '.')
+    os.remove(src)
+
+def _completed(result=None, exception=None):
+    future = Future()
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+    return future
+
+class Mover(object):
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, stats=None):
+        """
+        Moves files: renames on the same file system are done immediately,
+        copies across file systems run in at most *max_workers* threads.
+
+        :arg stats: statistics of the moves (phases ``rename`` and ``copy``)
+        :type stats: :class:`musictools.stats.Stats`
+        """
+        if stats is None:
+            stats = NullStats()
+        self.max_workers = max_workers
+        self.stats = stats
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _copy(self, src, dst):
+        with self.stats.phase('copy'):
+            copy_and_remove(src, dst)
+
+    def submit(self, src, dst):
+        """
+        Moves *src* to *dst* and returns a future of the move.
+        """
+        try:
+            with self.stats.phase('rename'):
+                os.rename(src, dst)
+        except OSError as ex:
+            if ex.errno != errno.EXDEV:
+                return _completed(exception=ex)
+        else:
+            return _completed()
+
+        return self._executor.submit(self._copy, src, dst)
+
+    def move(self, src, dst):
+        """
+        Moves *src* to *dst* and waits for the move to be done.
+        """
+        self.submit(src, dst).result()
+
+    def close(self):
+        self._executor.shutdown()
@@ -0,0 +1,311 @@
+#!/usr/bin/env python
+"""
+================================================================================
+:mod:`musicbrainz` -- Cache and backends of the Musicbrainz web service
+================================================================================
+
+.. module:: musicbrainz
+   :synopsis: Cache and backends of the Musicbrainz web service
+
+A backend is any object with the methods ``get_releases_by_discid(discid)``
+and ``get_release_by_id(release_id, includes)`` of :mod:`musicbrainzngs`.
+The module :mod:`musicbrainzngs` itself is the default backend.
+
+"""
+
+# Standard library modules.
+import os
+import re
+import json
+import time
+import tempfile
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Third party modules.
+import musicbrainzngs
+
+# Local modules.
+
+# Globals and constants variables.
+DEFAULT_TTL = 30 * 24 * 3600 # s
+
+DEFAULT_MAX_SIZE = 50 * 1024 * 1024 # bytes
+
+DEFAULT_RATE = 1.0 # requests/s, limit of the Musicbrainz web service
+
+RELEASE_INCLUDES = ['artists', 'recordings', 'discids']
+
+_UNSAFE_CHARS = re.compile(r'[^A-Za-z0-9._\-]')
+
+class OfflineError(Exception):
+    pass
+
+def release_key(release_id, includes=RELEASE_INCLUDES):
+    """
+    Returns the cache key of the response of ``get_release_by_id`` for
+    *release_id* and *includes*.
+    """
+    return 'release-%s-%s' % (release_id, '+'.join(sorted(includes)))
+
+def _filename(key):
+    return _UNSAFE_CHARS.sub('_', key) + '.json'
+
+class ReleaseCache(object):
+
+    def __init__(self, dirpath, ttl=DEFAULT_TTL, max_size=DEFAULT_MAX_SIZE):
+        """
+        Persistent cache of the responses of the Musicbrainz web service,
+        stored as JSON files in *dirpath*.
+
+        :arg ttl: time (in seconds) after which an entry expires
+        :arg max_size: maximum size (in bytes) of the cache; the oldest
+            entries are evicted when it is exceeded
+        """
+        self.dirpath = dirpath
+        self.ttl = ttl
+        self.max_size = max_size
+        os.makedirs(dirpath, exist_ok=True)
+
+    def _filepath(self, key):
+        return os.path.join(self.dirpath, _filename(key))
+
+    def get(self, key):
+        """
+        Returns the cached value of *key* or ``None`` if it is not cached or
+        expired.
+        """
+        filepath = self._filepath(key)
+        try:
+            if time.time() - os.stat(filepath).st_mtime > self.ttl:
+                os.remove(filepath)
+                return None
+
+            with open(filepath, 'r', encoding='utf-8') as fp:
+                return json.load(fp)
+        except (OSError, ValueError):
+            return None
+
+    def set(self, key, value):
+        fd, tmpfilepath = tempfile.mkstemp(suffix='.tmp', dir=self.dirpath)
+        try:
+            with open(fd, 'w', encoding='utf-8') as fp:
+                json.dump(value, fp)
+            os.replace(tmpfilepath, self._filepath(key))
+        except:
+            os.remove(tmpfilepath)
+            raise
+
+        self._evict()
+
+    def _evict(self):
+        entries = []
+        for entry in os.scandir(self.dirpath):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        size = sum(entry[1] for entry in entries)
+        for _mtime, entrysize, filepath in sorted(entries):
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(filepath)
+            except OSError:
+                pass
+            size -= entrysize
+
+    def clear(self):
+        for entry in os.scandir(self.dirpath):
+            if entry.name.endswith('.json'):
+                os.remove(entry.path)
+
+class FixtureBackend(object):
+
+    def __init__(self, dirpath):
+        """
+        Backend serving the responses stored as JSON files in *dirpath*,
+        named ``disc-<discid>.json`` and ``release-<release id>.json``.
+        Used in place of the web service in tests.
+        """
+        self.dirpath = dirpath
+
+    def _load(self, key):
+        filepath = os.path.join(self.dirpath, _filename(key))
+        if not os.path.exists(filepath):
+            raise musicbrainzngs.ResponseError('No fixture for %s' % key)
+
+        with open(filepath, 'r', encoding='utf-8') as fp:
+            return json.load(fp)
+
+    def get_releases_by_discid(self, discid):
+        return self._load('disc-' + discid)
+
+    def get_release_by_id(self, release_id, includes=()):
+        return self._load('release-' + release_id)
+
+def cached_call(cache, key, fetch, offline=False):
+    """
+    Returns the value of *key* from the *cache*, or calls *fetch* and caches
+    its result if it is not cached.
+
+    :arg cache: cache or ``None`` to always call *fetch*
+    :arg offline: if ``True``, *fetch* is never called and
+        :exc:`OfflineError` is raised when the value is not cached
+    """
+    value = None if cache is None else cache.get(key)
+    if value is not None:
+        return value
+
+    if offline:
+        raise OfflineError('%s is not cached' % key)
+
+    value = fetch()
+    if cache is not None:
+        cache.set(key, value)
+    return value
+
+class RateLimiter(object):
+
+    def __init__(self, rate=DEFAULT_RATE):
+        """
+        Spaces calls to :meth:`wait` by at least ``1 / rate`` seconds.
+        Thread-safe.
+        """
+        self.interval = 1.0 / rate
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        if start > now:
+            time.sleep(start - now)
+
+def _is_retryable(ex):
+    if isinstance(ex, musicbrainzngs.NetworkError):
+        return True
+    if isinstance(ex, musicbrainzngs.ResponseError):
+        # 503: rate limit exceeded or service unavailable
+        return getattr(ex.cause, 'code', None) == 503
+    return False
+
+class BulkClient(object):
+
+    def __init__(self, backend=None, cache=None, rate=DEFAULT_RATE,
+                 max_workers=4, retries=3, backoff=1.0):
+        """
+        Client to look up many discs or releases concurrently while keeping
+        the rate of requests at the limit of the web service.
+        Identical lookups are only done once and cached responses do not
+        count toward the rate limit.
+
+        :arg backend: backend (see module), defaults to :mod:`musicbrainzngs`
+            (which applies its own rate limit as well)
+        :arg cache: cache of the responses
+        :type cache: :class:`ReleaseCache`
+        :arg rate: maximum number of requests per second
+        :arg max_workers: number of concurrent requests
+        :arg retries: number of times a request failing with a network error
+            or an HTTP 503 is retried
+        :arg backoff: delay (in seconds) before the first retry, doubled on
+            each subsequent retry
+        """
+        if backend is None:
+            backend = musicbrainzngs
+        self.backend = backend
+        self.cache = cache
+        self.retries = retries
+        self.backoff = backoff
+
+        self._limiter = RateLimiter(rate)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _request(self, fetch):
+        attempt = 0
+        while True:
+            self._limiter.wait()
+            try:
+                return fetch()
+            except Exception as ex:
+                if attempt >= self.retries or not _is_retryable(ex):
+                    raise
+                delay = self.backoff * 2 ** attempt
+                logging.debug('Request failed (%s), retrying in %.1f s', ex, delay)
+                time.sleep(delay)
+                attempt += 1
+
+    def _submit(self, key, fetch):
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None:
+                return future
+
+            request = lambda: self._request(fetch)
+            future = self._executor.submit(cached_call, self.cache, key, request)
+            self._futures[key] = future
+
+        # Outside of the lock: the callback is called immediately if the
+        # future is already done
+        future.add_done_callback(lambda future: self._forget(key, future))
+        return future
+
+    def _forget(self, key, future):
+        # Only pending lookups are shared; completed ones are in the cache
+        with self._lock:
+            if self._futures.get(key) is future:
+                del self._futures[key]
+
+    def submit_disc(self, discid):
+        """
+        Returns a future of the response of ``get_releases_by_discid``.
+        """
+        return self._submit('disc-' + discid,
+                            lambda: self.backend.get_releases_by_discid(discid))
+
+    def submit_release(self, release_id, includes=RELEASE_INCLUDES):
+        """
+        Returns a future of the response of ``get_release_by_id``.
+        """
+        return self._submit(release_key(release_id, includes),
+                            lambda: self.backend.get_release_by_id(release_id, includes=includes))
+
+    def _stream(self, futures):
+        keys = dict((future, key) for key, future in futures)
+        for future in as_completed(keys):
+            yield keys[future], future
+
+    def discs(self, discids):
+        """
+        Looks up all *discids* and yields tuples ``(discid, future)`` as the
+        responses arrive. The result of the future is the response, or its
+        exception if the lookup failed.
+        """
+        return self._stream([(discid, self.submit_disc(discid))
+                             for discid in set(discids)])
+
+    def releases(self, release_ids, includes=RELEASE_INCLUDES):
+        """
+        Looks up all *release_ids* and yields tuples ``(release_id, future)``
+        as the responses arrive.
+        """
+        return self._stream([(release_id, self.submit_release(release_id, includes))
+                             for release_id in set(release_ids)])
+
+    def close(self):
+        self._executor.shutdown()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python
+"""
+================================================================================
+:mod:`renamer` -- Plan and execution of renames
+================================================================================
+
+.. module:: renamer
+   :synopsis: Plan and execution of renames
+
+Renaming is done in two phases. :class:`RenamePlan` first collects the
+destination of every file and detects the moves that cannot be done: several
+files with the same destination, a destination already taken by another
+file, or moves depending on each other in a cycle. Files already at their
+destination are left alone. :func:`execute` then creates each target
+directory once and runs the moves grouped by target directory, with a
+:class:`musictools.mover.Mover`.
+
+"""
+
+# Standard library modules.
+import os
+import collections
+from concurrent import futures
+
+# Third party modules.
+
+# Local modules.
+from musictools.stats import NullStats
+from musictools.mover import Mover
+
+# Globals and constants variables.
+COLLISION_DUPLICATE = 'duplicate'
+COLLISION_EXISTS = 'exists'
+COLLISION_CYCLE = 'cycle'
+
+Move = collections.namedtuple('Move', ['src', 'dst', 'song'])
+
+Collision = collections.namedtuple('Collision', ['dst', 'srcs', 'reason'])
+
+def _key(filepath):
+    return os.path.normcase(os.path.abspath(filepath))
+
+class RenamePlan(object):
+
+    def __init__(self):
+        """
+        Plan of the moves of a rename run. Files are added with :meth:`add`,
+        then :meth:`close` resolves the plan.
+        After :meth:`close`:
+
+          * :attr:`moves` are the moves to run, in execution order;
+          * :attr:`noops` are the files already at their destination;
+          * :attr:`collisions` are the moves that will not be run.
+        """
+        self.moves = []
+        self.noops = []
+        self.collisions = []
+        self._entries = collections.OrderedDict()
+
+    def add(self, src, dst, song=None):
+        """
+        Plans the move of *src* to *dst*.
+        """
+        self._entries.setdefault(_key(dst), []).append(Move(src, dst, song))
+
+    def close(self):
+        moves = []
+        for entries in self._entries.values():
+            if len(entries) > 1:
+                dst = entries[0].dst
+                srcs = [move.src for move in entries]
+                self.collisions.append(Collision(dst, srcs, COLLISION_DUPLICATE))
+                continue
+
+            move, = entries
+            if _key(move.src) == _key(move.dst) or \
+                    (os.path.exists(move.dst) and os.path.samefile(move.src, move.dst)):
+                self.noops.append(move)
+            else:
+                moves.append(move)
+        self._entries.clear()
+
+        # A destination may only exist if its file is moved away first
+        sources = set(_key(move.src) for move in moves)
+        remaining = []
+        for move in moves:
+            if os.path.lexists(move.dst) and _key(move.dst) not in sources:
+                self.collisions.append(Collision(move.dst, [move.src], COLLISION_EXISTS))
+            else:
+                remaining.append(move)
+
+        self.moves = self._order(remaining)
+
+    def _order(self, moves):
+        """
+        Orders the moves by target directory, then delays the moves whose
+        destination is the source of another pending move.
+        Moves depending on each other in a cycle are collisions.
+        """
+        pending = sorted(moves, key=lambda move: (os.path.dirname(_key(move.dst)),
+                                                  _key(move.dst)))
+        sources = set(_key(move.src) for move in pending)
+
+        ordered = []
+        while pending:
+            blocked = []
+            for move in pending:
+                if _key(move.dst) in sources:
+                    blocked.append(move)
+                else:
+                    ordered.append(move)
+                    sources.discard(_key(move.src))
+
+            if len(blocked) == len(pending):
+                for move in blocked:
+                    self.collisions.append(Collision(move.dst, [move.src], COLLISION_CYCLE))
+                break
+            pending = blocked
+
+        return ordered
+
+    @property
+    def dirpaths(self):
+        """
+        Target directories of the moves, each listed once.
+        """
+        dirpaths = collections.OrderedDict()
+        for move in self.moves:
+            dirpaths[os.path.dirname(move.dst)] = None
+        return list(dirpaths)
+
+def execute(plan, mover=None, stats=None):
+    """
+    Runs the moves of the *plan*. The target directories are created first.
+    Yields a tuple ``(move, error)`` after each move, in the order of the
+    plan, where *error* is ``None`` on success and the exception otherwise;
+    a failed move does not stop the others.
+
+    :arg mover: mover of the files, a :class:`musictools.mover.Mover` with
+        one worker by default
+    :arg stats: statistics of the run
+    :type stats: :class:`musictools.stats.Stats`
+    """
+    if stats is None:
+        stats = NullStats()
+
+    for dirpath in plan.dirpaths:
+        with stats.phase('makedirs'):
+            os.makedirs(dirpath, exist_ok=True)
+
+    if mover is None:
+        with Mover(max_workers=1, stats=stats) as mover:
+            for result in _execute(plan, mover):
+                yield result
+    else:
+        for result in _execute(plan, mover):
+            yield result
+
+def _execute(plan, mover):
+    # Copies across file systems run concurrently: at most twice as many
+    # moves as workers are in flight.
+    window = mover.max_workers * 2
+    pending = collections.deque()
+    inflight = {}
+
+    for entry in plan.moves:
+        # A move onto the source of a previous move waits for it
+        future = inflight.get(_key(entry.dst))
+        if future is not None:
+            futures.wait([future])
+
+        future = mover.submit(entry.src, entry.dst)
+        inflight[_key(entry.src)] = future
+        pending.append((entry, future))
+
+        while len(pending) > window:
+            yield _result(pending.popleft(), inflight)
+
+    while pending:
+        yield _result(pending.popleft(), inflight)
+
+def _result(item, inflight):
+    entry, future = item
+    inflight.pop(_key(entry.src), None)
+    return entry, future.exception()
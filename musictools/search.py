@@ -0,0 +1,399 @@
+#!/usr/bin/env python
+"""
+================================================================================
+:mod:`search` -- Search index of songs
+================================================================================
+
+.. module:: search
+   :synopsis: Search index of songs
+
+Inverted index of the tokens of the artists, album titles and titles of
+songs. Tokens are the words of the :func:`musictools.utils.slugify` version
+of the tags: lower case ASCII letters and digits, so that a search ignores
+case, accents and punctuation.
+
+:class:`SearchIndexBuilder` collects the songs, for instance while a
+library is scanned, and saves the index in a single file. The file is
+memory mapped by :class:`SearchIndex`: opening it reads nothing but its
+header and a search only touches the pages of the terms and postings it
+needs, so a query on a large library is answered quickly even from a cold
+process.
+
+File format (little endian)::
+
+    header       magic, version, number of terms, number of songs,
+                 number of postings, size of the terms, size of the paths
+    uint32       offsets of the terms (number of terms + 1)
+    uint32       offsets of the postings of the terms (number of terms + 1)
+    uint32       postings: song numbers, sorted for each term
+    uint32       offsets of the paths (number of songs + 1)
+    bytes        terms, sorted, concatenated
+    bytes        paths of the songs, UTF-8, concatenated
+
+"""
+
+# Standard library modules.
+import os
+import re
+import sys
+import mmap
+import array
+import bisect
+import struct
+import tempfile
+import itertools
+
+# Third party modules.
+
+# Local modules.
+from musictools.utils import slugify
+
+# Globals and constants variables.
+MAGIC = b'MTSI'
+VERSION = 1
+
+MIN_FUZZY_LENGTH = 3
+
+_HEADER = struct.Struct('<4s6I')
+
+_TOKEN = re.compile('[a-z0-9]+')
+
+_ALPHABET = 'abcdefghijklmnopqrstuvwxyz0123456789'
+
+class InvalidIndexError(Exception):
+    pass
+
+def tokenize(text):
+    """
+    Returns the list of search tokens of *text*.
+    """
+    return _TOKEN.findall(slugify(text))
+
+def song_tokens(song):
+    """
+    Returns the set of search tokens of the artists, album title and title
+    of *song*.
+    """
+    tokens = set(tokenize(song.albumtitle))
+    tokens.update(tokenize(song.title))
+    for artist in song.artists:
+        tokens.update(tokenize(artist.name))
+    return tokens
+
+def _uint32_array(data):
+    """
+    Returns a sequence of the unsigned 32-bit little endian integers of
+    the buffer *data*, without copying it when possible.
+    """
+    if sys.byteorder == 'little':
+        return memoryview(data).cast('I')
+    values = array.array('I', bytes(data)) #pragma: no cover
+    values.byteswap() #pragma: no cover
+    return values #pragma: no cover
+
+class SearchIndexBuilder(object):
+
+    def __init__(self):
+        """
+        Builder of a search index. Songs are added with :meth:`add` (an
+        added song replaces the entry of the same path) and removed with
+        :meth:`remove`; :meth:`save` writes the index.
+        """
+        self._tokens = {} # filepath: tokens
+
+    @classmethod
+    def from_index(cls, index):
+        """
+        Returns a builder with the songs of the :class:`SearchIndex`
+        *index*, to update it.
+        """
+        builder = cls()
+        filepaths = [index.path(docid) for docid in range(len(index))]
+        for filepath in filepaths:
+            builder._tokens[filepath] = set()
+        for term, docids in index.iter_postings():
+            for docid in docids:
+                builder._tokens[filepaths[docid]].add(term)
+        return builder
+
+    def __len__(self):
+        return len(self._tokens)
+
+    def __contains__(self, filepath):
+        return filepath in self._tokens
+
+    def add(self, song):
+        """
+        Adds the tokens of *song*, a :class:`musictools.song.Song`.
+        """
+        self._tokens[song.filepath] = song_tokens(song)
+
+    def remove(self, filepath):
+        """
+        Removes the song of *filepath*, if any.
+        """
+        self._tokens.pop(filepath, None)
+
+    def save(self, filepath):
+        """
+        Writes the index to *filepath*. The file is replaced atomically.
+        """
+        filepaths = sorted(self._tokens)
+        postings = {}
+        for docid, songpath in enumerate(filepaths):
+            for token in self._tokens[songpath]:
+                postings.setdefault(token, []).append(docid)
+        terms = sorted(postings)
+
+        term_blobs = [term.encode('ascii') for term in terms]
+        path_blobs = [os.fsencode(songpath) for songpath in filepaths]
+
+        def offsets(lengths):
+            return array.array('I', itertools.accumulate(itertools.chain([0], lengths)))
+
+        term_offsets = offsets(map(len, term_blobs))
+        posting_offsets = offsets(len(postings[term]) for term in terms)
+        path_offsets = offsets(map(len, path_blobs))
+        docids = array.array('I', itertools.chain.from_iterable(postings[term] for term in terms))
+
+        header = _HEADER.pack(MAGIC, VERSION, len(terms), len(filepaths), len(docids),
+                              term_offsets[-1], path_offsets[-1])
+        if sys.byteorder != 'little': #pragma: no cover
+            for values in (term_offsets, posting_offsets, path_offsets, docids):
+                values.byteswap()
+
+        dirpath, filename = os.path.split(filepath)
+        fd, tmpfilepath = tempfile.mkstemp(prefix='.' + filename, suffix='.tmp',
+                                           dir=dirpath or '.')
+        try:
+            with open(fd, 'wb') as fp:
+                fp.write(header)
+                for values in (term_offsets, posting_offsets, docids, path_offsets):
+                    values.tofile(fp)
+                fp.writelines(term_blobs)
+                fp.writelines(path_blobs)
+            os.replace(tmpfilepath, filepath)
+        except:
+            os.remove(tmpfilepath)
+            raise
+
+class _Terms(object):
+    # Sequence of the terms of the index, for bisect
+
+    def __init__(self, offsets, blob):
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, index):
+        return bytes(self._blob[self._offsets[index]:self._offsets[index + 1]])
+
+class SearchIndex(object):
+
+    def __init__(self, filepath):
+        """
+        Opens the search index saved in *filepath*.
+
+        :raise InvalidIndexError: if the file is not a search index
+        """
+        self.filepath = filepath
+        with open(filepath, 'rb') as fp:
+            try:
+                self._mmap = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError: # empty file
+                raise InvalidIndexError('Empty file')
+
+        try:
+            self._load()
+        except:
+            self.close()
+            raise
+
+    def _load(self):
+        if len(self._mmap) < _HEADER.size:
+            raise InvalidIndexError('Truncated header')
+        magic, version, nterms, ndocs, npostings, terms_size, paths_size = \
+            _HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise InvalidIndexError('Not a search index')
+        if version != VERSION:
+            raise InvalidIndexError('Unsupported version %i' % version)
+
+        sizes = [4 * (nterms + 1), 4 * (nterms + 1), 4 * npostings, 4 * (ndocs + 1),
+                 terms_size, paths_size]
+        if _HEADER.size + sum(sizes) > len(self._mmap):
+            raise InvalidIndexError('Truncated index')
+
+        view = memoryview(self._mmap)
+        sections = []
+        offset = _HEADER.size
+        for size in sizes:
+            sections.append(view[offset:offset + size])
+            offset += size
+        self._views = [view] + sections
+
+        term_offsets, posting_offsets, postings, path_offsets, terms, paths = sections
+        self._terms = _Terms(_uint32_array(term_offsets), terms)
+        self._posting_offsets = _uint32_array(posting_offsets)
+        self._postings = _uint32_array(postings)
+        self._path_offsets = _uint32_array(path_offsets)
+        self._paths = paths
+        self._views.extend(value for value in (self._terms._offsets, self._posting_offsets,
+                                               self._postings, self._path_offsets)
+                           if isinstance(value, memoryview))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def __len__(self):
+        return len(self._path_offsets) - 1
+
+    def path(self, docid):
+        """
+        Returns the path of the song number *docid*.
+        """
+        start, end = self._path_offsets[docid], self._path_offsets[docid + 1]
+        return os.fsdecode(bytes(self._paths[start:end]))
+
+    def _postings_of(self, index):
+        return self._postings[self._posting_offsets[index]:self._posting_offsets[index + 1]]
+
+    def iter_postings(self):
+        """
+        Yields each term of the index and the song numbers of its postings.
+        """
+        for index in range(len(self._terms)):
+            yield self._terms[index].decode('ascii'), self._postings_of(index)
+
+    def _find(self, term, start=0, end=None):
+        # Index of the term, or None
+        key = term.encode('ascii')
+        end = len(self._terms) if end is None else end
+        index = bisect.bisect_left(self._terms, key, start, end)
+        if index < end and self._terms[index] == key:
+            return index
+        return None
+
+    def _find_prefix(self, prefix, start=0, end=None):
+        # Range of the indexes of the terms starting with prefix
+        key = prefix.encode('ascii')
+        end = len(self._terms) if end is None else end
+        start = bisect.bisect_left(self._terms, key, start, end)
+        end = bisect.bisect_left(self._terms, key + b'\xff', start, end)
+        return range(start, end)
+
+    def _find_edits(self, token):
+        """
+        Returns the indexes of the terms at an edit distance of one from
+        *token* (deletion, substitution, insertion or transposition of a
+        character). Each candidate is only looked for among the terms
+        starting like it, and none is looked for past the first prefix of
+        *token* that no term starts with.
+        """
+        indexes = set()
+        bounds = range(len(self._terms))
+        for i in range(len(token) + 1):
+            left, right = token[:i], token[i:]
+            bounds = self._find_prefix(left, bounds.start, bounds.stop)
+            if not bounds:
+                break
+
+            candidates = [(left + right[1:], bounds)] if right else []
+            if len(right) > 1:
+                candidates.append((left + right[1] + right[0] + right[2:], bounds))
+            for char in _ALPHABET:
+                subbounds = self._find_prefix(left + char, bounds.start, bounds.stop)
+                if subbounds:
+                    candidates.append((left + char + right, subbounds))
+                    if right:
+                        candidates.append((left + char + right[1:], subbounds))
+
+            for candidate, candidate_bounds in candidates:
+                index = self._find(candidate, candidate_bounds.start, candidate_bounds.stop)
+                if index is not None:
+                    indexes.add(index)
+
+        return indexes
+
+    def terms(self, token, prefix=False, fuzzy=False):
+        """
+        Returns the sorted list of the terms matching *token*: the term
+        equal to *token* and, with *prefix*, the terms starting with it and,
+        with *fuzzy*, the terms at an edit distance of one from it (for
+        tokens of at least :data:`MIN_FUZZY_LENGTH` characters).
+        """
+        return [self._terms[index].decode('ascii')
+                for index in self._match(token, prefix, fuzzy)]
+
+    def _match(self, token, prefix, fuzzy):
+        if prefix:
+            indexes = set(self._find_prefix(token))
+        else:
+            indexes = set()
+            index = self._find(token)
+            if index is not None:
+                indexes.add(index)
+
+        if fuzzy and len(token) >= MIN_FUZZY_LENGTH:
+            indexes.update(self._find_edits(token))
+
+        return sorted(indexes)
+
+    def search(self, query, prefix=True, fuzzy=False, limit=None):
+        """
+        Returns the paths of the songs matching all the tokens of *query*,
+        in the order of their paths.
+
+        :arg prefix: whether a token matches the terms starting with it
+        :arg fuzzy: whether a token matches the terms with a typo (see
+            :meth:`terms`)
+        :arg limit: maximum number of paths returned
+        """
+        matches = []
+        for token in set(tokenize(query)):
+            indexes = self._match(token, prefix, fuzzy)
+            if not indexes:
+                return []
+            size = sum(self._posting_offsets[index + 1] - self._posting_offsets[index]
+                       for index in indexes)
+            matches.append((size, indexes))
+        if not matches:
+            return []
+
+        # Start from the least frequent token
+        matches.sort(key=lambda match: match[0])
+        _size, indexes = matches[0]
+        docids = set()
+        for index in indexes:
+            docids.update(self._postings_of(index))
+
+        for size, indexes in matches[1:]:
+            if not docids:
+                break
+            if len(docids) * len(indexes) < size:
+                docids = set(docid for docid in docids
+                             if any(self._contains(index, docid) for index in indexes))
+            else:
+                others = set()
+                for index in indexes:
+                    others.update(self._postings_of(index))
+                docids &= others
+
+        docids = sorted(docids)[:limit]
+        return [self.path(docid) for docid in docids]
+
+    def _contains(self, index, docid):
+        postings = self._postings_of(index)
+        position = bisect.bisect_left(postings, docid)
+        return position < len(postings) and postings[position] == docid
+
+    def close(self):
+        for view in reversed(getattr(self, '_views', [])):
+            view.release()
+        self._views = []
+        self._mmap.close()
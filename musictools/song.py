@@ -11,42 +11,135 @@
 
 # Standard library modules.
 import os
-import re
+import sys
+import shutil
+import weakref
+import base64
+import tempfile
 import warnings
+import threading
+import collections
 
 # Third party modules.
 import mutagen.id3 as id3
+import mutagen.mp3 as mp3
 import mutagen.oggvorbis as ogg
+import mutagen.flac as flac
+from mutagen.ogg import OggPage
 
 # Local modules.
-from musictools.utils import unicode_to_ascii
+from musictools.utils import slugify
+from musictools.tagreader import \
+    (read_id3_frames, read_id3_picture, read_vorbis_comments, id3_tag_size,
+     UnsupportedTagError, Picture, ID3_TEXT_FRAMES, VORBIS_BINARY_COMMENTS,
+     PICTURE_TYPE_FRONT_COVER)
 
 # Globals and constants variables.
 EXTENSION_MP3 = 'mp3'
 EXTENSION_OGG = 'ogg'
 
-def _format(text):
-    text = unicode_to_ascii(text)
-    text = text.lower()
-    text = re.sub(r"[^a-z0-9()\-\[\]\s]", "", text)
-    text = re.sub(r'\W', '_', text)
-    text = re.sub('_+', '_', text)
-    text = text.rstrip('_')
-    return text
+DEFAULT_PADDING = 4096
+
+# Number of saves done in place and by rewriting the whole file
+save_statistics = collections.Counter(inplace=0, rewrite=0)
+_save_statistics_lock = threading.Lock()
+
+class _RewriteRequired(Exception):
+    pass
+
+def _inplace_padding(info):
+    # Keep the existing padding; abort the save if the tag does not fit.
+    if info.padding < 0:
+        raise _RewriteRequired
+    return info.padding
+
+def _ogg_header_pages(fp):
+    """
+    Returns the pages of the Vorbis header packets of the Ogg file *fp*, up
+    to the page where the comment header ends.
+    """
+    fp.seek(0)
+    pages = [OggPage(fp)]
+    while not pages[-1].packets[0].startswith(b'\x03vorbis'):
+        pages.append(OggPage(fp))
+
+    serial = pages[-1].serial
+    while not (pages[-1].complete or len(pages[-1].packets) > 1):
+        pages.append(OggPage(fp))
+        while pages[-1].serial != serial:
+            pages.append(OggPage(fp))
+    return pages
+
+def _ogg_last_sequence(fp, serial):
+    # Sequence number of the last page of the logical bitstream serial
+    sequence = None
+    while True:
+        try:
+            page = OggPage(fp)
+        except EOFError:
+            return sequence
+        if page.serial == serial:
+            sequence = page.sequence
+
+def _rewrite(filepath, write):
+    """
+    Rewrites *filepath* atomically: *write* is called with the path of a
+    temporary file in the same directory and an open file object on the
+    original file; the temporary file then replaces the original one.
+    """
+    dirpath, filename = os.path.split(filepath)
+    fd, tmpfilepath = tempfile.mkstemp(prefix='.' + filename, suffix='.tmp',
+                                       dir=dirpath or '.')
+    try:
+        with open(fd, 'wb') as tmpfp, open(filepath, 'rb') as fp:
+            write(tmpfilepath, tmpfp, fp)
+            tmpfp.flush()
+            os.fsync(tmpfp.fileno())
+        shutil.copymode(filepath, tmpfilepath)
+        os.replace(tmpfilepath, filepath)
+    except:
+        os.remove(tmpfilepath)
+        raise
 
 class Artist(object):
+    """
+    Immutable artist.
+    Artists are interned: creating an artist with the same name as an
+    existing one returns the existing instance.
+    """
 
-    def __init__(self, name=None, firstname=None, lastname=None):
+    __slots__ = ('_firstname', '_lastname', '__weakref__')
+
+    _pool = weakref.WeakValueDictionary()
+
+    def __new__(cls, name=None, firstname=None, lastname=None):
         if name is not None:
-            firstname, lastname = self._split_name(name)
+            firstname, lastname = cls._split_name(name)
+
+        key = (cls, firstname.strip(), lastname.strip())
+        artist = cls._pool.get(key)
+        if artist is None:
+            artist = object.__new__(cls)
+            object.__setattr__(artist, '_firstname', sys.intern(key[1]))
+            object.__setattr__(artist, '_lastname', sys.intern(key[2]))
+            cls._pool[key] = artist
+
+        return artist
 
-        self._firstname = firstname.strip()
-        self._lastname = lastname.strip()
+    def __setattr__(self, name, value):
+        raise AttributeError("Artist is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Artist is immutable")
+
+    def __reduce__(self):
+        return (self.__class__, (None, self._firstname, self._lastname))
 
     def __repr__(self):
         return '<Artist({})>'.format(self.name)
 
-    def _split_name(self, name):
+    @staticmethod
+    def _split_name(name):
         name = name.strip()
         names = name.split(' ')
         firstname = ' '.join(names[:-1])
@@ -79,222 +172,596 @@ class Artist(object):
     def __hash__(self):
         return hash((self.__class__, self._firstname, self._lastname))
 
+# Placeholder of the tag attributes not decoded yet
+_UNSET = object()
+
+Diagnostic = collections.namedtuple('Diagnostic', ['filepath', 'field', 'message'])
+
+# Tag attributes, in the order they are decoded by an eager read
+FIELDS = ('artists', 'title', 'albumtitle', 'tracknumber', 'description',
+          'year', 'genre', 'discnumber')
+
+# Tag attributes written by Song.save
+_SAVED_FIELDS = ('artists', 'albumtitle', 'title', 'tracknumber',
+                 'description', 'year', 'genre')
+
+# Snapshot of the saved tag attributes, before any of them is read
+_NOT_READ = (None,) * len(_SAVED_FIELDS)
+
+_DEFAULTS = {'albumtitle': '', 'title': '', 'tracknumber': 0,
+             'description': '', 'year': 0, 'genre': '', 'discnumber': 0}
+
+_MISSING_MESSAGES = {'title': 'a title',
+                     'albumtitle': 'an album title',
+                     'tracknumber': 'a track number',
+                     'year': 'a year',
+                     'genre': 'a genre',
+                     'discnumber': 'a disc number'}
+
+def _front_cover(pictures):
+    # Front cover, or the first picture; pictures are read until found
+    first = None
+    for picture in pictures:
+        if picture.type == PICTURE_TYPE_FRONT_COVER:
+            return picture
+        if first is None:
+            first = picture
+    return first
+
+def _tag_property(name):
+    attr = '_' + name
+
+    def fget(self):
+        value = getattr(self, attr)
+        if value is _UNSET:
+            value = self._decode(name)
+        return value
+
+    def fset(self, value):
+        setattr(self, attr, value)
+
+    return property(fget, fset)
+
 class Song(object):
 
-    def __init__(self, filepath):
+    __slots__ = ('filepath', 'filetype', '_artists', '_albumtitle', '_title',
+                 '_tracknumber', '_description', '_year', '_genre',
+                 '_discnumber', '_length', '_tags', '_frames', '_binary_frames',
+                 '_original', '_missing')
+
+    def __init__(self, filepath, lazy=False):
+        """
+        Reads the tags of the file *filepath*.
+
+        If *lazy* is ``False``, all tags are read and decoded immediately and
+        a warning is emitted for each missing tag. If *lazy* is ``True``,
+        the file is only read when a tag attribute is first accessed, only
+        the accessed attributes are decoded and no warning is emitted.
+        In both cases, the missing tags are listed in :attr:`diagnostics`.
+        """
+        self._reset(filepath)
+
+        if not lazy:
+            for name in FIELDS:
+                getattr(self, name)
+            for name in self._missing:
+                warnings.warn(self._missing_message(name))
+
+    @classmethod
+    def open(cls, filepath):
+        """
+        Returns the song of *filepath*, read lazily.
+        """
+        return cls(filepath, lazy=True)
+
+    @classmethod
+    def from_index(cls, library, filepath, read=True):
+        """
+        Returns the song of *filepath* as stored in the *library* index.
+        The file is only read if it is not indexed yet or if its size or
+        modification time changed since it was indexed.
+
+        :arg library: index of songs
+        :type library: :class:`musictools.library.Library`
+        :arg read: if ``False``, ``None`` is returned instead of reading
+            the file when it is not indexed yet or changed
+        """
+        fields = library.lookup(filepath)
+        if fields is None:
+            if not read:
+                return None
+            song = cls(filepath)
+            library.add(song)
+            return song
+
+        return cls._from_fields(filepath, fields)
+
+    @classmethod
+    def _from_fields(cls, filepath, fields):
+        song = cls.__new__(cls)
+        song._reset(filepath)
+        for name, value in fields.items():
+            setattr(song, name, value)
+        song._original = song._snapshot()
+        return song
+
+    def _reset(self, filepath):
         self.filepath = filepath
         _root, extension = os.path.splitext(filepath)
 
-        # Reset
-        self.artists = []
-        self.albumtitle = ''
-        self.title = ''
-        self.tracknumber = 0
-        self.description = ''
-        self.year = 0
-        self.genre = ''
-        self.discnumber = 0
+        for name in FIELDS:
+            setattr(self, '_' + name, _UNSET)
+        self._length = None
+        self._tags = None
+        self._frames = None
+        self._binary_frames = None
+        self._original = _NOT_READ
+        self._missing = ()
 
         if extension == '.' + EXTENSION_MP3:
             self.filetype = EXTENSION_MP3
-            self._read_mp3(filepath)
         elif extension == '.' + EXTENSION_OGG:
             self.filetype = EXTENSION_OGG
-            self._read_ogg(filepath)
         else:
             raise IOError("Invalid extension (%s)" % extension)
 
+    def __getstate__(self):
+        state = dict((name, getattr(self, name)) for name in self.__slots__)
+        state['_tags'] = None # not picklable, parsed again if needed
+        state['_frames'] = None # parsed again if needed
+        state['_binary_frames'] = None
+        for name in FIELDS: # the placeholder is not picklable
+            if state['_' + name] is _UNSET:
+                del state['_' + name]
+        return state
+
+    def __setstate__(self, state):
+        for name in FIELDS:
+            setattr(self, '_' + name, _UNSET)
+        for name, value in state.items():
+            setattr(self, name, value)
+
     def __repr__(self):
-        artists = ','.join(self.artists)
+        artists = ','.join(artist.name for artist in self.artists)
         return "<Song(%i - %s - %s (%i) by %s)>" % \
             (self.tracknumber, self.title, self.albumtitle, self.year, artists)
 
-    def _read_mp3(self, filepath):
-        mp3info = id3.ID3(filepath)
+    artists = _tag_property('artists')
+    albumtitle = _tag_property('albumtitle')
+    title = _tag_property('title')
+    tracknumber = _tag_property('tracknumber')
+    description = _tag_property('description')
+    year = _tag_property('year')
+    genre = _tag_property('genre')
+    discnumber = _tag_property('discnumber')
 
-        for code in ['TPE1', 'TPE2', 'TPE3', 'TPE4']:
-            author = mp3info.get(code)
-            if not author:
-                continue
-            if not author.text[0]:
-                continue
+    def _load_frames(self):
+        """
+        Returns the raw tags of the file: a :class:`dict` of the ID3 frame
+        ids or Vorbis comment names and their lists of values. They are read
+        once and kept until all the tag attributes are decoded.
+        Binary frames and comments (cover art, ...) are not read; the
+        position of the ID3 binary frames is kept in :attr:`_binary_frames`.
+        """
+        if self._frames is not None:
+            return self._frames
 
-            artist = Artist(name=author.text[0])
+        if self.filetype == EXTENSION_MP3:
+            try:
+                frames, binary_frames = read_id3_frames(self.filepath)
+                self._binary_frames = tuple(binary_frames)
+            except UnsupportedTagError:
+                mp3info = self._tags = id3.ID3(self.filepath)
+                frames = {}
+                for code in ID3_TEXT_FRAMES:
+                    frame = mp3info.get(code)
+                    if frame is not None:
+                        frames[code] = [str(text) for text in frame.text]
+        else:
+            try:
+                frames = read_vorbis_comments(self.filepath,
+                                              skip=VORBIS_BINARY_COMMENTS)
+            except UnsupportedTagError:
+                self._tags = ogg.OggVorbis(self.filepath)
+                frames = self._tags.tags.as_dict()
 
-            if artist not in self.artists:
-                self.artists.append(artist)
+        self._frames = frames
+        return frames
 
-        title = mp3info.get('TIT2', mp3info.get('TIT1'))
-        if title is not None:
-            self.title = str(title.text[0])
-        else:
-            warnings.warn("Song (%s) does not have a title." % filepath)
+    def _decode(self, name):
+        """
+        Decodes the tag attribute *name* from the raw tags and returns it.
+        """
+        decoder = getattr(self, '_decode_%s_%s' % (self.filetype, name))
+        value = decoder(self._load_frames())
 
-        albumtitle = mp3info.get('TALB')
-        if albumtitle is not None:
-            self.albumtitle = str(albumtitle.text[0])
-        else:
-            warnings.warn("Song (%s) does not have an album title." % filepath)
+        if value is None:
+            value = _DEFAULTS[name]
+            if name in _MISSING_MESSAGES:
+                self._missing += (name,)
 
-        tracknumber = mp3info.get('TRCK')
-        if tracknumber is not None:
-            self.tracknumber = int(tracknumber.text[0].split('/')[0])
-        else:
-            warnings.warn("Song (%s) does not have a track number." % filepath)
+        setattr(self, '_' + name, value)
 
-#        description = mp3info.get('TIT2')
-#        if description is not None: description = description.text[0]
-#        self.set_description(description)
+        # The raw tags are not needed anymore once all attributes are decoded
+        if all(getattr(self, '_' + field) is not _UNSET for field in FIELDS):
+            self._frames = None
 
-        year = mp3info.get('TYER', mp3info.get('TDRC'))
-        if year is not None:
-            self.year = int(str(year.text[0]))
-        else:
-            warnings.warn("Song (%s) does not have a year." % filepath)
+        if name in _SAVED_FIELDS:
+            index = _SAVED_FIELDS.index(name)
+            original = self._original
+            self._original = original[:index] + \
+                (self._snapshot_value(name, value),) + original[index + 1:]
 
-        genre = mp3info.get('TCON')
-        if genre is not None:
-            self.genre = genre.text[0]
-        else:
-            warnings.warn("Song (%s) does not have a genre." % filepath)
+        return value
 
-        disc = mp3info.get('TPOS')
-        if disc is not None:
-            discnumber, total = map(int, disc.text[0].split('/'))
-            self.discnumber = discnumber if total >= 2 else 0
-        else:
-            warnings.warn("Song (%s) does not have a disc number." % filepath)
+    def _missing_message(self, name):
+        return "Song (%s) does not have %s." % (self.filepath, _MISSING_MESSAGES[name])
+
+    @property
+    def diagnostics(self):
+        """
+        List of the :class:`Diagnostic` of the missing tags, among the
+        decoded attributes.
+        """
+        return [Diagnostic(self.filepath, name, self._missing_message(name))
+                for name in self._missing]
 
-    def _read_ogg(self, filepath):
-        ogginfo = ogg.OggVorbis(filepath)
+    def _decode_mp3_artists(self, frames):
+        artists = []
+        for code in ['TPE1', 'TPE2', 'TPE3', 'TPE4']:
+            author = frames.get(code)
+            if not author:
+                continue
+            if not author[0]:
+                continue
 
-        authors = ogginfo.get('artist')
-        for author in authors:
+            artist = Artist(name=author[0])
+
+            if artist not in artists:
+                artists.append(artist)
+        return artists
+
+    def _decode_mp3_title(self, frames):
+        title = frames.get('TIT2', frames.get('TIT1'))
+        if title:
+            return title[0]
+
+    def _decode_mp3_albumtitle(self, frames):
+        albumtitle = frames.get('TALB')
+        if albumtitle:
+            return sys.intern(albumtitle[0])
+
+    def _decode_mp3_tracknumber(self, frames):
+        tracknumber = frames.get('TRCK')
+        if tracknumber:
+            return int(tracknumber[0].split('/')[0])
+
+    def _decode_mp3_description(self, frames):
+        return '' # not read
+
+    def _decode_mp3_year(self, frames):
+        year = frames.get('TYER', frames.get('TDRC'))
+        if year:
+            return int(year[0])
+
+    def _decode_mp3_genre(self, frames):
+        genre = frames.get('TCON')
+        if genre:
+            return sys.intern(genre[0])
+
+    def _decode_mp3_discnumber(self, frames):
+        disc = frames.get('TPOS')
+        if disc:
+            discnumber, total = map(int, disc[0].split('/'))
+            return discnumber if total >= 2 else 0
+
+    def _decode_ogg_artists(self, frames):
+        artists = []
+        for author in frames.get('artist', []):
             artist = Artist(author)
-            if artist not in self.artists:
-                self.artists.append(artist)
+            if artist not in artists:
+                artists.append(artist)
+        return artists
 
-        title = ogginfo.get('title')
+    def _decode_ogg_title(self, frames):
+        title = frames.get('title')
         if title is not None:
-            self.title = str(title[0])
-        else:
-            warnings.warn("Song (%s) does not have a title." % filepath)
+            return str(title[0])
 
-        albumtitle = ogginfo.get('album')
+    def _decode_ogg_albumtitle(self, frames):
+        albumtitle = frames.get('album')
         if albumtitle is not None:
-            self.albumtitle = str(albumtitle[0])
-        else:
-            warnings.warn("Song (%s) does not have an album title." % filepath)
+            return sys.intern(str(albumtitle[0]))
 
-        tracknumber = ogginfo.get('tracknumber')
+    def _decode_ogg_tracknumber(self, frames):
+        tracknumber = frames.get('tracknumber')
         if tracknumber is not None:
-            self.tracknumber = int(tracknumber[0])
-        else:
-            warnings.warn("Song (%s) does not have a track number." % filepath)
+            return int(tracknumber[0])
 
-#        description = ogginfo.get('description')
-#        if description is not None:
-#            description = description[0]
-#        else:
-#            description = ''
-#        self.set_description(description)
+    def _decode_ogg_description(self, frames):
+        return '' # not read
 
-        year = ogginfo.get('date')
+    def _decode_ogg_year(self, frames):
+        year = frames.get('date')
         if year is not None:
-            self.year = int(year[0])
-        else:
-            warnings.warn("Song (%s) does not have a year." % filepath)
+            return int(year[0])
 
-        genre = ogginfo.get('genre')
+    def _decode_ogg_genre(self, frames):
+        genre = frames.get('genre')
         if genre is not None:
-            self.genre = genre[0]
+            return sys.intern(genre[0])
+
+    def _decode_ogg_discnumber(self, frames):
+        return 0 # not read
+
+    @property
+    def length(self):
+        """
+        Length of the track in seconds.
+        It is only computed when first accessed, as it requires to read the
+        audio stream and not only the tags.
+        """
+        if self._length is None:
+            if self.filetype == EXTENSION_MP3:
+                self._length = mp3.MP3(self.filepath).info.length
+            else:
+                self._length = ogg.OggVorbis(self.filepath).info.length
+        return self._length
+
+    @property
+    def cover_art(self):
+        """
+        Cover art of the song as a :class:`musictools.tagreader.Picture`, or
+        ``None`` if the file has no picture. The front cover is preferred
+        over other pictures.
+        The picture is read from the file each time this attribute is
+        accessed; it is never kept in memory with the song.
+        """
+        if self.filetype == EXTENSION_MP3:
+            return self._read_mp3_cover_art()
         else:
-            warnings.warn("Song (%s) does not have a genre." % filepath)
+            return self._read_ogg_cover_art()
+
+    def _cover_art_tags(self, loader):
+        # Tags parsed by mutagen while reading are reused, but tags parsed
+        # for the pictures are not kept
+        if self._tags is not None and self._tags.filename == self.filepath:
+            return self._tags
+        return loader(self.filepath)
+
+    def _read_mp3_cover_art(self):
+        if self._binary_frames is None and self._tags is None:
+            self._load_frames()
+        if self._binary_frames is not None:
+            apics = [frame for frame in self._binary_frames if frame.frameid == 'APIC']
+            try:
+                return _front_cover(read_id3_picture(self.filepath, frame)
+                                    for frame in apics)
+            except UnsupportedTagError:
+                pass
+
+        mp3info = self._cover_art_tags(id3.ID3)
+        return _front_cover(Picture(frame.mime, frame.type, frame.desc, frame.data)
+                            for frame in mp3info.getall('APIC'))
+
+    def _read_ogg_cover_art(self):
+        tags = self._cover_art_tags(ogg.OggVorbis).tags or {}
+
+        def pictures():
+            for value in tags.get('metadata_block_picture', []):
+                try:
+                    picture = flac.Picture(base64.b64decode(value))
+                except (ValueError, flac.error):
+                    continue
+                yield Picture(picture.mime, picture.type, picture.desc, picture.data)
+
+        return _front_cover(pictures())
 
     @property
     def formatted_filename(self):
         if self.discnumber != 0:
             return "{:02d}-{:02d}_{}.{}".format(self.discnumber, self.tracknumber,
-                                                _format(self.title), self.filetype)
+                                                slugify(self.title), self.filetype)
         else:
-            return "{:02d}_{}.{}".format(self.tracknumber, _format(self.title), self.filetype)
+            return "{:02d}_{}.{}".format(self.tracknumber, slugify(self.title), self.filetype)
 
     @property
     def formatted_dirname(self):
-        return os.path.join(_format(self.artists[0].name), _format(self.albumtitle))
+        return os.path.join(slugify(self.artists[0].name), slugify(self.albumtitle))
+
+    @staticmethod
+    def _snapshot_value(name, value):
+        # Artists are immutable and shared, the list is not
+        if name == 'artists':
+            return tuple(value)
+        return value
+
+    def _snapshot(self):
+        # Tuple of the values of _SAVED_FIELDS, None for the attributes not
+        # decoded yet (they cannot have been modified)
+        snapshot = []
+        for name in _SAVED_FIELDS:
+            value = getattr(self, '_' + name)
+            if value is _UNSET:
+                snapshot.append(None)
+            else:
+                snapshot.append(self._snapshot_value(name, value))
+        return tuple(snapshot)
 
-    def save(self):
+    @property
+    def modified_fields(self):
+        """
+        Set of the names of the tag attributes that were modified since the
+        file was read or last saved.
+        """
+        current = self._snapshot()
+        return set(name for name, value, original in
+                   zip(_SAVED_FIELDS, current, self._original)
+                   if value is not None and value != original)
+
+    def _load_tags(self, loader):
+        # Reuse the tags parsed by mutagen while reading, if any
+        if self._tags is None or self._tags.filename != self.filepath:
+            self._tags = loader(self.filepath)
+        return self._tags
+
+    def save(self, padding=DEFAULT_PADDING):
         """
         Saves the information to the current file or new file.
+        Only the tags of the modified attributes are written; nothing is
+        written if no attribute was modified.
+
+        The tags are written in place, using the existing padding, whenever
+        they fit. Otherwise, the whole file is rewritten to a temporary file
+        with *padding* bytes reserved for future changes, which then
+        atomically replaces the original file. The number of saves of each
+        kind is counted in :data:`save_statistics`.
+
+        :arg padding: padding (in bytes) reserved when the file is rewritten
         """
+        fields = self.modified_fields
+        if not fields:
+            return
+
         if self.filetype == EXTENSION_MP3:
-            self._save_mp3(self.filepath)
+            tags = self._load_tags(id3.ID3)
+            self._update_mp3(tags, fields)
         elif self.filetype == EXTENSION_OGG:
-            self._save_ogg(self.filepath)
+            tags = self._load_tags(ogg.OggVorbis)
+            self._update_ogg(tags, fields)
         else:
             raise IOError("Invalid extension (%s)" % self.filetype)
 
-    def _save_mp3(self, filepath):
-        mp3info = id3.ID3(filepath)
-
-        if len(self.artists) >= 1:
-            text = id3.TPE1(encoding=3, text=[self.artists[0].name])
-            mp3info['TPE1'] = text
-        if len(self.artists) >= 2:
-            text = id3.TPE2(encoding=3, text=[self.artists[1].name])
-            mp3info['TPE2'] = text
-        if len(self.artists) >= 3:
-            text = id3.TPE3(encoding=3, text=[self.artists[2].name])
-            mp3info['TPE3'] = text
-        if len(self.artists) >= 4:
-            text = id3.TPE4(encoding=3, text=[self.artists[3].name])
-            mp3info['TPE4'] = text
-
-        TIT2 = id3.TIT2(encoding=3, text=self.title)
-        mp3info['TIT2'] = TIT2
-
-        TALB = id3.TALB(encoding=3, text=self.albumtitle)
-        mp3info['TALB'] = TALB
-
-        TRCK = id3.TRCK(encoding=3, text=str(self.tracknumber))
-        mp3info['TRCK'] = TRCK
-
-        TIT3 = id3.TIT3(encoding=3, text=self.description)
-        mp3info['TIT3'] = TIT3
-
-        if self.year == 0:
-            year = '0000'
+        try:
+            tags.save(self.filepath, padding=_inplace_padding)
+        except _RewriteRequired:
+            if self.filetype == EXTENSION_MP3:
+                self._rewrite_mp3(tags, padding)
+            else:
+                self._rewrite_ogg(tags, padding)
+            kind = 'rewrite'
         else:
-            year = str(self.year)
-        TYER = id3.TYER(encoding=3, text=str(year))
-        TDRC = id3.TDRC(encoding=3, text=str(year))
-        mp3info['TYER'] = TYER
-        mp3info['TDRC'] = TDRC
-
-        TCON = id3.TCON(encoding=3, text=self.genre)
-        mp3info['TCON'] = TCON
-
-        mp3info.save(filepath)
-
-    def _save_ogg(self, filepath):
-        ogginfo = ogg.OggVorbis(filepath)
-
-        ogginfo['artist'] = [artist.name for artist in self.artists]
-
-        ogginfo['title'] = [self.title]
-
-        ogginfo['album'] = [self.albumtitle]
-
-        ogginfo['tracknumber'] = [str(self.tracknumber)]
-
-        ogginfo['description'] = [self.description]
-
+            kind = 'inplace'
+
+        with _save_statistics_lock: # songs may be saved in several threads
+            save_statistics[kind] += 1
+
+        self._original = self._snapshot()
+
+    def _rewrite_mp3(self, mp3info, padding):
+        def write(tmpfilepath, tmpfp, fp):
+            # New tag, followed by the audio data after the old tag
+            mp3info.save(tmpfilepath, padding=lambda info: padding)
+            tmpfp.seek(0, os.SEEK_END)
+            id3_tag_size(fp)
+            shutil.copyfileobj(fp, tmpfp)
+            tmpfp.flush()
+
+            # Update the ID3v1 tag, if any
+            mp3info.save(tmpfilepath, padding=_inplace_padding)
+
+        _rewrite(self.filepath, write)
+
+    def _rewrite_ogg(self, ogginfo, padding):
+        def write(tmpfilepath, tmpfp, fp):
+            # New header pages
+            pages = _ogg_header_pages(fp)
+            end = pages[-1].offset + pages[-1].size
+            fp.seek(0)
+            tmpfp.write(fp.read(end))
+            tmpfp.flush()
+            ogginfo.save(tmpfilepath, padding=lambda info: padding)
+
+            serial = pages[-1].serial
+            with open(tmpfilepath, 'rb') as newfp:
+                sequence = _ogg_last_sequence(newfp, serial)
+
+            # Followed by the pages after the old header, renumbered if the
+            # number of header pages changed
+            tmpfp.seek(0, os.SEEK_END)
+            fp.seek(end)
+            offset = sequence - pages[-1].sequence
+            if offset == 0:
+                shutil.copyfileobj(fp, tmpfp)
+                return
+
+            while True:
+                try:
+                    page = OggPage(fp)
+                except EOFError:
+                    break
+                if page.serial == serial:
+                    page.sequence += offset
+                tmpfp.write(page.write())
+
+        _rewrite(self.filepath, write)
+
+    def _formatted_year(self):
         if self.year == 0:
-            year = '0000'
+            return '0000'
         else:
-            year = str(self.year)
-        ogginfo['date'] = [year]
-
-        ogginfo['genre'] = [self.genre]
-
-        ogginfo.save(filepath)
+            return str(self.year)
+
+    def _update_mp3(self, mp3info, fields):
+        if 'artists' in fields:
+            if len(self.artists) >= 1:
+                text = id3.TPE1(encoding=3, text=[self.artists[0].name])
+                mp3info['TPE1'] = text
+            if len(self.artists) >= 2:
+                text = id3.TPE2(encoding=3, text=[self.artists[1].name])
+                mp3info['TPE2'] = text
+            if len(self.artists) >= 3:
+                text = id3.TPE3(encoding=3, text=[self.artists[2].name])
+                mp3info['TPE3'] = text
+            if len(self.artists) >= 4:
+                text = id3.TPE4(encoding=3, text=[self.artists[3].name])
+                mp3info['TPE4'] = text
+
+        if 'title' in fields:
+            TIT2 = id3.TIT2(encoding=3, text=self.title)
+            mp3info['TIT2'] = TIT2
+
+        if 'albumtitle' in fields:
+            TALB = id3.TALB(encoding=3, text=self.albumtitle)
+            mp3info['TALB'] = TALB
+
+        if 'tracknumber' in fields:
+            TRCK = id3.TRCK(encoding=3, text=str(self.tracknumber))
+            mp3info['TRCK'] = TRCK
+
+        if 'description' in fields:
+            TIT3 = id3.TIT3(encoding=3, text=self.description)
+            mp3info['TIT3'] = TIT3
+
+        if 'year' in fields:
+            year = self._formatted_year()
+            TYER = id3.TYER(encoding=3, text=year)
+            TDRC = id3.TDRC(encoding=3, text=year)
+            mp3info['TYER'] = TYER
+            mp3info['TDRC'] = TDRC
+
+        if 'genre' in fields:
+            TCON = id3.TCON(encoding=3, text=self.genre)
+            mp3info['TCON'] = TCON
+
+    def _update_ogg(self, ogginfo, fields):
+        if 'artists' in fields:
+            ogginfo['artist'] = [artist.name for artist in self.artists]
+
+        if 'title' in fields:
+            ogginfo['title'] = [self.title]
+
+        if 'albumtitle' in fields:
+            ogginfo['album'] = [self.albumtitle]
+
+        if 'tracknumber' in fields:
+            ogginfo['tracknumber'] = [str(self.tracknumber)]
+
+        if 'description' in fields:
+            ogginfo['description'] = [self.description]
+
+        if 'year' in fields:
+            ogginfo['date'] = [self._formatted_year()]
+
+        if 'genre' in fields:
+            ogginfo['genre'] = [self.genre]
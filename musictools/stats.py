@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+"""
+================================================================================
+:mod:`stats` -- Timings and counters of a run
+================================================================================
+
+.. module:: stats
+   :synopsis: Timings and counters of a run
+
+A :class:`Stats` records the time spent in each phase of a run, as a
+histogram of the durations, and counters (files, bytes, warnings, ...).
+It is dumped as JSON or in the text format of Prometheus.
+:class:`NullStats` has the same interface and does nothing; it is used when
+the statistics are disabled.
+
+"""
+
+# Standard library modules.
+import time
+import json
+import threading
+import contextlib
+import collections
+
+# Third party modules.
+
+# Local modules.
+
+# Globals and constants variables.
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5,
+                   1.0, 5.0, 10.0, 60.0, 300.0) # s
+
+FORMAT_JSON = 'json'
+FORMAT_PROMETHEUS = 'prometheus'
+
+class Histogram(object):
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        """
+        Histogram of durations (in seconds). A value is counted in the first
+        bucket whose upper bound is greater or equal to it; values above the
+        last bound are only counted in the total.
+        """
+        self.buckets = tuple(buckets)
+        self.counts = [0] * len(self.buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.sum += value
+
+    def cumulative_counts(self):
+        counts = []
+        total = 0
+        for count in self.counts:
+            total += count
+            counts.append(total)
+        return counts
+
+    def to_dict(self):
+        return {'count': self.count, 'sum': self.sum,
+                'buckets': dict(zip(map(str, self.buckets), self.counts))}
+
+class Stats(object):
+
+    enabled = True
+
+    def __init__(self, prefix='musictools', buckets=DEFAULT_BUCKETS):
+        """
+        Statistics of a run. Thread-safe.
+
+        :arg prefix: prefix of the metric names in the Prometheus format
+        """
+        self.prefix = prefix
+        self.buckets = buckets
+        self.phases = collections.OrderedDict()
+        self.counters = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def observe(self, phase, seconds):
+        """
+        Records a duration of *phase*.
+        """
+        with self._lock:
+            histogram = self.phases.get(phase)
+            if histogram is None:
+                histogram = self.phases[phase] = Histogram(self.buckets)
+            histogram.observe(seconds)
+
+    @contextlib.contextmanager
+    def phase(self, phase):
+        """
+        Context manager recording the duration of its block in *phase*.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(phase, time.perf_counter() - start)
+
+    def iterate(self, phase, iterable):
+        """
+        Iterates over *iterable*, recording the time taken by each step in
+        *phase*.
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.observe(phase, time.perf_counter() - start)
+                return
+            self.observe(phase, time.perf_counter() - start)
+            yield item
+
+    def count(self, name, value=1):
+        """
+        Increments the counter *name* by *value*.
+        """
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self):
+        with self._lock:
+            return {'phases': dict((phase, histogram.to_dict())
+                                   for phase, histogram in self.phases.items()),
+                    'counters': dict(self.counters)}
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), indent=2)
+
+    def to_prometheus(self):
+        """
+        Returns the statistics in the text format of Prometheus: one
+        histogram ``<prefix>_phase_seconds`` labelled by phase and one
+        counter ``<prefix>_<name>_total`` per counter.
+        """
+        lines = []
+        with self._lock:
+            if self.phases:
+                name = self.prefix + '_phase_seconds'
+                lines.append('# HELP %s Time spent in each phase.' % name)
+                lines.append('# TYPE %s histogram' % name)
+            for phase, histogram in self.phases.items():
+                counts = histogram.cumulative_counts()
+                for bound, count in zip(histogram.buckets, counts):
+                    lines.append('%s_bucket{phase="%s",le="%s"} %i' % \
+                                 (name, phase, repr(float(bound)), count))
+                lines.append('%s_bucket{phase="%s",le="+Inf"} %i' % \
+                             (name, phase, histogram.count))
+                lines.append('%s_sum{phase="%s"} %r' % (name, phase, histogram.sum))
+                lines.append('%s_count{phase="%s"} %i' % (name, phase, histogram.count))
+
+            for counter, value in self.counters.items():
+                name = '%s_%s_total' % (self.prefix, counter)
+                lines.append('# TYPE %s counter' % name)
+                lines.append('%s %s' % (name, value))
+
+        return '\n'.join(lines) + '\n'
+
+    def dump(self, filepath, format=FORMAT_JSON):
+        """
+        Writes the statistics to *filepath* (``-`` for the standard output)
+        in *format*, either ``json`` or ``prometheus``.
+        """
+        if format == FORMAT_JSON:
+            text = self.to_json() + '\n'
+        elif format == FORMAT_PROMETHEUS:
+            text = self.to_prometheus()
+        else:
+            raise ValueError('Unknown format: %s' % format)
+
+        if filepath == '-':
+            print(text, end='')
+        else:
+            with open(filepath, 'w') as fp:
+                fp.write(text)
+
+class _NullContext(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_NULL_CONTEXT = _NullContext()
+
+class NullStats(object):
+    """
+    Statistics that record nothing.
+    """
+
+    enabled = False
+
+    def observe(self, phase, seconds):
+        pass
+
+    def phase(self, phase):
+        return _NULL_CONTEXT
+
+    def iterate(self, phase, iterable):
+        return iterable
+
+    def count(self, name, value=1):
+        pass
+
+def create_stats(enabled, prefix='musictools'):
+    """
+    Returns a :class:`Stats` if *enabled*, a :class:`NullStats` otherwise.
+    """
+    if enabled:
+        return Stats(prefix)
+    return NullStats()
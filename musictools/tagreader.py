@@ -0,0 +1,343 @@
+#!/usr/bin/env python
+"""
+================================================================================
+:mod:`tagreader` -- Fast readers of tags
+================================================================================
+
+.. module:: tagreader
+   :synopsis: Fast readers of tags
+
+Minimal readers that only decode the tags used by
+:class:`musictools.song.Song`. They raise :exc:`UnsupportedTagError` for any
+tag they do not fully understand, in which case the caller should fall back
+on :mod:`mutagen`.
+
+Binary frames of ID3 tags (cover art, encapsulated objects, private data)
+can be several megabytes. The ID3 reader maps the tag in memory and only
+records their position; :func:`read_id3_picture` reads a picture on demand.
+
+"""
+
+# Standard library modules.
+import re
+import mmap
+import struct
+import collections
+
+# Third party modules.
+
+# Local modules.
+
+# Globals and constants variables.
+ID3_TEXT_FRAMES = frozenset(['TPE1', 'TPE2', 'TPE3', 'TPE4', 'TIT1', 'TIT2',
+                             'TALB', 'TRCK', 'TYER', 'TDRC', 'TCON', 'TPOS'])
+
+ID3_BINARY_FRAMES = frozenset(['APIC', 'GEOB', 'PRIV'])
+
+VORBIS_BINARY_COMMENTS = frozenset(['metadata_block_picture', 'coverart'])
+
+PICTURE_TYPE_FRONT_COVER = 3
+
+BinaryFrame = collections.namedtuple('BinaryFrame', ['frameid', 'offset', 'size', 'flags'])
+
+Picture = collections.namedtuple('Picture', ['mime', 'type', 'description', 'data'])
+
+_ID3_HEADER_SIZE = 10
+_ID3_FRAME_HEADER_SIZE = 10
+
+_ID3_FLAG_UNSYNCHRONISATION = 0x80
+_ID3_FLAG_EXTENDED_HEADER = 0x40
+_ID3_FLAG_FOOTER = 0x10
+
+# Compression, encryption and grouping (v2.3); grouping, compression,
+# encryption, unsynchronisation and data length indicator (v2.4).
+_ID3V23_FRAME_FLAGS_UNSUPPORTED = 0xe0
+_ID3V24_FRAME_FLAGS_UNSUPPORTED = 0x4f
+
+_ID3_ENCODINGS = {0: 'latin-1', 1: 'utf-16', 2: 'utf-16-be', 3: 'utf-8'}
+
+_ID3_FRAMEID = re.compile(rb'[A-Z0-9]{4}\Z')
+
+# Numerical genres ("(17)", "17") and "RX"/"CR" are translated by mutagen.
+_ID3_GENRE_REFERENCE = re.compile(r'\(|\d+\Z|RX\Z|CR\Z')
+
+_OGG_PAGE_HEADER_SIZE = 27
+
+_UINT32 = struct.Struct('<I')
+
+class UnsupportedTagError(Exception):
+    pass
+
+def _synchsafe(data):
+    value = 0
+    for byte in data:
+        if byte & 0x80:
+            raise UnsupportedTagError('Invalid synchsafe integer')
+        value = (value << 7) | byte
+    return value
+
+def _decode_id3_text(data):
+    try:
+        encoding = _ID3_ENCODINGS[data[0]]
+    except (IndexError, KeyError):
+        raise UnsupportedTagError('Unknown text encoding')
+
+    try:
+        text = data[1:].decode(encoding)
+    except UnicodeDecodeError:
+        raise UnsupportedTagError('Invalid text')
+
+    if not text:
+        return []
+    if text.endswith('\0'):
+        text = text[:-1]
+    return [value.lstrip('\ufeff') for value in text.split('\0')]
+
+def id3_tag_size(fp):
+    """
+    Returns the size in bytes of the ID3v2 tag at the beginning of the file
+    object *fp*, including its header, padding and footer, or 0 if the file
+    does not start with an ID3v2 tag.
+    The position of *fp* is left at the end of the tag.
+    """
+    fp.seek(0)
+    header = fp.read(_ID3_HEADER_SIZE)
+    if len(header) < _ID3_HEADER_SIZE or header[:3] != b'ID3':
+        fp.seek(0)
+        return 0
+
+    size = _ID3_HEADER_SIZE + _synchsafe(header[6:10])
+    if header[5] & _ID3_FLAG_FOOTER:
+        size += _ID3_HEADER_SIZE
+    fp.seek(size)
+    return size
+
+def read_id3_text_frames(filepath, frameids=ID3_TEXT_FRAMES):
+    """
+    Reads the text frames *frameids* of the ID3v2.3 or ID3v2.4 tag at the
+    beginning of *filepath*.
+    Returns a :class:`dict` of the frame ids and their list of strings.
+    See :func:`read_id3_frames`.
+    """
+    return read_id3_frames(filepath, frameids, ())[0]
+
+def read_id3_frames(filepath, frameids=ID3_TEXT_FRAMES,
+                    binary_frameids=ID3_BINARY_FRAMES):
+    """
+    Reads the text frames *frameids* of the ID3v2.3 or ID3v2.4 tag at the
+    beginning of *filepath* and locates its binary frames *binary_frameids*.
+    The tag is mapped in memory: only the frame headers and the text frames
+    are read, other frames are skipped without being read.
+    Returns a tuple of a :class:`dict` of the frame ids and their list of
+    strings, and a list of the binary frames as :class:`BinaryFrame`
+    (position of the content of the frame in the file, its size and its
+    format flags).
+
+    :raise UnsupportedTagError: if the file has no ID3v2 tag or if the tag
+        uses features (old version, unsynchronisation, compression,
+        encryption, numerical genres) that this reader does not support
+    """
+    with open(filepath, 'rb') as fp:
+        header = fp.read(_ID3_HEADER_SIZE)
+        if len(header) < _ID3_HEADER_SIZE or header[:3] != b'ID3':
+            raise UnsupportedTagError('No ID3v2 tag')
+
+        major = header[3]
+        flags = header[5]
+        if major not in (3, 4):
+            raise UnsupportedTagError('Unsupported ID3v2.%i tag' % major)
+        if flags & _ID3_FLAG_UNSYNCHRONISATION:
+            raise UnsupportedTagError('Unsynchronised tag')
+
+        size = _synchsafe(header[6:10])
+        try:
+            data = mmap.mmap(fp.fileno(), _ID3_HEADER_SIZE + size,
+                             access=mmap.ACCESS_READ)
+        except ValueError: # file shorter than the tag
+            raise UnsupportedTagError('Truncated tag')
+
+    try:
+        return _walk_id3_frames(data, major, flags, _ID3_HEADER_SIZE + size,
+                                frameids, binary_frameids)
+    finally:
+        data.close()
+
+def _walk_id3_frames(data, major, flags, size, frameids, binary_frameids):
+    offset = _ID3_HEADER_SIZE
+    if flags & _ID3_FLAG_EXTENDED_HEADER:
+        if major == 4:
+            offset += _synchsafe(data[offset:offset + 4])
+        else:
+            offset += 4 + int.from_bytes(data[offset:offset + 4], 'big')
+
+    if major == 4:
+        read_size = _synchsafe
+        unsupported_flags = _ID3V24_FRAME_FLAGS_UNSUPPORTED
+    else:
+        read_size = lambda data: int.from_bytes(data, 'big')
+        unsupported_flags = _ID3V23_FRAME_FLAGS_UNSUPPORTED
+
+    frames = {}
+    binary_frames = []
+    while offset + _ID3_FRAME_HEADER_SIZE <= size:
+        header = data[offset:offset + _ID3_FRAME_HEADER_SIZE]
+        frameid = header[:4]
+        if frameid[0] == 0: # padding
+            break
+        if not _ID3_FRAMEID.match(frameid):
+            raise UnsupportedTagError('Invalid frame id')
+
+        start = offset + _ID3_FRAME_HEADER_SIZE
+        end = start + read_size(header[4:8])
+        if end > size:
+            raise UnsupportedTagError('Truncated frame')
+
+        frameid = frameid.decode('ascii')
+        if frameid in frameids:
+            if header[9] & unsupported_flags:
+                raise UnsupportedTagError('Unsupported frame flags')
+            # Like mutagen, the text of repeated frames is merged.
+            frames.setdefault(frameid, []).extend(_decode_id3_text(data[start:end]))
+        elif frameid in binary_frameids:
+            binary_frames.append(BinaryFrame(frameid, start, end - start,
+                                             header[9] & unsupported_flags))
+
+        offset = end
+
+    for genre in frames.get('TCON', []):
+        if _ID3_GENRE_REFERENCE.match(genre):
+            raise UnsupportedTagError('Numerical genre')
+
+    return frames, binary_frames
+
+def _find_id3_terminator(data, start, encoding):
+    if encoding in (1, 2): # UTF-16: two null bytes, aligned
+        index = start
+        while True:
+            index = data.index(b'\0\0', index)
+            if (index - start) % 2 == 0:
+                return index, index + 2
+            index += 1
+    index = data.index(b'\0', start)
+    return index, index + 1
+
+def read_id3_picture(filepath, frame):
+    """
+    Reads the picture of the APIC frame *frame*, located by
+    :func:`read_id3_frames`, and returns a :class:`Picture`.
+
+    :raise UnsupportedTagError: if the frame is compressed, encrypted or
+        invalid
+    """
+    if frame.flags:
+        raise UnsupportedTagError('Unsupported frame flags')
+
+    with open(filepath, 'rb') as fp:
+        fp.seek(frame.offset)
+        data = fp.read(frame.size)
+    if len(data) < frame.size:
+        raise UnsupportedTagError('Truncated frame')
+
+    # Encoding, MIME type, picture type, description, picture data
+    try:
+        end, offset = _find_id3_terminator(data, 1, 0)
+        mime = data[1:end].decode('latin-1')
+        picture_type = data[offset]
+        end, start = _find_id3_terminator(data, offset + 1, data[0])
+    except (IndexError, ValueError):
+        raise UnsupportedTagError('Invalid picture frame')
+    description = ''.join(_decode_id3_text(data[:1] + data[offset + 1:end]))
+
+    return Picture(mime, picture_type, description, data[start:])
+
+def _iter_ogg_packets(fp, chunksize):
+    """
+    Yields the packets of the first logical bitstream of an Ogg file, reading
+    the file sequentially by chunks of *chunksize* bytes.
+    """
+    buffer = bytearray()
+    serial = None
+    packet = []
+
+    def fill(size):
+        while len(buffer) < size:
+            data = fp.read(chunksize)
+            if not data:
+                raise UnsupportedTagError('Truncated Ogg page')
+            buffer.extend(data)
+
+    while True:
+        fill(_OGG_PAGE_HEADER_SIZE)
+        if buffer[0:4] != b'OggS' or buffer[4] != 0:
+            raise UnsupportedTagError('Invalid Ogg page')
+
+        header_size = _OGG_PAGE_HEADER_SIZE + buffer[26]
+        fill(header_size)
+        lacing = bytes(buffer[_OGG_PAGE_HEADER_SIZE:header_size])
+        page_size = header_size + sum(lacing)
+        fill(page_size)
+
+        page_serial = bytes(buffer[14:18])
+        if serial is None:
+            serial = page_serial
+
+        if page_serial == serial:
+            start = header_size
+            for length in lacing:
+                packet.append(bytes(buffer[start:start + length]))
+                start += length
+                if length < 255:
+                    yield b''.join(packet)
+                    packet = []
+
+        del buffer[:page_size]
+
+def read_vorbis_comments(filepath, chunksize=65536, skip=()):
+    """
+    Reads the Vorbis comments of the Ogg Vorbis file *filepath*.
+    Only the first pages of the file, up to and including the comment
+    header, are read sequentially; the file is never seeked to its end.
+    Returns a :class:`dict` of the lower case field names and their list of
+    values. The values of the fields in *skip* (e.g.
+    :data:`VORBIS_BINARY_COMMENTS`) are not decoded and not returned.
+
+    :raise UnsupportedTagError: if the file is not a valid Ogg Vorbis file
+    """
+    with open(filepath, 'rb') as fp:
+        packets = _iter_ogg_packets(fp, chunksize)
+        if not next(packets).startswith(b'\x01vorbis'):
+            raise UnsupportedTagError('Not an Ogg Vorbis file')
+        data = next(packets)
+
+    if not data.startswith(b'\x03vorbis'):
+        raise UnsupportedTagError('No comment header')
+
+    try:
+        offset = 7
+        length, = _UINT32.unpack_from(data, offset)
+        offset += 4 + length # vendor
+
+        count, = _UINT32.unpack_from(data, offset)
+        offset += 4
+
+        comments = {}
+        for _ in range(count):
+            length, = _UINT32.unpack_from(data, offset)
+            offset += 4
+            if offset + length > len(data):
+                raise UnsupportedTagError('Truncated comment')
+            end = offset + length
+            separator = data.find(b'=', offset, end)
+            if separator < 0:
+                offset = end
+                continue
+
+            key = data[offset:separator].decode('utf-8', 'replace').lower()
+            if key not in skip:
+                value = data[separator + 1:end].decode('utf-8', 'replace')
+                comments.setdefault(key, []).append(value)
+            offset = end
+    except struct.error:
+        raise UnsupportedTagError('Truncated comment header')
+
+    return comments
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+"""
+================================================================================
+:mod:`test_dedupe` -- Unit tests for the module :mod:`dedupe`.
+================================================================================
+
+"""
+
+# Standard library modules.
+import unittest
+import logging
+import shutil
+import tempfile
+import hashlib
+import warnings
+import os
+from unittest import mock
+
+# Third party modules.
+import mutagen.id3 as id3
+import mutagen.oggvorbis as ogg
+
+# Local modules.
+import musictools.dedupe as dedupe_module
+from musictools.dedupe import payload_size, hash_audio, find_duplicates
+from musictools.library import Library
+from musictools.stats import Stats
+from musictools.tagreader import id3_tag_size
+
+# Globals and constants variables.
+
+class TestDedupe(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        warnings.simplefilter('ignore')
+
+        self.folderpath = os.path.join(os.path.dirname(__file__), "testData")
+        self.tmpdir = tempfile.mkdtemp()
+
+        # Same audio, different tags
+        self.mp3_filepath = self._copy('song.mp3', 'a.mp3')
+        self.mp3_copy_filepath = self._copy('song.mp3', 'b.mp3')
+        mp3info = id3.ID3(self.mp3_copy_filepath)
+        mp3info['TIT2'] = id3.TIT2(encoding=3, text=u'Other' * 1000)
+        mp3info.save(self.mp3_copy_filepath, v1=2)
+
+        self.ogg_filepath = self._copy('song3.ogg', 'c.ogg')
+        self.ogg_copy_filepath = self._copy('song3.ogg', 'd.ogg')
+        ogginfo = ogg.OggVorbis(self.ogg_copy_filepath)
+        ogginfo['description'] = [u'\xe9' * 100000]
+        ogginfo.save()
+
+        # Same size, different audio at the end
+        self.mp3_other_filepath = self._copy('song.mp3', 'e.mp3')
+        with open(self.mp3_other_filepath, 'r+b') as fp:
+            fp.seek(-200, os.SEEK_END) # before the ID3v1 tag
+            byte = fp.read(1)
+            fp.seek(-200, os.SEEK_END)
+            fp.write(bytes([byte[0] ^ 0xff]))
+
+        self.filepaths = [self.mp3_filepath, self.mp3_copy_filepath,
+                          self.ogg_filepath, self.ogg_copy_filepath,
+                          self.mp3_other_filepath]
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+        warnings.resetwarnings()
+
+    def _copy(self, filename, newfilename):
+        filepath = os.path.join(self.tmpdir, newfilename)
+        shutil.copy(os.path.join(self.folderpath, filename), filepath)
+        return filepath
+
+    def testpayload_size(self):
+        self.assertNotEqual(os.path.getsize(self.mp3_filepath),
+                            os.path.getsize(self.mp3_copy_filepath))
+        self.assertEqual(payload_size(self.mp3_filepath),
+                         payload_size(self.mp3_copy_filepath))
+
+        self.assertNotEqual(os.path.getsize(self.ogg_filepath),
+                            os.path.getsize(self.ogg_copy_filepath))
+        self.assertEqual(payload_size(self.ogg_filepath),
+                         payload_size(self.ogg_copy_filepath))
+
+    def testhash_audio(self):
+        self.assertEqual(hash_audio(self.mp3_filepath), hash_audio(self.mp3_copy_filepath))
+        self.assertEqual(hash_audio(self.ogg_filepath), hash_audio(self.ogg_copy_filepath))
+        self.assertNotEqual(hash_audio(self.mp3_filepath), hash_audio(self.mp3_other_filepath))
+
+    def testhash_audio_limit(self):
+        with open(self.mp3_filepath, 'rb') as fp:
+            fp.seek(id3_tag_size(fp))
+            data = fp.read(1000)
+        expected = hashlib.blake2b(data, digest_size=dedupe_module.DIGEST_SIZE)
+
+        self.assertEqual(expected.hexdigest(), hash_audio(self.mp3_filepath, 1000))
+        self.assertEqual(hash_audio(self.mp3_filepath, 1000),
+                         hash_audio(self.mp3_other_filepath, 1000))
+
+    def testhash_audio_invalid(self):
+        with open(self.ogg_filepath, 'r+b') as fp:
+            fp.truncate(100)
+        self.assertRaises(ValueError, hash_audio, self.ogg_filepath)
+
+    def testfind_duplicates(self):
+        with mock.patch.object(dedupe_module, 'PARTIAL_SIZE', 1000):
+            groups = find_duplicates(self.filepaths, max_workers=2)
+        self.assertEqual([[self.mp3_filepath, self.mp3_copy_filepath],
+                          [self.ogg_filepath, self.ogg_copy_filepath]], groups)
+
+        groups = find_duplicates(reversed(self.filepaths))
+        self.assertEqual([[self.ogg_copy_filepath, self.ogg_filepath],
+                          [self.mp3_copy_filepath, self.mp3_filepath]], groups)
+
+    def testfind_duplicates_invalid(self):
+        invalid_filepath = os.path.join(self.tmpdir, 'f.ogg')
+        open(invalid_filepath, 'wb').close()
+
+        stats = Stats()
+        groups = find_duplicates(self.filepaths + [invalid_filepath], stats=stats)
+        self.assertEqual(2, len(groups))
+        self.assertEqual(1, stats.counters['failures'])
+
+    def testfind_duplicates_library(self):
+        with Library(':memory:') as library:
+            for song in library.scan(self.tmpdir):
+                pass
+
+            stats = Stats()
+            groups = find_duplicates(self.filepaths, library, stats=stats)
+            self.assertEqual(2, len(groups))
+            self.assertEqual(0, stats.counters['cached_partial_hash'])
+            self.assertIsNotNone(library.hashes(self.ogg_filepath)['content_hash'])
+
+            stats = Stats()
+            self.assertEqual(groups, find_duplicates(self.filepaths, library, stats=stats))
+            self.assertEqual(5, stats.counters['cached_partial_hash'])
+            self.assertEqual(2, stats.counters['cached_content_hash'])
+            self.assertNotIn('partial_hash', stats.phases)
+
+if __name__ == '__main__': #pragma: no cover
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
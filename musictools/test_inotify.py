@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+"""
+================================================================================
+:mod:`test_inotify` -- Unit tests for the module :mod:`inotify`.
+================================================================================
+
+"""
+
+# Standard library modules.
+import unittest
+import logging
+import shutil
+import tempfile
+import struct
+import sys
+import os
+
+# Third party modules.
+
+# Local modules.
+from musictools.inotify import \
+    FileWatcher, parse_events, IN_CREATE, IN_CLOSE_WRITE
+
+# Globals and constants variables.
+
+class TestParseEvents(unittest.TestCase):
+
+    def testparse_events(self):
+        data = struct.pack('iIII', 1, IN_CREATE, 0, 8) + b'a.mp3\0\0\0' + \
+               struct.pack('iIII', 2, IN_CLOSE_WRITE, 0, 0)
+        events = parse_events(data)
+
+        self.assertEqual(2, len(events))
+        self.assertEqual((1, IN_CREATE, 0, 'a.mp3'), tuple(events[0]))
+        self.assertEqual('', events[1].name)
+
+@unittest.skipUnless(sys.platform.startswith('linux'), 'inotify requires Linux')
+class TestFileWatcher(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.inbox = os.path.join(self.tmpdir, 'inbox')
+        os.makedirs(os.path.join(self.inbox, 'sub'))
+        with open(os.path.join(self.inbox, 'old.mp3'), 'w') as fp:
+            fp.write('old')
+
+        self.watcher = FileWatcher([self.inbox], delay=0.1)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        self.watcher.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def testpoll(self):
+        filepath = os.path.join(self.inbox, 'sub', 'new.mp3')
+        with open(filepath, 'w') as fp:
+            fp.write('new')
+            fp.flush()
+            self.assertEqual([], self.watcher.poll(0.3)) # not closed
+
+        self.assertEqual([filepath], self.watcher.poll(1.0))
+        self.assertEqual([], self.watcher.poll(0.2))
+
+    def testpoll_moved_directory(self):
+        dirpath = os.path.join(self.tmpdir, 'album')
+        os.makedirs(os.path.join(dirpath, 'cd1'))
+        with open(os.path.join(dirpath, 'cd1', 'a.mp3'), 'w') as fp:
+            fp.write('a')
+        os.rename(dirpath, os.path.join(self.inbox, 'album'))
+
+        self.assertEqual([os.path.join(self.inbox, 'album', 'cd1', 'a.mp3')],
+                         self.watcher.poll(1.0))
+
+        # The moved directory is watched
+        filepath = os.path.join(self.inbox, 'album', 'b.mp3')
+        with open(filepath, 'w') as fp:
+            fp.write('b')
+        self.assertEqual([filepath], self.watcher.poll(1.0))
+
+    def testpoll_deleted(self):
+        filepath = os.path.join(self.inbox, 'new.mp3')
+        with open(filepath, 'w') as fp:
+            fp.write('new')
+        os.remove(filepath)
+
+        self.assertEqual([], self.watcher.poll(0.3))
+
+if __name__ == '__main__': #pragma: no cover
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+"""
+================================================================================
+:mod:`test_journal` -- Unit tests for the module :mod:`journal`.
+================================================================================
+
+"""
+
+# Standard library modules.
+import unittest
+import logging
+import shutil
+import tempfile
+import os
+
+# Third party modules.
+
+# Local modules.
+from musictools.journal import Journal, read_journal, reconcile
+from musictools.renamer import Move
+
+# Globals and constants variables.
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmpdir, 'journal.jsonl')
+
+        self.moves = []
+        for name in ['a', 'b', 'c']:
+            src = os.path.join(self.tmpdir, name + '.mp3')
+            with open(src, 'w') as fp:
+                fp.write(name)
+            self.moves.append(Move(src, os.path.join(self.tmpdir, name + '2.mp3'), None))
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _move(self, index):
+        move = self.moves[index]
+        os.rename(move.src, move.dst)
+        return move
+
+    def testread(self):
+        with Journal(self.filepath) as journal:
+            journal.begin()
+            journal.plan(self.moves)
+            move = self._move(0)
+            journal.done(move.src, move.dst)
+
+        state = read_journal(self.filepath)
+        self.assertEqual([(move.src, move.dst) for move in self.moves], state.moves)
+        self.assertEqual(set([(move.src, move.dst)]), state.done)
+        self.assertTrue(state.planned)
+        self.assertFalse(state.ended)
+
+        with Journal(self.filepath, append=True) as journal:
+            journal.end()
+        self.assertTrue(read_journal(self.filepath).ended)
+
+    def testread_last_run(self):
+        with Journal(self.filepath) as journal:
+            journal.begin()
+            journal.plan(self.moves)
+            journal.end()
+            journal.begin()
+
+        state = read_journal(self.filepath)
+        self.assertEqual([], state.moves)
+        self.assertFalse(state.planned)
+
+    def testread_relative(self):
+        cwd = os.getcwd()
+        os.chdir(self.tmpdir)
+        try:
+            with Journal(self.filepath) as journal:
+                journal.begin()
+                journal.plan([Move('a.mp3', 'a2.mp3', None)])
+                journal.done('a.mp3', 'a2.mp3')
+        finally:
+            os.chdir(cwd)
+
+        state = read_journal(self.filepath)
+        move = (self.moves[0].src, self.moves[0].dst)
+        self.assertEqual([move], state.moves)
+        self.assertEqual(set([move]), state.done)
+
+    def testtruncated(self):
+        with Journal(self.filepath) as journal:
+            journal.begin()
+            journal.plan(self.moves)
+        with open(self.filepath, 'a') as fp:
+            fp.write('{"op": "do')
+
+        move = self._move(0)
+        with Journal(self.filepath, append=True) as journal:
+            journal.done(move.src, move.dst)
+
+        state = read_journal(self.filepath)
+        self.assertEqual(set([(move.src, move.dst)]), state.done)
+
+    def testreconcile(self):
+        with Journal(self.filepath) as journal:
+            journal.begin()
+            journal.plan(self.moves)
+            move = self._move(0)
+            journal.done(move.src, move.dst)
+        self._move(1) # record lost in a crash
+
+        remaining, found, conflicts = reconcile(read_journal(self.filepath))
+        self.assertEqual([tuple(self.moves[2][:2])], remaining)
+        self.assertEqual([tuple(self.moves[1][:2])], found)
+        self.assertEqual([], conflicts)
+
+    def _plan_and_copy(self):
+        with Journal(self.filepath) as journal:
+            journal.begin()
+            journal.plan(self.moves)
+        shutil.copy2(self.moves[0].src, self.moves[0].dst) # crash before removal
+        shutil.copy(self.moves[1].src, self.moves[1].dst) # other modification time
+        with open(self.moves[2].dst, 'w') as fp: # same size, other content
+            fp.write('x')
+        stat = os.stat(self.moves[2].src)
+        os.utime(self.moves[2].dst, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+    def testreconcile_copied(self):
+        self._plan_and_copy()
+
+        remaining, found, conflicts = reconcile(read_journal(self.filepath))
+        self.assertEqual([], remaining)
+        self.assertEqual([tuple(self.moves[0][:2])], found)
+        self.assertEqual([tuple(move[:2]) for move in self.moves[1:]], conflicts)
+        self.assertFalse(os.path.exists(self.moves[0].src))
+        for move in self.moves[1:]:
+            self.assertTrue(os.path.exists(move.src))
+            self.assertTrue(os.path.exists(move.dst))
+
+    def testreconcile_copied_no_finish(self):
+        self._plan_and_copy()
+
+        remaining, found, conflicts = reconcile(read_journal(self.filepath), finish=False)
+        self.assertEqual([], remaining)
+        self.assertEqual([], found)
+        self.assertEqual([tuple(move[:2]) for move in self.moves], conflicts)
+        for move in self.moves:
+            self.assertTrue(os.path.exists(move.src))
+
+    def testreconcile_chained(self):
+        # b -> c, then a -> b: a and b have the same size
+        os.remove(self.moves[2].src)
+        os.utime(self.moves[0].src, (1000000000, 1000000000))
+        os.utime(self.moves[1].src, (1000000001, 1000000001))
+        moves = [Move(self.moves[1].src, self.moves[2].src, None),
+                 Move(self.moves[0].src, self.moves[1].src, None)]
+        with Journal(self.filepath) as journal:
+            journal.begin()
+            journal.plan(moves)
+        os.rename(moves[0].src, moves[0].dst) # the records are lost
+        os.rename(moves[1].src, moves[1].dst)
+
+        remaining, found, conflicts = reconcile(read_journal(self.filepath))
+        self.assertEqual([], remaining)
+        self.assertEqual([tuple(move[:2]) for move in moves], found)
+        self.assertEqual([], conflicts)
+        with open(self.moves[1].src) as fp:
+            self.assertEqual('a', fp.read())
+        with open(self.moves[2].src) as fp:
+            self.assertEqual('b', fp.read())
+
+    def testreconcile_undone(self):
+        with Journal(self.filepath) as journal:
+            journal.begin()
+            journal.plan(self.moves[:1])
+            move = self._move(0)
+            journal.done(move.src, move.dst)
+            os.rename(move.dst, move.src)
+            journal.undone(move.src, move.dst)
+
+        remaining, found, conflicts = reconcile(read_journal(self.filepath))
+        self.assertEqual([tuple(move[:2])], remaining)
+        self.assertEqual([], found)
+        self.assertEqual([], conflicts)
+
+if __name__ == '__main__': #pragma: no cover
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
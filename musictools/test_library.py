@@ -0,0 +1,228 @@
+#!/usr/bin/env python
+"""
+================================================================================
+:mod:`test_library` -- Unit tests for the module :mod:`library`.
+================================================================================
+
+"""
+
+# Standard library modules.
+import unittest
+import logging
+import shutil
+import tempfile
+import os
+import warnings
+
+# Third party modules.
+try:
+    import numpy as np
+except ImportError: #pragma: no cover
+    np = None
+
+# Local modules.
+from musictools.library import Library, SongTable
+from musictools.song import Song, Artist
+
+# Globals and constants variables.
+
+class TestLibrary(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        warnings.simplefilter('ignore')
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.musicdir = os.path.join(self.tmpdir, 'music')
+        shutil.copytree(os.path.join(os.path.dirname(__file__), 'testData'),
+                        self.musicdir)
+        self.song1_filepath = os.path.join(self.musicdir, 'song.mp3')
+
+        self.index_filepath = os.path.join(self.tmpdir, 'index.sqlite')
+        self.library = Library(self.index_filepath)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        self.library.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+        warnings.resetwarnings()
+
+    def testscan(self):
+        songs = list(self.library.scan(self.musicdir))
+        self.assertEqual(3, len(songs))
+        self.assertEqual(3, len(self.library))
+        self.assertIn(self.song1_filepath, self.library)
+
+    def testscan_incremental(self):
+        list(self.library.scan(self.musicdir))
+
+        # Modify the tags but keep the size and modification time: the index
+        # must be trusted and the file not read again.
+        stat = os.stat(self.song1_filepath)
+        song = Song(self.song1_filepath)
+        song.title = 'Other'
+        song.save()
+        os.truncate(self.song1_filepath, stat.st_size)
+        os.utime(self.song1_filepath, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+
+        songs = dict((os.path.basename(song.filepath), song)
+                     for song in self.library.scan(self.musicdir))
+        self.assertEqual('Silence', songs['song.mp3'].title)
+
+        songs = dict((os.path.basename(song.filepath), song)
+                     for song in self.library.scan(self.musicdir, incremental=False))
+        self.assertEqual('Other', songs['song.mp3'].title)
+
+    def testlookup_changed(self):
+        list(self.library.scan(self.musicdir))
+        self.assertIsNotNone(self.library.lookup(self.song1_filepath))
+
+        with open(self.song1_filepath, 'ab') as fp:
+            fp.write(b'\0')
+        self.assertIsNone(self.library.lookup(self.song1_filepath))
+
+    def testfrom_index(self):
+        self.assertIsNone(Song.from_index(self.library, self.song1_filepath, read=False))
+        self.assertEqual(0, len(self.library))
+
+        song = Song.from_index(self.library, self.song1_filepath)
+        self.assertEqual(1, len(self.library))
+        self.assertIsNotNone(Song.from_index(self.library, self.song1_filepath, read=False))
+
+        song = Song.from_index(self.library, self.song1_filepath)
+        self.assertEqual(self.song1_filepath, song.filepath)
+        self.assertEqual([Artist(name='piman')], song.artists)
+        self.assertEqual('Quod Libet Test Data', song.albumtitle)
+        self.assertEqual('Silence', song.title)
+        self.assertEqual(2, song.tracknumber)
+        self.assertEqual(2004, song.year)
+        self.assertEqual('Silence', song.genre)
+        self.assertEqual(0, song.discnumber)
+        self.assertEqual('mp3', song.filetype)
+
+    def testmove(self):
+        list(self.library.scan(self.musicdir))
+        dst = os.path.join(self.tmpdir, 'moved.mp3')
+        shutil.move(self.song1_filepath, dst)
+        self.library.move(self.song1_filepath, dst)
+
+        self.assertNotIn(self.song1_filepath, self.library)
+        self.assertEqual('Silence', self.library.lookup(dst)['title'])
+
+    def testhashes(self):
+        self.assertIsNone(self.library.hashes(self.song1_filepath))
+
+        list(self.library.scan(self.musicdir))
+        self.assertEqual({'partial_hash': None, 'content_hash': None},
+                         self.library.hashes(self.song1_filepath))
+
+        self.library.set_hashes(self.song1_filepath, partial_hash='abc')
+        self.library.set_hashes(self.song1_filepath, content_hash='def')
+        self.assertEqual({'partial_hash': 'abc', 'content_hash': 'def'},
+                         self.library.hashes(self.song1_filepath))
+
+        # Cleared when the entry is replaced
+        self.library.add(Song(self.song1_filepath))
+        self.assertEqual({'partial_hash': None, 'content_hash': None},
+                         self.library.hashes(self.song1_filepath))
+
+    def testhashes_changed(self):
+        list(self.library.scan(self.musicdir))
+        with open(self.song1_filepath, 'ab') as fp:
+            fp.write(b'\0')
+
+        self.library.set_hashes(self.song1_filepath, partial_hash='abc')
+        self.assertIsNone(self.library.hashes(self.song1_filepath))
+
+    def testpersistence(self):
+        list(self.library.scan(self.musicdir))
+        self.library.close()
+
+        self.library = Library(self.index_filepath)
+        self.assertEqual(3, len(self.library))
+        titles = sorted(song.title for song in self.library)
+        self.assertEqual(['A Wonderful World', 'Silence', 'What a Wonderful World'],
+                         titles)
+
+@unittest.skipIf(np is None, 'numpy is not installed')
+class TestSongTable(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        warnings.simplefilter('ignore')
+
+        self.tmpdir = tempfile.mkdtemp()
+        musicdir = os.path.join(os.path.dirname(__file__), 'testData')
+        self.library = Library(os.path.join(self.tmpdir, 'index.sqlite'))
+        list(self.library.scan(musicdir))
+
+        self.table = self.library.table()
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        self.library.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+        warnings.resetwarnings()
+
+    def testcolumns(self):
+        self.assertEqual(3, len(self.table))
+        self.assertEqual(np.int32, self.table['year'].dtype)
+        self.assertEqual(['mp3', 'ogg'], sorted(self.table['filetype'].categories))
+        self.assertEqual(sorted(song.title for song in self.library),
+                         sorted(self.table['title']))
+
+    def testfrom_songs(self):
+        table = SongTable.from_songs(self.library)
+        self.assertEqual(self.table.count_by('artist'), table.count_by('artist'))
+        self.assertEqual(self.table.year_histogram(), table.year_histogram())
+
+    def testselect(self):
+        table = self.table.select(self.table.equals('filetype', 'ogg'))
+        self.assertEqual(2, len(table))
+        self.assertEqual(['ogg', 'ogg'], list(table['filetype'].decode()))
+
+        table = self.table.select(self.table.equals('genre', 'unknown'))
+        self.assertEqual(0, len(table))
+
+    def testcount_by(self):
+        self.assertEqual({'mp3': 1, 'ogg': 2}, self.table.count_by('filetype'))
+
+    def testalbums_per_artist(self):
+        albums = self.table.albums_per_artist()
+        self.assertEqual(1, albums['piman'])
+        self.assertEqual(len(self.table.count_by('artist')), len(albums))
+
+    def testmissing_counts(self):
+        counts = self.table.missing_counts()
+        self.assertEqual(0, counts['title'])
+        self.assertEqual(int(np.count_nonzero(self.table['year'] == 0)), counts['year'])
+
+    def testyear_histogram(self):
+        histogram = self.table.year_histogram()
+        self.assertEqual(1, histogram[2004])
+        self.assertNotIn(0, histogram)
+
+    def testempty(self):
+        table = SongTable.from_songs([])
+        self.assertEqual(0, len(table))
+        self.assertEqual({}, table.count_by('artist'))
+        self.assertEqual({}, table.albums_per_artist())
+
+    def testto_arrow(self):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError: #pragma: no cover
+            self.skipTest('pyarrow is not installed')
+
+        arrow = self.table.to_arrow()
+        self.assertEqual(3, arrow.num_rows)
+        self.assertEqual(sorted(self.table['title']),
+                         sorted(arrow.column('title').to_pylist()))
+
+        filepath = os.path.join(self.tmpdir, 'library.parquet')
+        self.table.to_parquet(filepath)
+        self.assertEqual(arrow.to_pylist(), pq.read_table(filepath).to_pylist())
+
+if __name__ == '__main__': #pragma: no cover
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+"""
+================================================================================
+:mod:`test_mover` -- Unit tests for the module :mod:`mover`.
+================================================================================
+
+"""
+
+# Standard library modules.
+import unittest
+import logging
+import shutil
+import tempfile
+import errno
+import os
+from unittest import mock
+
+# Third party modules.
+
+# Local modules.
+import musictools.mover as mover_module
+from musictools.mover import Mover, copy_data, copy_and_remove
+
+# Globals and constants variables.
+
+def _rename_exdev(src, dst):
+    raise OSError(errno.EXDEV, 'Invalid cross-device link')
+
+class TestMover(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = os.urandom(100000)
+        self.src = os.path.join(self.tmpdir, 'src.mp3')
+        with open(self.src, 'wb') as fp:
+            fp.write(self.data)
+        os.utime(self.src, (1000000000, 1000000000))
+        self.dst = os.path.join(self.tmpdir, 'dst.mp3')
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _read(self, filepath):
+        with open(filepath, 'rb') as fp:
+            return fp.read()
+
+    def _copy_data(self, method):
+        with mock.patch.object(mover_module, 'COPY_CHUNK_SIZE', 4096), \
+                mock.patch.object(mover_module, '_copy_methods', lambda: [method]), \
+                open(self.src, 'rb') as infp, open(self.dst, 'wb') as outfp:
+            return copy_data(infp.fileno(), outfp.fileno())
+
+    def testcopy_data(self):
+        methods = mover_module._copy_methods()
+        self.assertIn(mover_module._pread_write, methods)
+
+        for method in methods:
+            self.assertEqual(len(self.data), self._copy_data(method))
+            self.assertEqual(self.data, self._read(self.dst))
+
+    def testcopy_data_fallback(self):
+        def unsupported(infd, outfd, offset):
+            if offset >= 8192:
+                raise OSError(errno.EXDEV, 'Invalid cross-device link')
+            return mover_module._pread_write(infd, outfd, offset)
+
+        with mock.patch.object(mover_module, 'COPY_CHUNK_SIZE', 4096), \
+                mock.patch.object(mover_module, '_copy_methods',
+                                  lambda: [unsupported, mover_module._pread_write]), \
+                open(self.src, 'rb') as infp, open(self.dst, 'wb') as outfp:
+            copy_data(infp.fileno(), outfp.fileno())
+
+        self.assertEqual(self.data, self._read(self.dst))
+
+    def testcopy_data_empty_fallback(self):
+        # End of file reported at the start of a non-empty file
+        empty = lambda infd, outfd, offset: 0
+
+        with mock.patch.object(mover_module, '_copy_methods',
+                               lambda: [empty, mover_module._pread_write]), \
+                open(self.src, 'rb') as infp, open(self.dst, 'wb') as outfp:
+            self.assertEqual(len(self.data), copy_data(infp.fileno(), outfp.fileno()))
+
+        self.assertEqual(self.data, self._read(self.dst))
+
+    def testcopy_and_remove(self):
+        copy_and_remove(self.src, self.dst)
+
+        self.assertFalse(os.path.exists(self.src))
+        self.assertEqual(self.data, self._read(self.dst))
+        self.assertEqual(1000000000, os.stat(self.dst).st_mtime)
+        self.assertEqual(['dst.mp3'], os.listdir(self.tmpdir))
+
+    def testcopy_and_remove_error(self):
+        os.remove(self.src)
+        self.assertRaises(OSError, copy_and_remove, self.src, self.dst)
+        self.assertEqual([], os.listdir(self.tmpdir))
+
+    def testcopy_and_remove_incomplete(self):
+        with mock.patch.object(mover_module, 'copy_data', lambda infd, outfd: 10):
+            self.assertRaises(IOError, copy_and_remove, self.src, self.dst)
+
+        self.assertEqual(self.data, self._read(self.src))
+        self.assertEqual(['src.mp3'], os.listdir(self.tmpdir))
+
+    def testmove(self):
+        with Mover() as mover:
+            mover.move(self.src, self.dst)
+        self.assertEqual(self.data, self._read(self.dst))
+        self.assertFalse(os.path.exists(self.src))
+
+    def testmove_cross_device(self):
+        filepaths = []
+        for i in range(10):
+            filepath = os.path.join(self.tmpdir, '%i.mp3' % i)
+            shutil.copy(self.src, filepath)
+            filepaths.append(filepath)
+
+        with mock.patch.object(mover_module.os, 'rename', _rename_exdev), \
+                Mover(max_workers=3) as mover:
+            futures = [mover.submit(filepath, filepath + '.moved')
+                       for filepath in filepaths]
+            for future in futures:
+                future.result()
+
+        for filepath in filepaths:
+            self.assertFalse(os.path.exists(filepath))
+            self.assertEqual(self.data, self._read(filepath + '.moved'))
+
+    def testmove_error(self):
+        with Mover() as mover:
+            future = mover.submit(os.path.join(self.tmpdir, 'missing'), self.dst)
+            self.assertIsInstance(future.exception(), OSError)
+
+if __name__ == '__main__': #pragma: no cover
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
@@ -0,0 +1,239 @@
+#!/usr/bin/env python
+"""
+================================================================================
+:mod:`test_musicbrainz` -- Unit tests for the module :mod:`musicbrainz`.
+================================================================================
+
+"""
+
+# Standard library modules.
+import unittest
+import logging
+import shutil
+import tempfile
+import json
+import os
+import time
+import threading
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+# Third party modules.
+import musicbrainzngs
+
+# Local modules.
+from musictools.musicbrainz import \
+    (ReleaseCache, FixtureBackend, OfflineError, BulkClient, RateLimiter,
+     cached_call, release_key, RELEASE_INCLUDES)
+from musictools.utils import get_release
+
+# Globals and constants variables.
+DISCID = 'ubhYGAMKtirc0PWBn6z.MjPkIgU-'
+RELEASE_ID = '8e6b8d2e-4a4e-4a7a-8b4b-0f2c4e8f7a11'
+
+class TestReleaseCache(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = ReleaseCache(os.path.join(self.tmpdir, 'cache'))
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def testget_set(self):
+        self.assertIsNone(self.cache.get('disc-' + DISCID))
+        self.cache.set('disc-' + DISCID, {'a': 1})
+        self.assertEqual({'a': 1}, self.cache.get('disc-' + DISCID))
+
+    def testttl(self):
+        self.cache.set('a', 1)
+        filepath = os.path.join(self.cache.dirpath, 'a.json')
+        os.utime(filepath, (0, time.time() - self.cache.ttl - 1))
+        self.assertIsNone(self.cache.get('a'))
+        self.assertFalse(os.path.exists(filepath))
+
+    def testmax_size(self):
+        self.cache.max_size = 250
+        for i in range(5):
+            self.cache.set(str(i), 'x' * 100)
+            mtime = time.time() - 100 + i
+            os.utime(os.path.join(self.cache.dirpath, '%i.json' % i), (mtime, mtime))
+
+        self.assertIsNone(self.cache.get('0'))
+        self.assertIsNone(self.cache.get('1'))
+        self.assertIsNone(self.cache.get('2'))
+        self.assertEqual('x' * 100, self.cache.get('3'))
+        self.assertEqual('x' * 100, self.cache.get('4'))
+
+    def testcached_call(self):
+        calls = []
+        fetch = lambda: calls.append(1) or 'value'
+
+        self.assertEqual('value', cached_call(self.cache, 'a', fetch))
+        self.assertEqual('value', cached_call(self.cache, 'a', fetch))
+        self.assertEqual(1, len(calls))
+
+        self.assertRaises(OfflineError, cached_call, self.cache, 'b', fetch, True)
+        self.assertRaises(OfflineError, cached_call, None, 'b', fetch, True)
+
+class TestGetRelease(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = ReleaseCache(os.path.join(self.tmpdir, 'cache'))
+
+        fixturedir = os.path.join(self.tmpdir, 'fixtures')
+        os.makedirs(fixturedir)
+        disc = {'disc': {'release-list': [{'id': RELEASE_ID}]}}
+        with open(os.path.join(fixturedir, 'disc-%s.json' % DISCID), 'w') as fp:
+            json.dump(disc, fp)
+        release = {'release': {'id': RELEASE_ID, 'title': 'Used to Be Duke'}}
+        with open(os.path.join(fixturedir, 'release-%s.json' % RELEASE_ID), 'w') as fp:
+            json.dump(release, fp)
+        self.backend = FixtureBackend(fixturedir)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def testget_release(self):
+        release = get_release(DISCID, backend=self.backend)
+        self.assertEqual('Used to Be Duke', release['title'])
+
+    def testget_release_unknown(self):
+        self.assertRaises(musicbrainzngs.ResponseError,
+                          get_release, 'abc', backend=self.backend)
+
+    def testget_release_offline(self):
+        self.assertRaises(OfflineError, get_release, DISCID,
+                          cache=self.cache, offline=True, backend=self.backend)
+
+        get_release(DISCID, cache=self.cache, backend=self.backend)
+
+        shutil.rmtree(self.backend.dirpath)
+        release = get_release(DISCID, cache=self.cache, offline=True)
+        self.assertEqual('Used to Be Duke', release['title'])
+
+class _FakeBackend(object):
+
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def get_release_by_id(self, release_id, includes=()):
+        with self.lock:
+            self.calls.append((time.monotonic(), release_id))
+            if self.failures > 0:
+                self.failures -= 1
+                raise musicbrainzngs.NetworkError('Connection reset')
+        if release_id == 'unknown':
+            raise musicbrainzngs.ResponseError('Not found')
+        return {'release': {'id': release_id}}
+
+class _MockHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        release_id = self.path.split('?')[0].rstrip('/').split('/')[-1]
+        body = ('<?xml version="1.0" encoding="UTF-8"?>'
+                '<metadata xmlns="http://musicbrainz.org/ns/mmd-2.0#">'
+                '<release id="%s"><title>Title %s</title></release>'
+                '</metadata>' % (release_id, release_id)).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/xml')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class TestBulkClient(unittest.TestCase):
+
+    def testrate_limiter(self):
+        limiter = RateLimiter(rate=50.0)
+        start = time.monotonic()
+        for _ in range(6):
+            limiter.wait()
+        self.assertGreaterEqual(time.monotonic() - start, 5 * 0.02)
+
+    def testreleases(self):
+        backend = _FakeBackend()
+        with BulkClient(backend, rate=50.0, max_workers=4) as client:
+            ids = ['a', 'b', 'c', 'a', 'b']
+            results = dict((release_id, future.result()['release']['id'])
+                           for release_id, future in client.releases(ids))
+
+        self.assertEqual({'a': 'a', 'b': 'b', 'c': 'c'}, results)
+        self.assertEqual(3, len(backend.calls))
+
+        times = sorted(t for t, _ in backend.calls)
+        for t0, t1 in zip(times, times[1:]):
+            self.assertGreaterEqual(t1 - t0, 0.015)
+
+    def testreleases_retry(self):
+        backend = _FakeBackend(failures=2)
+        with BulkClient(backend, rate=100.0, retries=2, backoff=0.01) as client:
+            results = dict(client.releases(['a', 'unknown']))
+            self.assertEqual('a', results['a'].result()['release']['id'])
+            self.assertRaises(musicbrainzngs.ResponseError, results['unknown'].result)
+
+    def testreleases_cache(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            cache = ReleaseCache(tmpdir)
+            backend = _FakeBackend()
+            with BulkClient(backend, cache=cache, rate=100.0) as client:
+                list(client.releases(['a', 'b']))
+            with BulkClient(backend, cache=cache, rate=100.0) as client:
+                list(client.releases(['a', 'b']))
+            self.assertEqual(2, len(backend.calls))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testreleases_includes(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            cache = ReleaseCache(tmpdir)
+            backend = _FakeBackend()
+            with BulkClient(backend, cache=cache, rate=100.0) as client:
+                client.submit_release('a', ['artists']).result()
+                client.submit_release('a', ['recordings', 'artists']).result()
+                client.submit_release('a', ['artists', 'recordings']).result()
+                self.assertEqual({}, client._futures)
+            self.assertEqual(2, len(backend.calls))
+            self.assertIsNotNone(cache.get(release_key('a', ['recordings', 'artists'])))
+            self.assertIsNone(cache.get(release_key('a')))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testrelease_key(self):
+        self.assertEqual(release_key('a', sorted(RELEASE_INCLUDES)), release_key('a'))
+        self.assertNotEqual(release_key('a', ['artists']), release_key('a'))
+
+    def testreleases_mock_server(self):
+        server = HTTPServer(('127.0.0.1', 0), _MockHandler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+
+        musicbrainzngs.set_hostname('127.0.0.1:%i' % server.server_port)
+        musicbrainzngs.set_rate_limit(False)
+        try:
+            with BulkClient(rate=100.0) as client:
+                results = dict((release_id, future.result()['release']['title'])
+                               for release_id, future in client.releases(['x', 'y']))
+            self.assertEqual({'x': 'Title x', 'y': 'Title y'}, results)
+        finally:
+            musicbrainzngs.set_rate_limit(1.0, 1)
+            musicbrainzngs.set_hostname('musicbrainz.org', use_https=True)
+            server.shutdown()
+            server.server_close()
+            thread.join()
+
+if __name__ == '__main__': #pragma: no cover
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
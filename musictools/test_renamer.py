@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+"""
+================================================================================
+:mod:`test_renamer` -- Unit tests for the module :mod:`renamer`.
+================================================================================
+
+"""
+
+# Standard library modules.
+import unittest
+import logging
+import shutil
+import tempfile
+import os
+
+# Third party modules.
+
+# Local modules.
+from musictools.renamer import \
+    (RenamePlan, execute, COLLISION_DUPLICATE, COLLISION_EXISTS, COLLISION_CYCLE)
+
+# Globals and constants variables.
+
+class TestRenamePlan(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.plan = RenamePlan()
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _path(self, *names):
+        return os.path.join(self.tmpdir, *names)
+
+    def _create(self, *names):
+        filepath = self._path(*names)
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(filepath, 'w') as fp:
+            fp.write(filepath)
+        return filepath
+
+    def testplan(self):
+        a = self._create('in', 'a.mp3')
+        b = self._create('in', 'b.mp3')
+        c = self._create('in', 'c.mp3')
+        self.plan.add(a, self._path('out', 'y', 'a.mp3'))
+        self.plan.add(b, self._path('out', 'x', 'b.mp3'))
+        self.plan.add(c, self._path('out', 'y', 'c.mp3'))
+        self.plan.close()
+
+        self.assertEqual([b, a, c], [move.src for move in self.plan.moves])
+        self.assertEqual([self._path('out', 'x'), self._path('out', 'y')],
+                         self.plan.dirpaths)
+        self.assertEqual([], self.plan.collisions)
+
+    def testduplicate(self):
+        a = self._create('in', 'a.mp3')
+        b = self._create('in', 'b.mp3')
+        self.plan.add(a, self._path('out', 'song.mp3'))
+        self.plan.add(b, self._path('out', 'song.mp3'))
+        self.plan.close()
+
+        self.assertEqual([], self.plan.moves)
+        self.assertEqual(1, len(self.plan.collisions))
+        self.assertEqual([a, b], self.plan.collisions[0].srcs)
+        self.assertEqual(COLLISION_DUPLICATE, self.plan.collisions[0].reason)
+
+    def testexists(self):
+        a = self._create('in', 'a.mp3')
+        dst = self._create('out', 'a.mp3')
+        self.plan.add(a, dst)
+        self.plan.close()
+
+        self.assertEqual([], self.plan.moves)
+        self.assertEqual(COLLISION_EXISTS, self.plan.collisions[0].reason)
+
+    def testnoop(self):
+        a = self._create('a.mp3')
+        self.plan.add(a, os.path.join(self.tmpdir, '.', 'a.mp3'))
+        self.plan.close()
+
+        self.assertEqual([], self.plan.moves)
+        self.assertEqual([a], [move.src for move in self.plan.noops])
+
+    def testchain(self):
+        a = self._create('a.mp3')
+        b = self._create('b.mp3')
+        self.plan.add(a, b)
+        self.plan.add(b, self._path('c.mp3'))
+        self.plan.close()
+
+        self.assertEqual([b, a], [move.src for move in self.plan.moves])
+
+        list(execute(self.plan))
+        with open(self._path('c.mp3')) as fp:
+            self.assertEqual(b, fp.read())
+        with open(b) as fp:
+            self.assertEqual(a, fp.read())
+
+    def testcycle(self):
+        a = self._create('a.mp3')
+        b = self._create('b.mp3')
+        self.plan.add(a, b)
+        self.plan.add(b, a)
+        self.plan.close()
+
+        self.assertEqual([], self.plan.moves)
+        self.assertEqual([COLLISION_CYCLE] * 2,
+                         [collision.reason for collision in self.plan.collisions])
+
+    def testexecute(self):
+        a = self._create('in', 'a.mp3')
+        b = self._create('in', 'b.mp3')
+        self.plan.add(a, self._path('out', 'x', 'a.mp3'))
+        self.plan.add(b, self._path('out', 'x', 'b.mp3'))
+        self.plan.close()
+
+        os.remove(b)
+        results = list(execute(self.plan))
+
+        self.assertIsNone(results[0][1])
+        self.assertIsInstance(results[1][1], OSError)
+        self.assertTrue(os.path.exists(self._path('out', 'x', 'a.mp3')))
+        self.assertFalse(os.path.exists(a))
+
+if __name__ == '__main__': #pragma: no cover
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
@@ -0,0 +1,151 @@
+#!/usr/bin/env python
+"""
+================================================================================
+:mod:`test_search` -- Unit tests for the module :mod:`search`.
+================================================================================
+
+"""
+
+# Standard library modules.
+import unittest
+import logging
+import shutil
+import tempfile
+import warnings
+import os
+
+# Third party modules.
+
+# Local modules.
+from musictools.search import \
+    SearchIndexBuilder, SearchIndex, InvalidIndexError, tokenize, song_tokens
+from musictools.song import Song, Artist
+
+# Globals and constants variables.
+
+class TestSearch(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        warnings.simplefilter('ignore')
+
+        self.folderpath = os.path.join(os.path.dirname(__file__), "testData")
+        self.song1_filepath = os.path.join(self.folderpath, 'song.mp3')
+        self.song2_filepath = os.path.join(self.folderpath, 'song3.ogg')
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.index_filepath = os.path.join(self.tmpdir, 'search.idx')
+
+        self.builder = SearchIndexBuilder()
+        self.builder.add(Song(self.song1_filepath))
+        self.builder.add(Song(self.song2_filepath))
+        self.builder.add(self._song('/music/beatles.mp3', 'The Beatles',
+                                    'Abbey Road', 'Here Comes the Sun'))
+        self.builder.add(self._song('/music/bjork.ogg', u'Bj\xf6rk',
+                                    u'Homog\xe9nic', u'J\xf3ga'))
+        self.builder.save(self.index_filepath)
+
+        self.index = SearchIndex(self.index_filepath)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        self.index.close()
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+        warnings.resetwarnings()
+
+    def _song(self, filepath, artist, albumtitle, title):
+        song = Song._from_fields(filepath, {'artists': [Artist(name=artist)],
+                                            'albumtitle': albumtitle,
+                                            'title': title})
+        return song
+
+    def testtokenize(self):
+        self.assertEqual(['what', 'a', 'wonderful', 'world'],
+                         tokenize('What a Wonderful World!'))
+        self.assertEqual(['bjork', 'kd', 'lang'], tokenize(u'Bj\xf6rk, K.D. Lang'))
+
+    def testsong_tokens(self):
+        song = self._song('/a.mp3', 'The Beatles', 'Abbey Road', 'Here Comes the Sun')
+        self.assertEqual(set(['the', 'beatles', 'abbey', 'road', 'here', 'comes', 'sun']),
+                         song_tokens(song))
+
+    def testlen(self):
+        self.assertEqual(4, len(self.index))
+        self.assertEqual(['/music/beatles.mp3', '/music/bjork.ogg'],
+                         [self.index.path(docid) for docid in range(2)])
+
+    def testsearch(self):
+        self.assertEqual(['/music/bjork.ogg'], self.index.search(u'BJ\xd6RK'))
+        self.assertEqual([self.song2_filepath], self.index.search('wonderful tony'))
+        self.assertEqual([], self.index.search('wonderful beatles'))
+        self.assertEqual([], self.index.search(''))
+
+    def testsearch_prefix(self):
+        self.assertEqual(['/music/beatles.mp3'], self.index.search('beat'))
+        self.assertEqual([], self.index.search('beat', prefix=False))
+        self.assertEqual(['/music/beatles.mp3', '/music/bjork.ogg', self.song2_filepath],
+                         self.index.search('b'))
+
+    def testsearch_fuzzy(self):
+        self.assertEqual([], self.index.search('beatels'))
+        self.assertEqual(['/music/beatles.mp3'], self.index.search('beatels', fuzzy=True))
+        self.assertEqual(['/music/beatles.mp3'], self.index.search('abey rod', fuzzy=True))
+        self.assertEqual([self.song1_filepath], self.index.search('silense', fuzzy=True))
+
+    def testsearch_limit(self):
+        self.assertEqual(1, len(self.index.search('b', limit=1)))
+
+    def testterms(self):
+        self.assertEqual(['wonderful'], self.index.terms('wonderful'))
+        self.assertEqual(['what', 'wonderful', 'world'], self.index.terms('w', prefix=True))
+        self.assertEqual(['world'], self.index.terms('wrld', fuzzy=True))
+        self.assertEqual(['world'], self.index.terms('wordl', fuzzy=True))
+        self.assertEqual(['world'], self.index.terms('worlds', fuzzy=True))
+        self.assertEqual(['world'], self.index.terms('warld', fuzzy=True))
+        self.assertEqual([], self.index.terms('wrd', fuzzy=True))
+        self.assertEqual([], self.index.terms('su', fuzzy=True)) # too short
+
+    def testupdate(self):
+        self.index.close()
+
+        with SearchIndex(self.index_filepath) as index:
+            builder = SearchIndexBuilder.from_index(index)
+        self.assertEqual(4, len(builder))
+        self.assertIn('/music/beatles.mp3', builder)
+
+        builder.remove('/music/beatles.mp3')
+        builder.add(self._song('/music/bjork.ogg', u'Bj\xf6rk', 'Debut', 'Human Behaviour'))
+        builder.save(self.index_filepath)
+
+        self.index = SearchIndex(self.index_filepath)
+        self.assertEqual(3, len(self.index))
+        self.assertEqual([], self.index.search('beatles'))
+        self.assertEqual([], self.index.search('joga'))
+        self.assertEqual(['/music/bjork.ogg'], self.index.search('bjork human'))
+        self.assertEqual([self.song2_filepath], self.index.search('tony bennett'))
+
+    def testempty(self):
+        filepath = os.path.join(self.tmpdir, 'empty.idx')
+        SearchIndexBuilder().save(filepath)
+        with SearchIndex(filepath) as index:
+            self.assertEqual(0, len(index))
+            self.assertEqual([], index.search('abc', fuzzy=True))
+
+    def testinvalid(self):
+        filepath = os.path.join(self.tmpdir, 'invalid.idx')
+        open(filepath, 'wb').close()
+        self.assertRaises(InvalidIndexError, SearchIndex, filepath)
+
+        with open(filepath, 'wb') as fp:
+            fp.write(b'\0' * 100)
+        self.assertRaises(InvalidIndexError, SearchIndex, filepath)
+
+        with open(self.index_filepath, 'rb') as fp:
+            data = fp.read()
+        with open(filepath, 'wb') as fp:
+            fp.write(data[:-10])
+        self.assertRaises(InvalidIndexError, SearchIndex, filepath)
+
+if __name__ == '__main__': #pragma: no cover
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
@@ -8,14 +8,24 @@
 
 # Standard library modules.
 import unittest
+import sys
 import logging
 import shutil
 import os
+import pickle
+import warnings
+import base64
 
 # Third party modules.
+import mutagen.id3 as id3
+import mutagen.oggvorbis as ogg
+import mutagen.flac as flac
+from mutagen.ogg import OggPage
 
 # Local modules.
-from musictools.song import Song, Artist
+from musictools.song import Song, Artist, save_statistics, FIELDS
+from musictools.tagreader import id3_tag_size
+from musictools.dedupe import hash_audio
 
 # Globals and constants variables.
 
@@ -49,6 +59,22 @@ class TestArtist(unittest.TestCase):
         artist = Artist(name='John John')
         self.assertTrue(self.artist1 != artist)
 
+    def testintern(self):
+        self.assertIs(self.artist1, self.artist2)
+        self.assertIs(self.artist1, Artist(name='  John Doe '))
+        self.assertIsNot(self.artist1, Artist(name='John John'))
+
+    def testslots(self):
+        self.assertRaises(AttributeError, setattr, self.artist1, 'x', 1)
+
+    def testimmutable(self):
+        self.assertRaises(AttributeError, setattr, self.artist1, '_firstname', 'Jane')
+        self.assertRaises(AttributeError, delattr, self.artist1, '_lastname')
+        self.assertEqual('John Doe', self.artist2.name)
+
+    def testpickle(self):
+        self.assertIs(self.artist1, pickle.loads(pickle.dumps(self.artist1)))
+
 class TestSong(unittest.TestCase):
 
     def setUp(self):
@@ -136,6 +162,10 @@ class TestSong(unittest.TestCase):
         self.assertEqual(self.song1.genre, 'Silence')
         self.assertEqual(self.song2.genre, 'Vocal')
 
+    def testlength(self):
+        self.assertAlmostEqual(self.song1.length, 3.77, 2)
+        self.assertAlmostEqual(self.song2.length, 203.13, 2)
+
     def testformatted_filename(self):
         self.assertEqual('2_silence.mp3', self.song1.formatted_filename)
 
@@ -193,6 +223,264 @@ class TestSong(unittest.TestCase):
 
         os.remove(testfilepath)
 
+    def testslots(self):
+        self.assertFalse(hasattr(self.song1, '__dict__'))
+        self.assertIs(self.song2.artists[0], Artist(name='K.D. Lang'))
+
+    def testmemory(self):
+        # Song and the containers it owns, not the shared artists and strings
+        def size(song):
+            size = sys.getsizeof(song)
+            for name in Song.__slots__:
+                value = getattr(song, name, None)
+                if isinstance(value, (list, tuple, dict)) and value:
+                    size += sys.getsizeof(value)
+            return size
+
+        # Same attributes stored in an instance dictionary
+        class DictSong(object):
+            pass
+
+        for song in [self.song1, self.song2]:
+            dictsong = DictSong()
+            for name in ('filepath', 'filetype') + FIELDS:
+                setattr(dictsong, name, getattr(song, name))
+            expected = sys.getsizeof(dictsong) + sys.getsizeof(dictsong.__dict__) + \
+                sys.getsizeof(dictsong.artists)
+            self.assertLess(size(song), expected)
+
+    def testpickle(self):
+        song = pickle.loads(pickle.dumps(self.song2))
+        self.assertEqual(self.song2.filepath, song.filepath)
+        self.assertEqual(self.song2.artists, song.artists)
+        self.assertEqual(self.song2.title, song.title)
+        self.assertEqual(set(), song.modified_fields)
+
+    def testmodified_fields(self):
+        self.assertEqual(set(), self.song1.modified_fields)
+
+        self.song1.title = 'abc'
+        self.song1.artists.append(Artist(name='John Doe'))
+        self.assertEqual(set(['title', 'artists']), self.song1.modified_fields)
+
+    def testlazy(self):
+        song = Song(self.song1_filepath, lazy=True)
+        self.assertIsNone(song._frames)
+
+        self.assertEqual('Silence', song.title)
+        self.assertIsNotNone(song._frames)
+        self.assertEqual([Artist(name='piman')], song.artists)
+        self.assertEqual(2004, song.year)
+
+        song = Song.open(self.song2_filepath)
+        self.assertEqual(self.song2.artists, song.artists)
+        self.assertEqual(self.song2.tracknumber, song.tracknumber)
+
+        # The raw tags are dropped once all attributes are decoded
+        for name in FIELDS:
+            getattr(song, name)
+        self.assertIsNone(song._frames)
+        self.assertIsNone(self.song1._frames)
+
+    def testlazy_diagnostics(self):
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            song = Song(self.song1_filepath, lazy=True)
+            self.assertEqual(0, song.discnumber)
+        self.assertEqual([], caught)
+
+        self.assertEqual(1, len(song.diagnostics))
+        self.assertEqual('discnumber', song.diagnostics[0].field)
+        self.assertEqual(self.song1_filepath, song.diagnostics[0].filepath)
+        self.assertIn('disc number', song.diagnostics[0].message)
+        self.assertEqual(('discnumber',), song._missing)
+
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            song = Song(self.song1_filepath)
+        self.assertEqual(len(song.diagnostics), len(caught))
+        self.assertIn('discnumber', [diagnostic.field for diagnostic in song.diagnostics])
+
+    def testlazy_modified_fields(self):
+        song = Song(self.song1_filepath, lazy=True)
+        self.assertEqual(set(), song.modified_fields)
+
+        song.title = 'abc'
+        song.artists.append(Artist(name='John Doe'))
+        song.year
+        self.assertEqual(set(['title', 'artists']), song.modified_fields)
+
+    def testlazy_save(self):
+        testfilepath = os.path.join(self.folderpath, 'test.mp3')
+        shutil.copy(self.song1_filepath, testfilepath)
+        try:
+            song = Song(testfilepath, lazy=True)
+            song.title = 'Other'
+            song.save()
+
+            song = Song(testfilepath)
+            self.assertEqual('Other', song.title)
+            self.assertEqual('Quod Libet Test Data', song.albumtitle)
+        finally:
+            os.remove(testfilepath)
+
+    def testlazy_pickle(self):
+        song = Song(self.song2_filepath, lazy=True)
+        song.title
+        song = pickle.loads(pickle.dumps(song))
+        self.assertEqual(self.song2.title, song.title)
+        self.assertEqual(self.song2.albumtitle, song.albumtitle)
+        self.assertEqual(set(), song.modified_fields)
+
+    def testcover_art(self):
+        self.assertIsNone(self.song1.cover_art)
+        self.assertIsNone(self.song2.cover_art)
+
+        testfilepath = os.path.join(self.folderpath, 'test.mp3')
+        shutil.copy(self.song1_filepath, testfilepath)
+        try:
+            data = os.urandom(200000)
+            mp3info = id3.ID3(testfilepath)
+            mp3info.add(id3.APIC(encoding=3, mime='image/png', type=4,
+                                 desc=u'back', data=b'back'))
+            mp3info.add(id3.APIC(encoding=3, mime='image/jpeg', type=3,
+                                 desc=u'front', data=data))
+            mp3info.save(testfilepath)
+
+            song = Song(testfilepath, lazy=True)
+            self.assertEqual('Silence', song.title)
+            self.assertEqual(2, len(song._binary_frames))
+
+            cover_art = song.cover_art
+            self.assertEqual('image/jpeg', cover_art.mime)
+            self.assertEqual(3, cover_art.type)
+            self.assertEqual(data, cover_art.data)
+            self.assertNotIn(data, pickle.dumps(song))
+        finally:
+            os.remove(testfilepath)
+
+    def testcover_art_ogg(self):
+        testfilepath = os.path.join(self.folderpath, 'test.ogg')
+        shutil.copy(self.song2_filepath, testfilepath)
+        try:
+            picture = flac.Picture()
+            picture.type = 3
+            picture.mime = 'image/png'
+            picture.desc = u'front'
+            picture.data = os.urandom(50000)
+            ogginfo = ogg.OggVorbis(testfilepath)
+            ogginfo['metadata_block_picture'] = \
+                [base64.b64encode(picture.write()).decode('ascii')]
+            ogginfo.save()
+
+            song = Song(testfilepath, lazy=True)
+            self.assertEqual(self.song2.title, song.title)
+            self.assertNotIn('metadata_block_picture', song._frames)
+
+            cover_art = song.cover_art
+            self.assertEqual('image/png', cover_art.mime)
+            self.assertEqual(picture.data, cover_art.data)
+        finally:
+            os.remove(testfilepath)
+
+    def testsave_unmodified(self):
+        testfilepath = os.path.join(self.folderpath, 'test.mp3')
+        shutil.copy(self.song1_filepath, testfilepath)
+        os.utime(testfilepath, (0, 0))
+
+        song = Song(testfilepath)
+        song.save()
+        self.assertEqual(0, os.stat(testfilepath).st_mtime)
+
+        os.remove(testfilepath)
+
+    def testsave_modified_only(self):
+        testfilepath = os.path.join(self.folderpath, 'test.ogg')
+        shutil.copy(self.song2_filepath, testfilepath)
+
+        song = Song(testfilepath)
+        song.title = 'abc'
+        song.save()
+        self.assertEqual(set(), song.modified_fields)
+
+        songTest = Song(testfilepath)
+        self.assertEqual(songTest.title, 'abc')
+        self.assertEqual(songTest.albumtitle, u'A Wonderful World')
+        self.assertEqual(songTest.tracknumber, 5)
+        self.assertNotIn('description', ogg.OggVorbis(testfilepath))
+
+        os.remove(testfilepath)
+
+    def _assert_save_inplace_and_rewrite(self, testfilepath):
+        save_statistics.clear()
+
+        song = Song(testfilepath)
+        song.title = 'abc'
+        song.save()
+        self.assertEqual(1, save_statistics['inplace'])
+        self.assertEqual(0, save_statistics['rewrite'])
+
+        song.title = 'x' * 20000
+        song.save(padding=10000)
+        self.assertEqual(1, save_statistics['inplace'])
+        self.assertEqual(1, save_statistics['rewrite'])
+        self.assertEqual('x' * 20000, Song(testfilepath).title)
+        self.assertEqual([], [filename for filename in os.listdir(self.folderpath)
+                              if filename.endswith('.tmp')])
+
+        # The reserved padding is used by the next save
+        song.title = 'y' * 25000
+        song.save()
+        self.assertEqual(2, save_statistics['inplace'])
+        self.assertEqual(1, save_statistics['rewrite'])
+        self.assertEqual('y' * 25000, Song(testfilepath).title)
+
+    def testsave_mp3_rewrite(self):
+        testfilepath = os.path.join(self.folderpath, 'test.mp3')
+        shutil.copy(self.song1_filepath, testfilepath)
+
+        with open(self.song1_filepath, 'rb') as fp:
+            id3_tag_size(fp)
+            audio = fp.read()[:-128] # without ID3v1 tag
+
+        self._assert_save_inplace_and_rewrite(testfilepath)
+
+        with open(testfilepath, 'rb') as fp:
+            id3_tag_size(fp)
+            self.assertEqual(audio, fp.read()[:-128])
+
+        os.remove(testfilepath)
+
+    def testsave_ogg_rewrite(self):
+        testfilepath = os.path.join(self.folderpath, 'test.ogg')
+        shutil.copy(self.song2_filepath, testfilepath)
+
+        audio = hash_audio(testfilepath)
+
+        self._assert_save_inplace_and_rewrite(testfilepath)
+        self.assertAlmostEqual(Song(testfilepath).length, 203.13, 2)
+        self.assertEqual(audio, hash_audio(testfilepath))
+
+        # Comment header over several pages: the audio pages are renumbered
+        song = Song(testfilepath)
+        song.title = 'z' * 200000
+        song.save(padding=0)
+        self.assertEqual('z' * 200000, Song(testfilepath).title)
+        self.assertAlmostEqual(Song(testfilepath).length, 203.13, 2)
+        self.assertEqual(audio, hash_audio(testfilepath))
+
+        with open(testfilepath, 'rb') as fp:
+            data = fp.read()
+            fp.seek(0)
+            sequences = []
+            while fp.tell() < len(data):
+                page = OggPage(fp)
+                sequences.append(page.sequence)
+                self.assertEqual(data[page.offset:page.offset + page.size], page.write())
+        self.assertEqual(list(range(len(sequences))), sequences)
+
+        os.remove(testfilepath)
+
 if __name__ == '__main__': #pragma: no cover
     logging.getLogger().setLevel(logging.DEBUG)
     unittest.main()
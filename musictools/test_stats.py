@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+"""
+================================================================================
+:mod:`test_stats` -- Unit tests for the module :mod:`stats`.
+================================================================================
+
+"""
+
+# Standard library modules.
+import unittest
+import logging
+import tempfile
+import shutil
+import json
+import os
+
+# Third party modules.
+
+# Local modules.
+from musictools.stats import Stats, NullStats, Histogram, create_stats
+
+# Globals and constants variables.
+
+class TestHistogram(unittest.TestCase):
+
+    def testobserve(self):
+        histogram = Histogram([0.1, 1.0])
+        histogram.observe(0.05)
+        histogram.observe(0.1)
+        histogram.observe(0.5)
+        histogram.observe(5.0)
+
+        self.assertEqual([2, 1], histogram.counts)
+        self.assertEqual([2, 3], histogram.cumulative_counts())
+        self.assertEqual(4, histogram.count)
+        self.assertAlmostEqual(5.65, histogram.sum, 4)
+
+class TestStats(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+
+        self.stats = Stats('test', buckets=[0.1, 1.0])
+
+    def testphase(self):
+        with self.stats.phase('a'):
+            pass
+        self.assertRaises(ValueError, self._fail_in_phase)
+
+        self.assertEqual(2, self.stats.phases['a'].count)
+
+    def _fail_in_phase(self):
+        with self.stats.phase('a'):
+            raise ValueError
+
+    def testiterate(self):
+        self.assertEqual([1, 2, 3], list(self.stats.iterate('walk', [1, 2, 3])))
+        self.assertEqual(4, self.stats.phases['walk'].count)
+
+    def testcount(self):
+        self.stats.count('files')
+        self.stats.count('files')
+        self.stats.count('bytes', 100)
+        self.assertEqual({'files': 2, 'bytes': 100}, self.stats.counters)
+
+    def testto_json(self):
+        self.stats.observe('parse', 0.5)
+        self.stats.count('files')
+
+        data = json.loads(self.stats.to_json())
+        self.assertEqual(1, data['phases']['parse']['count'])
+        self.assertEqual({'0.1': 0, '1.0': 1}, data['phases']['parse']['buckets'])
+        self.assertEqual({'files': 1}, data['counters'])
+
+    def testto_prometheus(self):
+        self.stats.observe('parse', 0.05)
+        self.stats.observe('parse', 0.5)
+        self.stats.count('files', 2)
+
+        lines = self.stats.to_prometheus().splitlines()
+        self.assertIn('# TYPE test_phase_seconds histogram', lines)
+        self.assertIn('test_phase_seconds_bucket{phase="parse",le="0.1"} 1', lines)
+        self.assertIn('test_phase_seconds_bucket{phase="parse",le="1.0"} 2', lines)
+        self.assertIn('test_phase_seconds_bucket{phase="parse",le="+Inf"} 2', lines)
+        self.assertIn('test_phase_seconds_count{phase="parse"} 2', lines)
+        self.assertIn('# TYPE test_files_total counter', lines)
+        self.assertIn('test_files_total 2', lines)
+
+    def testdump(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filepath = os.path.join(tmpdir, 'stats.json')
+            self.stats.count('files')
+            self.stats.dump(filepath)
+            with open(filepath, 'r') as fp:
+                self.assertEqual({'files': 1}, json.load(fp)['counters'])
+
+            self.assertRaises(ValueError, self.stats.dump, filepath, 'xml')
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def testnull(self):
+        stats = create_stats(False)
+        self.assertIsInstance(stats, NullStats)
+        self.assertFalse(stats.enabled)
+
+        with stats.phase('a'):
+            stats.count('files')
+        iterable = [1, 2]
+        self.assertIs(iterable, stats.iterate('walk', iterable))
+
+        self.assertIsInstance(create_stats(True), Stats)
+
+if __name__ == '__main__': #pragma: no cover
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+"""
+================================================================================
+:mod:`test_tagreader` -- Unit tests for the module :mod:`tagreader`.
+================================================================================
+
+"""
+
+# Standard library modules.
+import unittest
+import logging
+import shutil
+import tempfile
+import os
+
+# Third party modules.
+import mutagen.id3 as id3
+import mutagen.oggvorbis as ogg
+
+# Local modules.
+from musictools.tagreader import \
+    (read_id3_text_frames, read_id3_frames, read_id3_picture,
+     read_vorbis_comments, UnsupportedTagError, ID3_TEXT_FRAMES)
+
+# Globals and constants variables.
+
+class TestID3Reader(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+
+        self.folderpath = os.path.join(os.path.dirname(__file__), "testData")
+        self.song1_filepath = os.path.join(self.folderpath, 'song.mp3')
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.testfilepath = os.path.join(self.tmpdir, 'test.mp3')
+        shutil.copy(self.song1_filepath, self.testfilepath)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def _mutagen_frames(self, filepath):
+        mp3info = id3.ID3(filepath)
+        frames = {}
+        for code in ID3_TEXT_FRAMES:
+            frame = mp3info.get(code)
+            if frame is not None:
+                frames[code] = [str(text) for text in frame.text]
+        return frames
+
+    def testread_v23(self):
+        frames = read_id3_text_frames(self.song1_filepath)
+        self.assertEqual(['piman', 'jzig'], frames['TPE1'])
+        self.assertEqual(['Quod Libet Test Data'], frames['TALB'])
+        self.assertEqual(['Silence'], frames['TIT2'])
+        self.assertEqual(['02/10'], frames['TRCK'])
+        self.assertEqual(['2004'], frames['TYER'])
+        self.assertEqual(['Silence'], frames['TCON'])
+        self.assertNotIn('TLEN', frames)
+
+    def testread_v24(self):
+        mp3info = id3.ID3(self.testfilepath)
+        mp3info['TIT2'] = id3.TIT2(encoding=1, text=[u'\xe9cole', u'bi\xe8re'])
+        mp3info['TALB'] = id3.TALB(encoding=3, text=u'f\xeate de no\xebl')
+        mp3info['TPE2'] = id3.TPE2(encoding=2, text=u'h\xf4pital')
+        mp3info['TPOS'] = id3.TPOS(encoding=0, text=u'1/2')
+        mp3info['COMM'] = id3.COMM(encoding=3, lang='eng', desc='', text=u'abc')
+        mp3info.save(self.testfilepath, v2_version=4)
+
+        frames = read_id3_text_frames(self.testfilepath)
+        self.assertEqual(self._mutagen_frames(self.testfilepath), frames)
+
+    def testread_binary_frames(self):
+        data = os.urandom(500000)
+        mp3info = id3.ID3(self.testfilepath)
+        mp3info.add(id3.APIC(encoding=1, mime='image/png', type=4,
+                             desc=u'back \xe9', data=b'back'))
+        mp3info.add(id3.APIC(encoding=3, mime='image/jpeg', type=3,
+                             desc=u'front', data=data))
+        mp3info.add(id3.PRIV(owner='musictools', data=b'\0' * 1000))
+        mp3info.save(self.testfilepath, v2_version=4)
+
+        frames, binary_frames = read_id3_frames(self.testfilepath)
+        self.assertEqual(self._mutagen_frames(self.testfilepath), frames)
+        self.assertEqual(['APIC', 'APIC', 'PRIV'],
+                         sorted(frame.frameid for frame in binary_frames))
+
+        priv, = [frame for frame in binary_frames if frame.frameid == 'PRIV']
+        with open(self.testfilepath, 'rb') as fp:
+            fp.seek(priv.offset)
+            self.assertEqual(b'musictools\0' + b'\0' * 1000, fp.read(priv.size))
+
+        pictures = [read_id3_picture(self.testfilepath, frame)
+                    for frame in binary_frames if frame.frameid == 'APIC']
+        pictures.sort(key=lambda picture: picture.type)
+        self.assertEqual(('image/jpeg', 3, 'front', data), tuple(pictures[0]))
+        self.assertEqual(('image/png', 4, u'back \xe9', b'back'), tuple(pictures[1]))
+
+    def testread_binary_frames_none(self):
+        frames, binary_frames = read_id3_frames(self.song1_filepath)
+        self.assertEqual(read_id3_text_frames(self.song1_filepath), frames)
+        self.assertEqual([], binary_frames)
+
+    def testread_numerical_genre(self):
+        mp3info = id3.ID3(self.testfilepath)
+        mp3info['TCON'] = id3.TCON(encoding=0, text=u'(17)')
+        mp3info.save(self.testfilepath, v2_version=3)
+
+        self.assertRaises(UnsupportedTagError, read_id3_text_frames, self.testfilepath)
+
+    def testread_no_tag(self):
+        with open(self.testfilepath, 'wb') as fp:
+            fp.write(b'\xff\xfb' + b'\0' * 100)
+
+        self.assertRaises(UnsupportedTagError, read_id3_text_frames, self.testfilepath)
+
+    def testread_truncated(self):
+        with open(self.song1_filepath, 'rb') as fp:
+            data = fp.read(200)
+        with open(self.testfilepath, 'wb') as fp:
+            fp.write(data)
+
+        self.assertRaises(UnsupportedTagError, read_id3_text_frames, self.testfilepath)
+
+class TestVorbisReader(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+
+        self.folderpath = os.path.join(os.path.dirname(__file__), "testData")
+        self.song2_filepath = os.path.join(self.folderpath, 'song3.ogg')
+
+        self.tmpdir = tempfile.mkdtemp()
+        self.testfilepath = os.path.join(self.tmpdir, 'test.ogg')
+        shutil.copy(self.song2_filepath, self.testfilepath)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+
+    def testread(self):
+        comments = read_vorbis_comments(self.song2_filepath)
+        self.assertEqual(ogg.OggVorbis(self.song2_filepath).tags.as_dict(), comments)
+        self.assertEqual(['K.D. Lang', 'Tony Bennett'], comments['artist'])
+
+    def testread_small_chunks(self):
+        comments = read_vorbis_comments(self.song2_filepath, chunksize=10)
+        self.assertEqual(['What a Wonderful World'], comments['title'])
+
+    def testread_large_comment(self):
+        # Comment header spanning several pages
+        ogginfo = ogg.OggVorbis(self.testfilepath)
+        ogginfo['description'] = [u'\xe9' * 100000]
+        ogginfo['ARTIST'] = [u'a', u'b']
+        ogginfo.save()
+
+        comments = read_vorbis_comments(self.testfilepath)
+        self.assertEqual(ogg.OggVorbis(self.testfilepath).tags.as_dict(), comments)
+
+    def testread_skip(self):
+        ogginfo = ogg.OggVorbis(self.testfilepath)
+        ogginfo['metadata_block_picture'] = [u'A' * 100000]
+        ogginfo.save()
+
+        comments = read_vorbis_comments(self.testfilepath, skip=['metadata_block_picture'])
+        self.assertNotIn('metadata_block_picture', comments)
+        self.assertEqual(['What a Wonderful World'], comments['title'])
+
+    def testread_invalid(self):
+        with open(self.testfilepath, 'r+b') as fp:
+            fp.truncate(100)
+
+        self.assertRaises(UnsupportedTagError, read_vorbis_comments, self.testfilepath)
+
+if __name__ == '__main__': #pragma: no cover
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
@@ -4,11 +4,15 @@
 # Standard library modules.
 import unittest
 import logging
+import os
+import shutil
+import tempfile
 
 # Third party modules.
 
 # Local modules.
-from musictools.utils import unicode_to_ascii, get_release
+from musictools.utils import \
+    unicode_to_ascii, slugify, slugify_all, get_release, iter_files
 
 # Globals and constants variables.
 
@@ -26,6 +30,35 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(unicode_to_ascii(u'h\xf4pital'), 'hopital')
         self.assertEqual(unicode_to_ascii(u'f\xeate de no\xebl'), 'fete de noel')
 
+    def testslugify(self):
+        self.assertEqual('fete_de_noel', slugify(u'F\xeate de No\xebl'))
+        self.assertEqual('what_a_wonderful_world_live', slugify(u'What a  Wonderful World (Live)'))
+        self.assertEqual('acdc', slugify(u'AC/DC - '))
+        self.assertEqual('sigur_ros_que', slugify(u'Sigur R\xf3s \u2013 \u00bfQu\xe9?'))
+        self.assertEqual('', slugify(u'\u6771\u4eac'))
+
+    def testslugify_all(self):
+        texts = [u'F\xeate de No\xebl', u'', u'a_b__', u'\0x (y)', u'AC/DC - ']
+        self.assertEqual([slugify(text) for text in texts], slugify_all(texts))
+        self.assertEqual([], slugify_all([]))
+
+    def testiter_files(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for filepath in ['b.mp3', 'a.ogg', 'c.txt', 'x/z.mp3', 'x/y/w.ogg', 'd.mp3/e.mp3']:
+                filepath = os.path.join(tmpdir, filepath)
+                os.makedirs(os.path.dirname(filepath), exist_ok=True)
+                open(filepath, 'w').close()
+
+            filepaths = iter_files(tmpdir, ['mp3', 'ogg'])
+            self.assertEqual(os.path.join(tmpdir, 'a.ogg'), next(filepaths))
+
+            expected = ['b.mp3', 'd.mp3/e.mp3', 'x/z.mp3', 'x/y/w.ogg']
+            expected = [os.path.join(tmpdir, filepath) for filepath in expected]
+            self.assertEqual(expected, list(filepaths))
+        finally:
+            shutil.rmtree(tmpdir)
+
     def testget_release(self):
         release = get_release('ubhYGAMKtirc0PWBn6z.MjPkIgU-')
         self.assertEqual('Used to Be Duke', release['title'])
@@ -19,7 +19,10 @@ __copyright__ = "Copyright (c) 2011 Philippe T. Pinard"
 __license__ = "GPL v3"
 
 # Standard library modules.
+import os
+import re
 import logging
+import functools
 import unicodedata
 
 # Third party modules.
@@ -27,9 +30,56 @@ import musicbrainzngs
 musicbrainzngs.set_useragent("musictools", "0.1")
 
 # Local modules.
+from musictools.musicbrainz import cached_call, release_key, RELEASE_INCLUDES
 
 # Globals and constants variables.
 
+def _char_to_ascii(char):
+    if ord(char) < 128:
+        return char
+
+    decomposition = unicodedata.decomposition(char)
+    if not decomposition: # no decomposition
+        return ''
+
+    root, *_modifier = decomposition.split()
+    try:
+        return chr(int(root, 16)) #root is in hex base
+    except ValueError:
+        return ''
+
+def _char_to_slug(char):
+    text = _char_to_ascii(char).lower()
+    text = re.sub(r"[^a-z0-9()\-\[\]\s]", "", text)
+    text = re.sub(r'\W', '_', text)
+    return text
+
+class _TranslationTable(dict):
+    """
+    Translation table for :meth:`str.translate` whose entries are computed
+    on first use by *function* and then kept.
+    The entries of the ASCII and Latin ranges are precomputed.
+    """
+
+    def __init__(self, function):
+        dict.__init__(self)
+        self._function = function
+        for codepoint in range(0x250):
+            self[codepoint]
+
+    def __missing__(self, codepoint):
+        value = self._function(chr(codepoint)) or None # None deletes
+        self[codepoint] = value
+        return value
+
+_ASCII_TABLE = _TranslationTable(_char_to_ascii)
+_SLUG_TABLE = _TranslationTable(_char_to_slug)
+_SLUG_TABLE_BATCH = _TranslationTable(lambda char: char if char == '\0' else _char_to_slug(char))
+
+_UNDERSCORES = re.compile('_+')
+
+SLUG_CACHE_SIZE = 65536
+
 def unicode_to_ascii(unistr):
     """
     Convert a unicode string into an ascii string
@@ -38,34 +88,87 @@ def unicode_to_ascii(unistr):
     :arg unistr: unicode string
     :type unistr: :keyword:`unicode`
     """
-    ascii_chrs = []
+    return unistr.translate(_ASCII_TABLE)
 
-    for char in unistr:
-        try:
-            char.encode('ascii')
-        except UnicodeEncodeError:
-            decomposition = unicodedata.decomposition(char)
+@functools.lru_cache(maxsize=SLUG_CACHE_SIZE)
+def slugify(text):
+    """
+    Returns a lower case ASCII version of *text* suitable for a file or
+    directory name: accents are removed, spaces and brackets are replaced by
+    underscores and all other punctuation is dropped.
+    Repeated values (e.g. artist and album names) are served from a cache.
+    """
+    text = _UNDERSCORES.sub('_', text.translate(_SLUG_TABLE))
+    return text.rstrip('_')
 
-            if not decomposition: # no decomposition
-                continue
+def slugify_all(texts):
+    """
+    Returns the list of :func:`slugify` of all *texts*, translated in a
+    single pass.
+    """
+    if not texts:
+        return []
+
+    texts = [text.replace('\0', '') for text in texts]
+    text = '\0'.join(texts).translate(_SLUG_TABLE_BATCH)
+    text = _UNDERSCORES.sub('_', text)
+    return [text.rstrip('_') for text in text.split('\0')]
 
-            root, *_modifier = decomposition.split()
+def iter_files(dirpaths, extensions):
+    """
+    Yields recursively, in a single pass, the path of the files in
+    *dirpaths* with one of the *extensions*.
+    Files are yielded as the directories are walked, so the first file is
+    available right away and memory does not grow with the number of files.
+    Symbolic links to directories are not followed.
+
+    :arg dirpaths: directory or list of directories
+    :arg extensions: extensions of the files, without the leading dot
+        (e.g. ``['mp3', 'ogg']``)
+    """
+    if isinstance(dirpaths, str):
+        dirpaths = [dirpaths]
+    suffixes = tuple('.' + extension for extension in extensions)
+
+    for dirpath in dirpaths:
+        stack = [dirpath]
+        while stack:
             try:
-                char = chr(int(root, 16)) #root is in hex base
-            except:
+                with os.scandir(stack.pop()) as it:
+                    entries = sorted(it, key=lambda entry: entry.name)
+            except OSError as ex:
+                logging.warning('Cannot list %s: %s', ex.filename, ex.strerror)
                 continue
 
-        ascii_chrs.append(char)
+            subdirpaths = []
+            for entry in entries:
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirpaths.append(entry.path)
+                    elif entry.name.endswith(suffixes) and entry.is_file():
+                        yield entry.path
+                except OSError:
+                    continue
 
-    return str(''.join(ascii_chrs))
+            stack.extend(reversed(subdirpaths))
 
-def get_release(discid):
+def get_release(discid, cache=None, offline=False, backend=None):
     """
     Returns a Musicbrainz disc object from the current CD.
-    
+
+    :arg cache: cache of the responses of the web service
+    :type cache: :class:`musictools.musicbrainz.ReleaseCache`
+    :arg offline: if ``True``, only the cached responses are used
+    :arg backend: backend used instead of the Musicbrainz web service
+        (see :mod:`musictools.musicbrainz`)
     """
+    if backend is None:
+        backend = musicbrainzngs
+
     # Query for all discs matching the given DiscID.
-    result = musicbrainzngs.get_releases_by_discid(discid)
+    result = cached_call(cache, 'disc-' + discid,
+                         lambda: backend.get_releases_by_discid(discid),
+                         offline)
     releases = result['disc']['release-list']
 
     logging.debug("Found %i releases", len(releases))
@@ -75,8 +178,9 @@ def get_release(discid):
 
     # The returned release object only contains title and artist, but no tracks.
     # Query the web service once again to get all data we need.
-    includes = ['artists', 'recordings', 'discids']
-    result = musicbrainzngs.get_release_by_id(release_id, includes=includes)
+    result = cached_call(cache, release_key(release_id),
+                         lambda: backend.get_release_by_id(release_id, includes=RELEASE_INCLUDES),
+                         offline)
 
     return result['release']
 
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+================================================================================
+:mod:`dedupe` -- Find duplicate songs
+================================================================================
+
+.. module:: dedupe
+   :synopsis: Find duplicate songs
+
+Lists the mp3/ogg files with the same audio, whatever their tags and paths.
+With an index, the hashes of the audio are stored with the tags of the
+files, so that a later run only reads the files that are new or changed.
+
+"""
+
+# Script information for the file.
+__author__ = "Philippe T. Pinard"
+__email__ = "philippe.pinard@gmail.com"
+__version__ = "0.1"
+__copyright__ = "Copyright (c) 2013 Philippe T. Pinard"
+__license__ = "GPL v3"
+
+# Standard library modules.
+import time
+import logging
+import argparse
+
+# Third party modules.
+
+# Local modules.
+from musictools.song import Song, EXTENSION_MP3, EXTENSION_OGG
+from musictools.library import Library
+from musictools.utils import iter_files
+from musictools.dedupe import find_duplicates, DEFAULT_MAX_WORKERS
+from musictools.stats import create_stats, FORMAT_JSON, FORMAT_PROMETHEUS
+
+# Globals and constants variables.
+
+def _index(filepaths, library, stats):
+    # Hashes are only stored for indexed files
+    for filepath in filepaths:
+        try:
+            with stats.phase('index'):
+                Song.from_index(library, filepath)
+        except Exception as ex:
+            logging.warning('Cannot read %s: %s', filepath, ex)
+    library.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description='Find mp3/ogg files with the same audio')
+    parser.add_argument('-j', '--jobs', type=int, default=DEFAULT_MAX_WORKERS,
+                        help='Number of threads reading the files')
+    parser.add_argument('--index',
+                        help='Index file of the tags and hashes, to only read new or modified files')
+    parser.add_argument('--stats',
+                        help='File where to write timings and counters of the run (- for standard output)')
+    parser.add_argument('--stats-format', choices=[FORMAT_JSON, FORMAT_PROMETHEUS],
+                        default=FORMAT_JSON, help='Format of the statistics')
+    parser.add_argument('dir', nargs='+', help='Directory containing mp3/ogg files')
+
+    args = parser.parse_args()
+
+    stats = create_stats(args.stats is not None, 'musictools_dedupe')
+    start = time.perf_counter()
+
+    filepaths = list(stats.iterate('walk', iter_files(args.dir, [EXTENSION_MP3, EXTENSION_OGG])))
+
+    library = None
+    if args.index:
+        library = Library(args.index)
+
+    try:
+        if library is not None:
+            _index(filepaths, library, stats)
+        groups = find_duplicates(filepaths, library, args.jobs, stats)
+    finally:
+        if library is not None:
+            library.close()
+
+    for group in groups:
+        for filepath in group:
+            print(filepath)
+        print()
+
+    print('{} duplicate(s) in {} group(s)'.format(
+          sum(len(group) - 1 for group in groups), len(groups)))
+
+    if stats.enabled:
+        stats.observe('total', time.perf_counter() - start)
+        stats.dump(args.stats, args.stats_format)
+
+if __name__ == '__main__':
+    main()
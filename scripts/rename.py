@@ -2,40 +2,386 @@
 
 # Standard library modules.
 import os
-import glob
+import time
 import argparse
-import shutil
+import functools
+import collections
+from concurrent.futures import ProcessPoolExecutor, Future
 
 # Third party modules.
 
 # Local modules.
-from musictools.song import Song
+from musictools.song import Song, EXTENSION_MP3, EXTENSION_OGG
+from musictools.library import Library
+from musictools.utils import iter_files
+from musictools.renamer import RenamePlan, execute
+from musictools.mover import Mover, DEFAULT_MAX_WORKERS
+from musictools.journal import Journal, read_journal, reconcile
+from musictools.inotify import FileWatcher, DEFAULT_DELAY
+from musictools.stats import create_stats, FORMAT_JSON, FORMAT_PROMETHEUS
 
 # Globals and constants variables.
 
+def _describe(filepath, song, timings=None, keep_song=True):
+    start = time.perf_counter()
+    dirname, filename = song.formatted_dirname, song.formatted_filename
+    if timings is not None:
+        timings['slug'] = time.perf_counter() - start
+    if not keep_song:
+        song = None
+    return filepath, song, dirname, filename, None, timings
+
+def _parse(filepath, record=False, lazy=True, keep_song=False):
+    """
+    Reads the tags of a file and returns its new relative directory and
+    filename.
+    Returns a tuple ``(filepath, song, dirname, filename, error, timings)``
+    where *error* is ``None`` on success and a message otherwise, so that a
+    single bad file does not abort the whole run.
+    With *lazy*, only the tags needed for the names are decoded.
+    The song is only returned if *keep_song* is ``True`` (it is ``None``
+    otherwise), as it is sent back from the worker processes.
+    If *record* is ``True``, *timings* is a :class:`dict` with the time
+    taken to read the tags (``parse``) and to format the names (``slug``),
+    and the number of missing tags (``warnings``); otherwise it is ``None``.
+    """
+    try:
+        if not record:
+            return _describe(filepath, Song(filepath, lazy=lazy), keep_song=keep_song)
+
+        timings = {}
+        start = time.perf_counter()
+        song = Song(filepath, lazy=lazy)
+        # Decode the tags of the names
+        song.artists, song.albumtitle, song.title, song.tracknumber, song.discnumber
+        timings['parse'] = time.perf_counter() - start
+        timings['warnings'] = len(song.diagnostics)
+
+        return _describe(filepath, song, timings, keep_song)
+    except Exception as ex:
+        return filepath, None, None, None, '{}: {}'.format(type(ex).__name__, ex), None
+
+def _results(filepaths, library, executor, window, stats):
+    """
+    Yields the result of :func:`_parse` for each file, in input order.
+    Files up to date in the *library* index are not read again.
+    At most *window* files are being read ahead of the one yielded, so
+    that *filepaths* is consumed lazily.
+    """
+    # The songs added to the index are read completely and kept for it; the
+    # songs read from the index are not returned
+    parse = functools.partial(_parse, record=stats.enabled, lazy=library is None,
+                              keep_song=library is not None)
+
+    pending = collections.deque()
+    for filepath in filepaths:
+        song = None
+        if library is not None:
+            with stats.phase('index_lookup'):
+                song = Song.from_index(library, filepath, read=False)
+
+        if song is not None:
+            stats.count('cached_files')
+            pending.append(_describe(filepath, song, {} if stats.enabled else None,
+                                     keep_song=False))
+        elif executor is not None:
+            pending.append(executor.submit(parse, filepath))
+        else:
+            pending.append(parse(filepath))
+
+        while len(pending) > window:
+            yield _result(pending.popleft(), stats)
+
+    while pending:
+        yield _result(pending.popleft(), stats)
+
+def _result(result, stats):
+    if isinstance(result, Future):
+        result = result.result()
+
+    timings = result[-1]
+    if timings:
+        for phase in ('parse', 'slug'):
+            if phase in timings:
+                stats.observe(phase, timings[phase])
+        stats.count('warnings', timings.get('warnings', 0))
+
+    return result
+
+def _report(plan, stats):
+    for collision in plan.collisions:
+        print('Collision ({}): {} -> {}'.format(collision.reason,
+                                                ', '.join(collision.srcs),
+                                                collision.dst))
+    stats.count('collisions', sum(len(collision.srcs) for collision in plan.collisions))
+    stats.count('noops', len(plan.noops))
+
+def _plan(filepaths, args, library, stats):
+    """
+    Reads the tags of the files and returns the plan of the moves and the
+    number of files that could not be read.
+    The songs read from the files are added to the *library* index at their
+    current path, whether they are moved or not (already at their
+    destination, collision); the index is updated as they are moved.
+    """
+    executor = None
+    window = 0
+    if args.jobs > 1:
+        executor = ProcessPoolExecutor(max_workers=args.jobs)
+        window = args.jobs * 4
+
+    errors = 0
+    plan = RenamePlan()
+    try:
+        # Results come back in input order, so the plan is deterministic
+        # regardless of the number of workers.
+        for filepath, song, dirname, filename, error, _timings in \
+                _results(filepaths, library, executor, window, stats):
+            if error is not None:
+                print('Error: {}: {}'.format(filepath, error))
+                errors += 1
+                stats.count('errors')
+                continue
+
+            if song is not None:
+                with stats.phase('index_update'):
+                    library.add(song)
+
+            plan.add(filepath, os.path.join(args.output, dirname, filename))
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    with stats.phase('plan'):
+        plan.close()
+
+    return plan, errors
+
+def _execute(plan, args, library, journal, stats, rollback=False):
+    """
+    Runs the moves of the *plan* and returns the number of failed moves.
+    Each move is recorded in the *journal* once done.
+    """
+    errors = 0
+    with Mover(max_workers=args.copy_jobs, stats=stats) as mover:
+        for move, error in execute(plan, mover, stats):
+            if error is not None:
+                print('Error: {}: {}'.format(move.src, error))
+                errors += 1
+                stats.count('errors')
+                continue
+
+            print('{} -> {}'.format(move.src, move.dst))
+            stats.count('files')
+            if stats.enabled:
+                stats.count('bytes', os.path.getsize(move.dst))
+
+            if journal is not None:
+                if rollback: # planned in the opposite direction
+                    journal.undone(move.dst, move.src)
+                else:
+                    journal.done(move.src, move.dst)
+
+            if library is not None:
+                with stats.phase('index_update'):
+                    library.move(move.src, move.dst)
+
+    return errors
+
+def _report_conflicts(conflicts, stats):
+    for src, dst in conflicts:
+        print('Conflict: {} and {} both exist, left unchanged'.format(src, dst))
+    stats.count('conflicts', len(conflicts))
+    return len(conflicts)
+
+def _resume(args, library, stats):
+    """
+    Runs the moves of the journal not done yet.
+    """
+    state = read_journal(args.journal)
+    if not state.planned:
+        print('The plan of the journal is incomplete: no file was moved, start a new run')
+        return 0
+    if state.ended:
+        print('The run of the journal is complete')
+        return 0
+
+    remaining, found, conflicts = reconcile(state)
+    errors = _report_conflicts(conflicts, stats)
+
+    plan = RenamePlan()
+    for src, dst in remaining:
+        plan.add(src, dst)
+    plan.close()
+    _report(plan, stats)
+
+    with Journal(args.journal, append=True) as journal:
+        for src, dst in found:
+            journal.done(src, dst)
+            if library is not None:
+                library.move(src, dst)
+
+        print('Resuming: {} move(s) done, {} left'.format(
+              len(state.moves) - len(remaining) - len(conflicts), len(plan.moves)))
+        errors += _execute(plan, args, library, journal, stats)
+        if not errors and not plan.collisions:
+            journal.end()
+
+    return errors
+
+def _rollback(args, library, stats):
+    """
+    Moves back the files moved by the run of the journal.
+    """
+    state = read_journal(args.journal)
+    # The sources left by an interrupted copy are the originals: keep them
+    _remaining, found, conflicts = reconcile(state, finish=False)
+    errors = _report_conflicts(conflicts, stats)
+    done = set(state.done) | set(found)
+
+    plan = RenamePlan()
+    for src, dst in reversed(state.moves):
+        if (src, dst) in done and (src, dst) not in state.undone:
+            plan.add(dst, src)
+    plan.close()
+    _report(plan, stats)
+
+    with Journal(args.journal, append=True) as journal:
+        errors += _execute(plan, args, library, journal, stats, rollback=True)
+        if not errors and not plan.collisions:
+            journal.end()
+
+    return errors
+
+def _watch(watcher, args, library, stats):
+    """
+    Renames the new files in the watched directories until interrupted.
+    Returns the number of files that could not be renamed.
+    """
+    extensions = ['.' + EXTENSION_MP3, '.' + EXTENSION_OGG]
+
+    print('Watching {} (Ctrl+C to stop)'.format(', '.join(args.dir)))
+    errors = 0
+    with watcher:
+        try:
+            while True:
+                filepaths = [filepath for filepath in watcher.poll()
+                             if os.path.splitext(filepath)[1] in extensions]
+                if not filepaths:
+                    continue
+
+                plan, failures = _plan(filepaths, args, library, stats)
+                _report(plan, stats)
+                errors += failures + _execute(plan, args, library, None, stats)
+                if library is not None:
+                    library.commit()
+        except KeyboardInterrupt:
+            pass
+
+    return errors
+
 def main():
     parser = argparse.ArgumentParser(description='Rename mp3/ogg files')
-    parser.add_argument('-o', '--output', required=True,
+    parser.add_argument('-o', '--output',
                         help='Output directory')
-    parser.add_argument('dir', nargs='+', help='Directory containing mp3/ogg files')
+    parser.add_argument('-j', '--jobs', type=int, default=1,
+                        help='Number of worker processes used to read tags')
+    parser.add_argument('--copy-jobs', type=int, default=DEFAULT_MAX_WORKERS,
+                        help='Number of files copied concurrently when the output directory is on another file system')
+    parser.add_argument('--index',
+                        help='Index file of the tags, to only read new or modified files')
+    parser.add_argument('-n', '--dry-run', action='store_true',
+                        help='Print the moves without doing them')
+    parser.add_argument('--journal',
+                        help='Journal file of the moves, to resume or roll back an interrupted run')
+    parser.add_argument('--resume', action='store_true',
+                        help='Run the moves of the journal not done yet')
+    parser.add_argument('--rollback', action='store_true',
+                        help='Move back the files moved by the run of the journal')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running and rename new files as soon as they are written (Linux only)')
+    parser.add_argument('--watch-delay', type=float, default=DEFAULT_DELAY,
+                        help='Time (in seconds) without change after which a new file is renamed')
+    parser.add_argument('--stats',
+                        help='File where to write timings and counters of the run (- for standard output)')
+    parser.add_argument('--stats-format', choices=[FORMAT_JSON, FORMAT_PROMETHEUS],
+                        default=FORMAT_JSON, help='Format of the statistics')
+    parser.add_argument('dir', nargs='*', help='Directory containing mp3/ogg files')
 
     args = parser.parse_args()
 
-    outdirpath = args.output
+    if args.resume or args.rollback:
+        if not args.journal:
+            parser.error('--resume and --rollback require --journal')
+        if args.resume and args.rollback:
+            parser.error('--resume and --rollback are exclusive')
+    elif not args.output or not args.dir:
+        parser.error('the output directory and at least one directory are required')
+    elif args.watch and (args.dry_run or args.journal):
+        parser.error('--watch cannot be used with --dry-run or --journal')
+    elif args.journal and os.path.exists(args.journal) and not args.dry_run:
+        state = read_journal(args.journal)
+        if state.planned and not state.ended:
+            parser.error('the run of the journal is incomplete, use --resume or --rollback')
+
+    stats = create_stats(args.stats is not None, 'musictools_rename')
+    start = time.perf_counter()
+
+    library = None
+    if args.index:
+        library = Library(args.index)
+
+    errors = 0
+    plan = None
+    try:
+        if args.resume:
+            errors = _resume(args, library, stats)
+        elif args.rollback:
+            errors = _rollback(args, library, stats)
+        else:
+            if args.watch:
+                # Watch first, so that no file dropped during the first run
+                # is missed
+                try:
+                    watcher = FileWatcher(args.dir, args.watch_delay)
+                except OSError as ex:
+                    parser.error('cannot watch the directories: {}'.format(ex))
+
+            filepaths = stats.iterate('walk', iter_files(args.dir, [EXTENSION_MP3, EXTENSION_OGG]))
+            plan, errors = _plan(filepaths, args, library, stats)
+            _report(plan, stats)
 
-    for dirpath in args.dir:
-        filepaths = glob.glob(os.path.join(dirpath, '**', '*.mp3'), recursive=True)
-        filepaths += glob.glob(os.path.join(dirpath, '**', '*.ogg'), recursive=True)
+            if args.dry_run:
+                for move in plan.moves:
+                    print('{} -> {}'.format(move.src, move.dst))
+            elif args.journal:
+                with Journal(args.journal) as journal:
+                    journal.begin()
+                    journal.plan(plan.moves)
+                    failures = _execute(plan, args, library, journal, stats)
+                    if not failures: # otherwise left to --resume
+                        journal.end()
+                    errors += failures
+            else:
+                errors += _execute(plan, args, library, None, stats)
 
-        for filepath in filepaths:
-            song = Song(filepath)
+            if args.watch:
+                errors += _watch(watcher, args, library, stats)
+    finally:
+        if library is not None:
+            library.close()
 
-            newdirpath = os.path.join(outdirpath, song.formatted_dirname)
-            os.makedirs(newdirpath, exist_ok=True)
+    if errors:
+        print('{} file(s) could not be renamed'.format(errors))
+    if plan is not None and plan.collisions:
+        print('{} file(s) not renamed because of collisions'.format(
+              sum(len(collision.srcs) for collision in plan.collisions)))
+    if plan is not None and plan.noops:
+        print('{} file(s) already at their destination'.format(len(plan.noops)))
 
-            newfilepath = os.path.join(newdirpath, song.formatted_filename)
-            shutil.move(filepath, newfilepath)
-            print('{} -> {}'.format(filepath, newfilepath))
+    if stats.enabled:
+        stats.observe('total', time.perf_counter() - start)
+        stats.dump(args.stats, args.stats_format)
 
 if __name__ == '__main__':
     main()
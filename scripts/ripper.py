@@ -9,6 +9,17 @@
 
 .. inheritance-diagram:: ripper
 
+Tracks are extracted one after the other from the drive, while the encoding
+and tagging of the extracted tracks run in a pool of workers behind it.
+Unless the option ``keepWav`` is set, the output of cdda2wav is piped
+straight into ffmpeg and no intermediate WAV file is written.
+
+Several drives can rip at the same time (option ``--device``, repeated):
+each drive reads its disc id, looks up the release and extracts its tracks
+in its own thread, and logs its progress with its name as prefix. All the
+drives share one pool of encoders, which bounds the number of ffmpeg
+processes running at the same time to the number of encoders.
+
 """
 
 # Script information for the file.
@@ -21,167 +32,432 @@ __license__ = "GPL v3"
 # Standard library modules.
 import os
 import sys
-from subprocess import call
-import re
+import time
+import argparse
+from subprocess import call, Popen, PIPE
 import logging
+import threading
+import functools
 from configparser import ConfigParser
+from concurrent.futures import ThreadPoolExecutor, wait
 
 # Third party modules.
 import discid
+import musicbrainzngs
 
 # Local modules.
 from musictools.song import Song, Artist
-from musictools.utils import unicode_to_ascii, get_release
+from musictools.utils import slugify, get_release
+from musictools.musicbrainz import ReleaseCache
+from musictools.stats import create_stats, FORMAT_JSON, FORMAT_PROMETHEUS
 
 # Globals and constants variables.
 logging.getLogger().setLevel(logging.DEBUG)
 
-def _format(text):
-    text = unicode_to_ascii(text)
-    text = text.lower()
-    text = re.sub(r"[^a-z0-9()\-\[\]\s]", "", text)
-    text = re.sub(r'\W', '_', text)
-    text = re.sub('_+', '_', text)
-    return text
+class RipError(Exception):
+    pass
 
 def _filename(track_title, track_number, ext):
-    return "%i_%s.%s" % (track_number, _format(track_title), ext)
+    return "%i_%s.%s" % (track_number, slugify(track_title), ext)
 
 def _dirname(album_artist, album_title):
-    return os.path.join(_format(album_artist), _format(album_title))
-
-# Parsing configuration
-if hasattr(sys, "frozen") or hasattr(sys, "importers"):
-    main_dir = os.path.dirname(sys.executable)
-else:
-    main_dir = os.path.dirname(sys.argv[0])
-
-cfgpath = os.path.join(main_dir, 'ripper.cfg')
-if not os.path.exists(cfgpath):
-    print('Error: No ripper.cfg')
-    sys.exit(1)
-print('=' * 79)
-print('Parsing configuration file: %s ...' % cfgpath)
-
-parser = ConfigParser()
-parser.read(cfgpath)
-
-music_dir = parser.get('ripper', 'musicDir')
-cdda2wav_path = parser.get('ripper', 'cdda2wavPath')
-cdda2wav_args = []
-if parser.has_option('ripper', 'cdda2wavArgs'):
-    cdda2wav_args = parser.get('ripper', 'cdda2wavArgs').split()
-ffmpeg_path = parser.get('ripper', 'ffmpegPath')
-
-print('Music dir: %s' % music_dir)
-print('cdda2wav: %s' % cdda2wav_path)
-print('cdda2wav args: %s' % cdda2wav_args)
-print('ffmpeg: %s' % ffmpeg_path)
-
-# Retrieve information from Musicbrainz
-print('-' * 79)
-print('Searching Musicbrainz...')
-
-try:
-    disc_id = discid.read().id
-except Exception as ex:
-    print('Error while searching Musicbrainz: %s' % str(ex))
-    sys.exit(1)
-
-print('Disc id: %s' % disc_id)
-
-#call([internet_program_path, mbdisc.getSubmissionUrl(disc)])
-#sys.exit(1)
-try:
-    release = get_release(disc_id)
-except Exception as ex:
-    print(ex)
-    sys.exit(1)
-
-# Release information
-print('-' * 79)
-print('Release found')
-print(release.keys())
-
-album_title = release['title']
-print('Album title: %s' % album_title)
-
-album_artist = release['artist-credit-phrase']
-print('Album artist: %s' % album_artist)
-
-artists = []
-for artist in release['artist-credit']:
-    artists.append(Artist(name=artist['artist']['name']))
-
-year = release.get('date', 0)
-print('Album year: %s' % year)
-
-print('=' * 79)
-
-# Track offset for multiple CDs
-track_offset = 0
-tracks = []
-for medium in release['medium-list']:
-    disc_ids = [disc['id'] for disc in medium['disc-list']]
-    if disc_id in disc_ids:
-        tracks = medium['track-list']
-        break
-
-    track_offset += medium['track-count']
-
-if not tracks:
-    print('Cannot find track information')
-    sys.exit(1)
-
-print('Track offset: %i' % track_offset)
-
-# Rip tracks
-for track in tracks:
-    track_title = track['recording']['title']
-    track_position = int(track['position'])
-    track_number = track_offset + track_position
-    print('Ripping track %i - %s' % (track_number, track_title))
-
-    dirname = os.path.join(music_dir, _dirname(album_artist, album_title))
-    if not os.path.exists(dirname):
-        os.makedirs(dirname)
-
-    filename = _filename(track_title, track_number, 'wav')
-    wav_filepath = os.path.normpath(os.path.join(dirname, filename))
-
-    # cdda2wav
-    args = [cdda2wav_path] + cdda2wav_args + \
+    return os.path.join(slugify(album_artist), slugify(album_title))
+
+def _read_config(cfgpath=None):
+    if cfgpath is None:
+        if hasattr(sys, "frozen") or hasattr(sys, "importers"):
+            main_dir = os.path.dirname(sys.executable)
+        else:
+            main_dir = os.path.dirname(sys.argv[0])
+        cfgpath = os.path.join(main_dir, 'ripper.cfg')
+
+    if not os.path.exists(cfgpath):
+        print('Error: No configuration file (%s)' % cfgpath)
+        sys.exit(1)
+    print('=' * 79)
+    print('Parsing configuration file: %s ...' % cfgpath)
+
+    parser = ConfigParser()
+    parser.read(cfgpath)
+
+    config = {}
+    config['music_dir'] = parser.get('ripper', 'musicDir')
+    config['cdda2wav_path'] = parser.get('ripper', 'cdda2wavPath')
+    config['cdda2wav_args'] = []
+    if parser.has_option('ripper', 'cdda2wavArgs'):
+        config['cdda2wav_args'] = parser.get('ripper', 'cdda2wavArgs').split()
+    config['ffmpeg_path'] = parser.get('ripper', 'ffmpegPath')
+    config['encoders'] = os.cpu_count() or 1
+    if parser.get('ripper', 'encoders', fallback=''):
+        config['encoders'] = parser.getint('ripper', 'encoders')
+    config['keep_wav'] = parser.getboolean('ripper', 'keepWav', fallback=False)
+    config['cache_dir'] = parser.get('ripper', 'cacheDir', fallback='')
+    config['offline'] = parser.getboolean('ripper', 'offline', fallback=False)
+    config['musicbrainz_host'] = parser.get('ripper', 'musicbrainzHost', fallback='')
+
+    print('Music dir: %s' % config['music_dir'])
+    print('cdda2wav: %s' % config['cdda2wav_path'])
+    print('cdda2wav args: %s' % config['cdda2wav_args'])
+    print('ffmpeg: %s' % config['ffmpeg_path'])
+    print('Encoders: %i' % config['encoders'])
+    print('Keep WAV: %s' % config['keep_wav'])
+    print('Cache dir: %s' % config['cache_dir'])
+    print('Offline: %s' % config['offline'])
+    if config['musicbrainz_host']:
+        print('Musicbrainz host: %s' % config['musicbrainz_host'])
+
+    return config
+
+class Drive(object):
+
+    def __init__(self, device=None, log_dir=None):
+        """
+        CD drive *device* (the default drive if ``None``) and the logger of
+        its progress, whose messages are prefixed with the name of the
+        drive. If *log_dir* is given, the messages and the output of
+        cdda2wav and ffmpeg are also written to the file ``<name>.log`` in
+        it.
+        """
+        self.device = device
+        self.name = os.path.basename(device or discid.get_default_device())
+
+        self.log = logging.getLogger('ripper.' + self.name)
+        self.log.setLevel(logging.DEBUG)
+        self.log.propagate = False
+        for handler in list(self.log.handlers):
+            self.log.removeHandler(handler)
+
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setLevel(logging.INFO)
+        handler.setFormatter(logging.Formatter('[%s] %%(message)s' % self.name))
+        self.log.addHandler(handler)
+
+        self.output = None # output of the subprocesses, inherited if None
+        if log_dir:
+            filepath = os.path.join(log_dir, self.name + '.log')
+            self.output = open(filepath, 'a')
+            handler = logging.FileHandler(filepath)
+            handler.setFormatter(logging.Formatter('%(asctime)s %(message)s'))
+            self.log.addHandler(handler)
+
+    def close(self):
+        for handler in list(self.log.handlers):
+            handler.close()
+            self.log.removeHandler(handler)
+        if self.output is not None:
+            self.output.close()
+
+class EncoderPool(object):
+
+    def __init__(self, max_workers):
+        """
+        Encoders shared by all the drives: WAV files are encoded and tracks
+        tagged in a pool of *max_workers* threads, and at most
+        *max_workers* ffmpeg processes run at the same time, including the
+        ones encoding the output of cdda2wav through a pipe.
+        """
+        self.max_workers = max_workers
+        self.slots = threading.BoundedSemaphore(max_workers)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def submit(self, function, *args):
+        return self._executor.submit(function, *args)
+
+    def shutdown(self):
+        self._executor.shutdown()
+
+def _cdda2wav_args(config, drive, track_position, wav_filepath):
+    device = ['-D', drive.device] if drive.device else []
+    return [config['cdda2wav_path']] + device + config['cdda2wav_args'] + \
             ['-s', '-paranoia', '-no-infofile', '-v', 'summary', '-t', str(track_position), wav_filepath]
-    logging.debug(' '.join(args))
-
-    retcode = call(args)
-    logging.debug('cdda2wav return code: %i', retcode)
-    if retcode != 0:
-        continue
 
-    # ffmpeg
-    mp3_filepath = os.path.splitext(wav_filepath)[0] + '.mp3'
-    args = [ffmpeg_path, '-i', wav_filepath, '-vn', '-ar', '44100', '-ac', '2',
+def _ffmpeg_args(config, wav_filepath, mp3_filepath):
+    return [config['ffmpeg_path'], '-i', wav_filepath, '-vn', '-ar', '44100', '-ac', '2',
             '-ab', '192', '-f', 'mp3', '-y', mp3_filepath]
-    logging.debug(' '.join(args))
 
-    retcode = call(args)
-    logging.debug('ffmpeg return code: %i', retcode)
-    if retcode != 0:
-        continue
-
-    # add tags
-    song = Song(mp3_filepath)
+def _extract(config, drive, track_position, wav_filepath):
+    args = _cdda2wav_args(config, drive, track_position, wav_filepath)
+    drive.log.debug(' '.join(args))
 
-    song.artists.extend(artists)
-    song.albumtitle = album_title
-    song.year = year
-    song.title = track_title
-    song.tracknumber = track_number
+    retcode = call(args, stdout=drive.output, stderr=drive.output)
+    drive.log.debug('cdda2wav return code: %i', retcode)
+    if retcode != 0:
+        raise RipError('cdda2wav failed with return code %i' % retcode)
 
-    song.save()
+def _encode(config, drive, encoders, wav_filepath, mp3_filepath):
+    args = _ffmpeg_args(config, wav_filepath, mp3_filepath)
+    drive.log.debug(' '.join(args))
 
-    # remove wav
-    os.remove(wav_filepath)
+    with encoders.slots:
+        retcode = call(args, stdout=drive.output, stderr=drive.output)
+    drive.log.debug('ffmpeg return code: %i', retcode)
+    if retcode != 0:
+        raise RipError('ffmpeg failed with return code %i' % retcode)
+
+def _extract_and_encode(config, drive, encoders, track_position, mp3_filepath):
+    """
+    Pipes the audio extracted by cdda2wav straight into ffmpeg, without
+    writing an intermediate WAV file. The extraction waits for a free
+    encoder.
+    """
+    with encoders.slots:
+        _pipe(config, drive, track_position, mp3_filepath)
+
+def _pipe(config, drive, track_position, mp3_filepath):
+    args1 = _cdda2wav_args(config, drive, track_position, '-')
+    args2 = _ffmpeg_args(config, '-', mp3_filepath)
+    drive.log.debug('%s | %s', ' '.join(args1), ' '.join(args2))
+
+    cdda2wav = Popen(args1, stdout=PIPE, stderr=drive.output)
+    try:
+        ffmpeg = Popen(args2, stdin=cdda2wav.stdout, stdout=drive.output,
+                       stderr=drive.output)
+    except:
+        cdda2wav.kill()
+        cdda2wav.wait()
+        raise
+    finally:
+        # Only ffmpeg holds the read end, so that cdda2wav gets a broken pipe
+        # if ffmpeg exits early.
+        cdda2wav.stdout.close()
+
+    retcode2 = ffmpeg.wait()
+    retcode1 = cdda2wav.wait()
+    drive.log.debug('cdda2wav return code: %i', retcode1)
+    drive.log.debug('ffmpeg return code: %i', retcode2)
+
+    if retcode1 != 0 or retcode2 != 0:
+        if os.path.exists(mp3_filepath): # incomplete
+            os.remove(mp3_filepath)
+    if retcode2 != 0:
+        raise RipError('ffmpeg failed with return code %i' % retcode2)
+    if retcode1 != 0:
+        raise RipError('cdda2wav failed with return code %i' % retcode1)
+
+def _tag(stats, drive, mp3_filepath, artists, album_title, year, track_title, track_number):
+    with stats.phase('tag'):
+        song = Song(mp3_filepath)
+
+        song.artists.extend(artists)
+        song.albumtitle = album_title
+        song.year = year
+        song.title = track_title
+        song.tracknumber = track_number
+
+        song.save()
+
+    stats.count('tracks')
+    if stats.enabled:
+        stats.count('bytes', os.path.getsize(mp3_filepath))
+
+    drive.log.info('Track %i - %s done', track_number, track_title)
+
+def _encode_and_tag(config, stats, drive, encoders, wav_filepath, mp3_filepath, *tags):
+    with stats.phase('encode'):
+        _encode(config, drive, encoders, wav_filepath, mp3_filepath)
+    _tag(stats, drive, mp3_filepath, *tags)
+
+def _rip(config, drive, encoders, cache, stats):
+    """
+    Rips the disc in *drive*. Returns the number of tracks of the disc and
+    the list of the failed tracks ``(track_number, exception)``.
+
+    :raise RipError: if the release of the disc cannot be found
+    """
+    log = drive.log
+
+    # Retrieve information from Musicbrainz
+    log.info('-' * 79)
+    log.info('Searching Musicbrainz...')
+
+    try:
+        with stats.phase('discid'):
+            disc_id = discid.read(drive.device).id
+    except Exception as ex:
+        raise RipError('Error while reading the disc: %s' % ex)
+
+    log.info('Disc id: %s', disc_id)
+
+    #call([internet_program_path, mbdisc.getSubmissionUrl(disc)])
+    try:
+        with stats.phase('musicbrainz'):
+            release = get_release(disc_id, cache=cache, offline=config['offline'])
+    except Exception as ex:
+        raise RipError('Error while searching Musicbrainz: %s' % ex)
+
+    # Release information
+    log.info('-' * 79)
+    log.info('Release found')
+    log.debug('%s', list(release.keys()))
+
+    album_title = release['title']
+    log.info('Album title: %s', album_title)
+
+    album_artist = release['artist-credit-phrase']
+    log.info('Album artist: %s', album_artist)
+
+    artists = []
+    for artist in release['artist-credit']:
+        artists.append(Artist(name=artist['artist']['name']))
+
+    year = release.get('date', 0)
+    log.info('Album year: %s', year)
+
+    log.info('=' * 79)
+
+    # Track offset for multiple CDs
+    track_offset = 0
+    tracks = []
+    for medium in release['medium-list']:
+        disc_ids = [disc['id'] for disc in medium['disc-list']]
+        if disc_id in disc_ids:
+            tracks = medium['track-list']
+            break
+
+        track_offset += medium['track-count']
+
+    if not tracks:
+        raise RipError('Cannot find track information')
+
+    log.info('Track offset: %i', track_offset)
+
+    # The discs of a release ripped in several drives share the directory
+    dirname = os.path.join(config['music_dir'], _dirname(album_artist, album_title))
+    os.makedirs(dirname, exist_ok=True)
+
+    # Rip tracks: the drive extracts continuously while the extracted tracks
+    # are encoded and tagged by the workers. The number of extracted tracks
+    # waiting to be encoded is bounded to limit the scratch space.
+    failures = []
+    slots = threading.BoundedSemaphore(encoders.max_workers * 2)
+    futures = []
+
+    def _done(track_number, future):
+        slots.release()
+        ex = future.exception()
+        if ex is not None:
+            log.error('Error: track %i: %s', track_number, ex)
+            stats.count('failures')
+
+    for track in tracks:
+        track_title = track['recording']['title']
+        track_position = int(track['position'])
+        track_number = track_offset + track_position
+        log.info('Ripping track %i - %s', track_number, track_title)
+
+        filename = _filename(track_title, track_number, 'mp3')
+        mp3_filepath = os.path.normpath(os.path.join(dirname, filename))
+        wav_filepath = os.path.splitext(mp3_filepath)[0] + '.wav'
+        tags = (artists, album_title, year, track_title, track_number)
+
+        slots.acquire()
+        try:
+            if config['keep_wav']:
+                with stats.phase('extract'):
+                    _extract(config, drive, track_position, wav_filepath)
+            else:
+                # cdda2wav and ffmpeg run concurrently through a pipe
+                with stats.phase('extract_encode'):
+                    _extract_and_encode(config, drive, encoders, track_position,
+                                        mp3_filepath)
+        except Exception as ex:
+            slots.release()
+            log.error('Error: track %i: %s', track_number, ex)
+            failures.append((track_number, ex))
+            stats.count('failures')
+            continue
+
+        if config['keep_wav']:
+            future = encoders.submit(_encode_and_tag, config, stats, drive, encoders,
+                                     wav_filepath, mp3_filepath, *tags)
+        else:
+            future = encoders.submit(_tag, stats, drive, mp3_filepath, *tags)
+        future.add_done_callback(functools.partial(_done, track_number))
+        futures.append((track_number, future))
+
+    # The pool is shared: only wait for the tracks of this disc
+    wait([future for _track_number, future in futures])
+    for track_number, future in futures:
+        if future.exception() is not None:
+            failures.append((track_number, future.exception()))
+    stats.count('discs')
+
+    return len(tracks), failures
+
+def _rip_drive(config, drive, encoders, cache, stats):
+    # Errors of a drive do not stop the others
+    try:
+        return _rip(config, drive, encoders, cache, stats)
+    except Exception as ex:
+        drive.log.error('%s', ex)
+        stats.count('failures')
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Rip CDs')
+    parser.add_argument('-d', '--device', action='append',
+                        help='CD drive to rip (default: the default drive); repeat the option to rip several drives at the same time')
+    parser.add_argument('-c', '--config',
+                        help='Configuration file (default: ripper.cfg next to the script)')
+    parser.add_argument('--log-dir',
+                        help='Directory where to write the log of each drive, including the output of cdda2wav and ffmpeg')
+    parser.add_argument('--stats',
+                        help='File where to write timings and counters of the run (- for standard output)')
+    parser.add_argument('--stats-format', choices=[FORMAT_JSON, FORMAT_PROMETHEUS],
+                        default=FORMAT_JSON, help='Format of the statistics')
+
+    args = parser.parse_args()
+
+    stats = create_stats(args.stats is not None, 'musictools_ripper')
+    start = time.perf_counter()
+
+    config = _read_config(args.config)
+
+    cache = None
+    if config['cache_dir']:
+        cache = ReleaseCache(config['cache_dir'])
+    if config['musicbrainz_host']:
+        musicbrainzngs.set_hostname(config['musicbrainz_host'])
+
+    if args.log_dir:
+        os.makedirs(args.log_dir, exist_ok=True)
+    drives = [Drive(device, args.log_dir) for device in (args.device or [None])]
+
+    # One thread per drive; the encoders are shared by all drives
+    encoders = EncoderPool(config['encoders'])
+    try:
+        with ThreadPoolExecutor(max_workers=len(drives)) as executor:
+            futures = [executor.submit(_rip_drive, config, drive, encoders, cache, stats)
+                       for drive in drives]
+            results = [future.result() for future in futures]
+    finally:
+        encoders.shutdown()
+        for drive in drives:
+            drive.close()
 
     print('-' * 79)
+    if stats.enabled:
+        stats.observe('total', time.perf_counter() - start)
+        stats.dump(args.stats, args.stats_format)
+
+    success = True
+    for drive, result in zip(drives, results):
+        if result is None:
+            print('[%s] Disc not ripped' % drive.name)
+            success = False
+            continue
+
+        count, failures = result
+        if failures:
+            print('[%s] %i track(s) failed: %s' % \
+                  (drive.name, len(failures),
+                   ', '.join(str(number) for number, _ex in sorted(failures))))
+            success = False
+        else:
+            print('[%s] All %i tracks ripped' % (drive.name, count))
+
+    if not success:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+#!/usr/bin/env python
+"""
+================================================================================
+:mod:`search` -- Search songs by artist, album or title
+================================================================================
+
+.. module:: search
+   :synopsis: Search songs by artist, album or title
+
+Builds the search index of the mp3/ogg files of directories, then finds the
+songs matching all the words of a query. Words match the artists, album
+titles and titles starting with them, ignoring case, accents and
+punctuation.
+
+"""
+
+# Script information for the file.
+__author__ = "Philippe T. Pinard"
+__email__ = "philippe.pinard@gmail.com"
+__version__ = "0.1"
+__copyright__ = "Copyright (c) 2013 Philippe T. Pinard"
+__license__ = "GPL v3"
+
+# Standard library modules.
+import logging
+import argparse
+
+# Third party modules.
+
+# Local modules.
+from musictools.song import Song, EXTENSION_MP3, EXTENSION_OGG
+from musictools.library import Library
+from musictools.utils import iter_files
+from musictools.search import SearchIndexBuilder, SearchIndex
+
+# Globals and constants variables.
+
+def _songs(dirpaths, library):
+    if library is not None:
+        for song in library.scan(dirpaths):
+            yield song
+        return
+
+    for filepath in iter_files(dirpaths, [EXTENSION_MP3, EXTENSION_OGG]):
+        try:
+            yield Song(filepath, lazy=True)
+        except Exception as ex:
+            logging.warning('Cannot read %s: %s', filepath, ex)
+
+def _build(args):
+    library = None
+    if args.index:
+        library = Library(args.index)
+
+    builder = SearchIndexBuilder()
+    try:
+        for song in _songs(args.build, library):
+            try:
+                builder.add(song)
+            except Exception as ex:
+                logging.warning('Cannot read %s: %s', song.filepath, ex)
+    finally:
+        if library is not None:
+            library.close()
+
+    builder.save(args.search_index)
+    print('{} song(s) indexed'.format(len(builder)))
+
+def main():
+    parser = argparse.ArgumentParser(description='Search mp3/ogg files by artist, album or title')
+    parser.add_argument('--build', action='append', metavar='DIR',
+                        help='Build the search index of the files of the directory (may be repeated)')
+    parser.add_argument('--index',
+                        help='Index file of the tags, to only read new or modified files when building')
+    parser.add_argument('--fuzzy', action='store_true',
+                        help='Also match words with one typo')
+    parser.add_argument('--exact', action='store_true',
+                        help='Only match whole words')
+    parser.add_argument('-n', '--limit', type=int,
+                        help='Maximum number of songs listed')
+    parser.add_argument('search_index', help='Search index file')
+    parser.add_argument('query', nargs='*', help='Words to search')
+
+    args = parser.parse_intermixed_args()
+    if not args.build and not args.query:
+        parser.error('a query or --build is required')
+
+    if args.build:
+        _build(args)
+
+    if args.query:
+        with SearchIndex(args.search_index) as index:
+            filepaths = index.search(' '.join(args.query), prefix=not args.exact,
+                                     fuzzy=args.fuzzy, limit=args.limit)
+        for filepath in filepaths:
+            print(filepath)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+"""
+================================================================================
+:mod:`test_rename` -- Unit tests for the script :mod:`rename`.
+================================================================================
+
+"""
+
+# Standard library modules.
+import unittest
+import logging
+import shutil
+import tempfile
+import warnings
+import io
+import os
+import sys
+from unittest import mock
+
+# Third party modules.
+
+# Local modules.
+import rename
+from musictools.library import Library
+
+# Globals and constants variables.
+
+class TestRename(unittest.TestCase):
+
+    def setUp(self):
+        unittest.TestCase.setUp(self)
+        warnings.simplefilter('ignore')
+
+        folderpath = os.path.join(os.path.dirname(__file__), '..', 'musictools', 'testData')
+        self.tmpdir = tempfile.mkdtemp()
+        self.indir = os.path.join(self.tmpdir, 'in')
+        self.outdir = os.path.join(self.tmpdir, 'out')
+        self.index = os.path.join(self.tmpdir, 'index.db')
+        os.makedirs(self.indir)
+        for filename in ['song.mp3', 'song3.ogg', 'song3_1.ogg']:
+            shutil.copy(os.path.join(folderpath, filename), self.indir)
+
+    def tearDown(self):
+        unittest.TestCase.tearDown(self)
+        shutil.rmtree(self.tmpdir, ignore_errors=True)
+        warnings.resetwarnings()
+
+    def _run(self, *args):
+        argv = ['rename.py', '-o', self.outdir] + list(args)
+        with mock.patch.object(sys, 'argv', argv), \
+                mock.patch.object(sys, 'stdout', io.StringIO()) as stdout:
+            rename.main()
+        return stdout.getvalue()
+
+    def _indexed(self):
+        with Library(self.index) as library:
+            return sorted(song.filepath for song in library)
+
+    def testindex_moved(self):
+        self._run('--index', self.index, self.indir)
+
+        filepaths = sorted(os.path.join(dirpath, filename)
+                           for dirpath, _dirnames, filenames in os.walk(self.outdir)
+                           for filename in filenames)
+        self.assertEqual(3, len(filepaths))
+        self.assertEqual(filepaths, self._indexed())
+
+    def testindex_noops(self):
+        # Organized tree, without index
+        self._run(self.indir)
+        self.assertFalse(os.path.exists(self.index))
+
+        # The files already at their destination are indexed...
+        output = self._run('--index', self.index, self.outdir)
+        self.assertIn('3 file(s) already at their destination', output)
+        self.assertEqual(3, len(self._indexed()))
+
+        # ... and not read again
+        with mock.patch.object(rename, '_parse', side_effect=AssertionError):
+            output = self._run('--index', self.index, self.outdir)
+        self.assertIn('3 file(s) already at their destination', output)
+
+    def testindex_collisions(self):
+        shutil.copy(os.path.join(self.indir, 'song.mp3'),
+                    os.path.join(self.indir, 'copy.mp3'))
+
+        output = self._run('--index', self.index, self.indir)
+        self.assertIn('2 file(s) not renamed because of collisions', output)
+        self.assertEqual(4, len(self._indexed()))
+
+if __name__ == '__main__': #pragma: no cover
+    logging.getLogger().setLevel(logging.DEBUG)
+    unittest.main()
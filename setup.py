@@ -39,6 +39,7 @@ setup(name="musictools",
 
       setup_requires=[],
       install_requires=['mutagen', 'musicbrainzngs', 'discid'],
+      extras_require={'analysis': ['numpy', 'pyarrow']},
 
       entry_points=entry_points,
 )